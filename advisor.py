@@ -0,0 +1,226 @@
+# ========================================================================
+# Description: Optimization advisor for OR-of-equality chains
+#
+#              OR(LEFT([@SoldTo],6)="219246",LEFT([@SoldTo],6)="249946",...)
+#              evaluates LEFT([@SoldTo],6) once per comparison for every
+#              row.  Comparing the expression once against an array
+#              constant gives the same result (errors and case-insensitive
+#              text comparison included):
+#
+#                  OR(e=c1,e=c2,...)   ->  OR(e={c1,c2,...})
+#                  AND(e<>c1,e<>c2,...) ->  AND(NOT(OR(e={c1,c2,...})))
+#
+#              as long as e is one value: a single cell, [@Column], or an
+#              expression over such values.  Over a range (A1:A9,
+#              T[Column], A:A, 1:1, a defined name) e=c1 is an array
+#              already, and e={c1,c2} would pair it with the constants
+#              instead of testing each against all of them.
+#
+#              Function calls that are still evaluated more than once
+#              after the rewrite are reported as LET candidates.
+#              Formulas with an empty argument (IF(c,,x)) get no advice.
+#
+#       Usage: python advisor.py <name>_raw.txt [--min-terms N]
+# ========================================================================
+import collections
+import sys
+
+import structref
+from specialize import has_empty_argument
+from tokenizer import FunctionNode, OperatorNode, Token, XlsParser, get_ast, walk_ast
+
+Advice = collections.namedtuple('Advice', 'kind before after terms note')
+
+# functions whose result may differ between two evaluations in the same recalculation
+VOLATILE = ('RAND', 'RANDBETWEEN', 'NOW', 'TODAY', 'OFFSET', 'INDIRECT', 'CELL', 'INFO')
+
+# beyond this many constants a lookup table is easier to maintain than an array constant
+LOOKUP_TABLE_TERMS = 10
+
+# one value whatever their arguments
+_REDUCING = ('SUM', 'SUMPRODUCT', 'PRODUCT', 'COUNT', 'COUNTA', 'COUNTBLANK', 'AVERAGE', 'MIN', 'MAX', 'AND', 'OR',
+	'ROWS', 'COLUMNS')
+
+# one value when their first argument is one: VLOOKUP(value,table,...)
+_LOOKUPS = ('VLOOKUP', 'HLOOKUP', 'MATCH')
+
+
+def _constant(node):
+	# Emitted text of a literal operand (text, number, logical, negative number), or None
+	t = node.token
+	if t.ttype == 'operand' and t.tsubtype in ('text', 'number', 'logical'):
+		return node.emit()
+	if t.ttype == 'operator-prefix' and t.tvalue == '-' and node.args[0].token.tsubtype == 'number':
+		return node.emit()
+	return None
+
+
+def _is_cell(text):
+	# A1 or $A$1, with or without a sheet prefix
+	_, rest = structref.split_path(text)
+	cell = rest.replace('$', '')
+	letters = cell.rstrip('0123456789')
+	return letters != cell and 1 <= len(letters) <= 3 and letters.isalpha()
+
+
+def is_scalar(node):
+	# True when the node evaluates to one value for the row, not to an array
+	if _constant(node) is not None:
+		return True
+	t = node.token
+	if t.ttype == 'operand':
+		if t.tsubtype != 'range':
+			return False
+		ref = structref.parse(t.tvalue)
+		if ref is not None:
+			return ref.this_row and len(ref.columns()) == 1
+		return _is_cell(t.tvalue)
+	if isinstance(node, OperatorNode):
+		return t.tvalue not in (':', ',', '') and all(is_scalar(a) for a in node.args)
+	if isinstance(node, FunctionNode):
+		name = t.tvalue.upper()
+		if name in ('ARRAY', 'ARRAYROW'):
+			return False
+		if name in _REDUCING:
+			return True
+		if name in _LOOKUPS:
+			return bool(node.args) and is_scalar(node.args[0])
+		return all(is_scalar(a) for a in node.args)
+	return False
+
+
+def _comparison(node, op):
+	# e <op> constant (either side) -> (e, constant node), else None
+	if not isinstance(node, OperatorNode) or node.token.ttype != 'operator-infix' or node.token.tvalue != op:
+		return None
+	left, right = node.args
+	if _constant(right) is not None and _constant(left) is None:
+		return left, right
+	if _constant(left) is not None and _constant(right) is None:
+		return right, left
+	return None
+
+
+def _node(cls, value, ttype, tsubtype, args):
+	n = cls(Token(value, ttype, tsubtype))
+	n.args = args
+	n.num_args = len(args)
+	return n
+
+
+def _membership(expr, constants):
+	# expr={c1,c2,...}
+	row = _node(FunctionNode, 'ARRAYROW', 'function', '', constants)
+	array = _node(FunctionNode, 'ARRAY', 'function', '', [row])
+	return _node(OperatorNode, '=', 'operator-infix', 'logical', [expr, array])
+
+
+def is_volatile(node):
+	return any(isinstance(n, FunctionNode) and n.token.tvalue.upper() in VOLATILE for n in walk_ast(node))
+
+
+def _group(args, op, min_terms):
+	# Split the arguments of OR/AND into (expression key -> [(index, expr, constant)])
+	groups = collections.OrderedDict()
+	for i, a in enumerate(args):
+		cmp = _comparison(a, op)
+		if cmp is not None and not is_volatile(cmp[0]) and is_scalar(cmp[0]):
+			groups.setdefault(cmp[0].emit(), []).append((i, cmp[0], cmp[1]))
+	return [g for g in groups.values() if len(g) >= min_terms]
+
+
+def _rewrite(node, advice, min_terms):
+	# Bottom-up rewrite of the OR/AND chains of one subtree, returns the (new) node
+	args = getattr(node, 'args', None)
+	if not args:
+		return node
+	node.args = [_rewrite(a, advice, min_terms) for a in args]
+
+	if not isinstance(node, FunctionNode) or node.token.tvalue.upper() not in ('OR', 'AND'):
+		return node
+
+	is_or = node.token.tvalue.upper() == 'OR'
+	groups = _group(node.args, '=' if is_or else '<>', min_terms)
+	if not groups:
+		return node
+
+	before = node.emit()
+	replaced = {}
+	dropped = set()
+	for g in groups:
+		expr = g[0][1]
+		test = _membership(expr, [c for i, e, c in g])
+		if not is_or:
+			test = _node(FunctionNode, 'NOT', 'function', '', [_node(FunctionNode, 'OR', 'function', '', [test])])
+		replaced[g[0][0]] = test
+		dropped.update(i for i, e, c in g[1:])
+
+		note = '{0} evaluated once instead of {1} times'.format(expr.emit(), len(g))
+		if len(g) > LOOKUP_TABLE_TERMS:
+			note += '; consider a lookup table: ISNUMBER(MATCH({0},Table[Column],0))'.format(expr.emit())
+		advice.append(Advice('set-lookup', before, test.emit(), len(g), note))
+
+	node.args = [replaced.get(i, a) for i, a in enumerate(node.args) if i not in dropped]
+	node.num_args = len(node.args)
+	return node
+
+
+def repeated(ast, min_count=2):
+	# Function calls evaluated more than once within the formula: LET candidates
+	counts = collections.OrderedDict()
+	for n in walk_ast(ast):
+		if isinstance(n, FunctionNode) and n.token.tvalue not in ('ARRAY', 'ARRAYROW'):
+			key = n.emit()
+			counts[key] = counts.get(key, 0) + 1
+	return [(k, c) for k, c in counts.items() if c >= min_count]
+
+
+def advise(formula, min_terms=2):
+	# -> (rewritten formula with leading '=', list of Advice)
+	if not formula or not formula.lstrip(' =').strip():
+		return formula, []
+	# the expression tree would drop the empty argument: IF(c,,x) -> IF(c,x)
+	if has_empty_argument(XlsParser(formula)):
+		return formula, []
+
+	ast = get_ast(formula)
+	advice = []
+	ast = _rewrite(ast, advice, min_terms)
+	rewritten = '=' + ast.emit()
+
+	for expr, count in repeated(ast):
+		advice.append(Advice('let', expr, None, count, '{0} evaluated {1} times, bind it once with LET'.format(expr, count)))
+
+	return rewritten, advice
+
+
+########################################################################################################################
+
+if __name__ == '__main__':
+
+	from xlsfiles import read_raw, write_tidy
+
+	args = sys.argv[1:]
+	min_terms = 2
+	if '--min-terms' in args:
+		i = args.index('--min-terms')
+		min_terms = int(args[i + 1])
+		del args[i:i + 2]
+
+	if not args:
+		print('usage: python advisor.py <name>_raw.txt [--min-terms N]')
+		sys.exit(2)
+
+	with open(args[0], 'r') as ff:
+		for name, body in read_raw(ff):
+			rewritten, advice = advise(body, min_terms)
+			if not advice:
+				continue
+			print('=' * 100)
+			print(name)
+			for a in advice:
+				print('\t[{0}] {1}'.format(a.kind, a.note))
+				if a.after:
+					print('\t\t' + a.after)
+			if any(a.kind == 'set-lookup' for a in advice):
+				write_tidy(sys.stdout, [(name, XlsParser(rewritten).xlstidy())])
@@ -0,0 +1,186 @@
+# ========================================================================
+# Description: Bind repeated subexpressions of a formula once with LET
+#
+#              IF(SUMIF(T[[K]:[K]],[@K],T[[V]:[V]])>0,"X",IF(SUMIF(T[[K]:[K]],[@K],T[[V]:[V]])>1,...
+#          ->  LET(_x1,SUMIF(T[[K]:[K]],[@K],T[[V]:[V]]),IF(_x1>0,"X",IF(_x1>1,...
+#
+#              The largest structurally identical pure subtree evaluated
+#              more than once is bound first, then the search repeats on
+#              the result.  Volatile and position dependent functions are
+#              never hoisted.  LET evaluates its bindings up front, so a
+#              subtree is only bound when one of its copies is evaluated
+#              whatever the conditions: copies that all sit in a branch
+#              of IF, IFERROR, IFNA, IFS, SWITCH or CHOOSE (any argument
+#              but the first) are left alone.  As a guard against a bad
+#              rewrite, substituting the bindings back must also give the
+#              original formula text; this is a textual check, not an
+#              evaluation of either formula.  Formulas with an empty
+#              argument (IF(c,,x)), which the expression tree cannot
+#              represent, are left unchanged.
+#
+#       Usage: python letrewrite.py <name>_raw.txt
+# ========================================================================
+import collections
+import sys
+
+from advisor import VOLATILE
+from specialize import has_empty_argument
+from tokenizer import FunctionNode, OperatorNode, RangeNode, Token, XlsParser, compact, get_ast, walk_ast
+
+# never hoisted: volatile, or their value depends on where they are evaluated
+UNHOISTABLE = VOLATILE + ('ROW', 'COLUMN', 'ROWS', 'COLUMNS', 'LET', 'LAMBDA')
+
+# reference operators: their result is a reference, not a value worth binding
+_REFERENCE_OPS = (':', ',', '')
+
+# only their first argument is always evaluated
+CONDITIONAL = ('IF', 'IFERROR', 'IFNA', 'IFS', 'SWITCH', 'CHOOSE')
+
+Binding = collections.namedtuple('Binding', 'name expr count')
+
+
+def _eligible(node):
+	# A pure function call, or an operator over one, that can be bound to a name
+	if isinstance(node, FunctionNode):
+		if node.token.tvalue in ('ARRAY', 'ARRAYROW'):
+			return False
+	elif isinstance(node, OperatorNode):
+		if node.token.tvalue in _REFERENCE_OPS:
+			return False
+	else:
+		return False
+
+	has_call = False
+	for n in walk_ast(node):
+		if isinstance(n, FunctionNode):
+			if n.token.tvalue.upper() in UNHOISTABLE:
+				return False
+			has_call = True
+	return has_call
+
+
+def _occurrences(roots):
+	# key -> [(parent, index, conditional)] of every eligible subtree below the roots
+	occ = collections.OrderedDict()
+
+	def visit(parent, conditional):
+		branches = isinstance(parent, FunctionNode) and parent.token.tvalue.upper() in CONDITIONAL
+		for i, a in enumerate(getattr(parent, 'args', [])):
+			inside = conditional or branches and i > 0
+			if _eligible(a):
+				occ.setdefault(a.emit(), []).append((parent, i, inside))
+			visit(a, inside)
+
+	for root in roots:
+		visit(root, False)
+	return occ
+
+
+def _name_node(name):
+	return RangeNode(Token(name, 'operand', 'range'))
+
+
+def _expand(node, values):
+	# Copy of the tree with every bound name replaced by its expression
+	if isinstance(node, RangeNode) and node.token.tvalue in values:
+		return _expand(values[node.token.tvalue], values)
+	args = getattr(node, 'args', None)
+	if not args:
+		return node
+	copy = node.__class__(node.token)
+	copy.args = [_expand(a, values) for a in args]
+	copy.num_args = len(copy.args)
+	return copy
+
+
+def _order(bindings):
+	# Bindings in definition order: every name after the names it uses
+	names = set(b.name for b in bindings)
+	uses = dict((b.name, set(n.token.tvalue for n in walk_ast(b.expr) if isinstance(n, RangeNode) and n.token.tvalue in names)) for b in bindings)
+	ordered = []
+	done = set()
+	while len(ordered) < len(bindings):
+		for b in bindings:
+			if b.name not in done and uses[b.name] <= done:
+				ordered.append(b)
+				done.add(b.name)
+	return ordered
+
+
+def dedup(formula, min_count=2, prefix='_x'):
+	# -> (formula, [Binding]); the formula is returned unchanged when nothing is worth binding
+	if not formula or not formula.lstrip(' =').strip():
+		return formula, []
+
+	# the expression tree would drop the empty argument: F(a,,b) -> F(a,b)
+	if has_empty_argument(XlsParser(formula)):
+		return formula, []
+
+	ast = get_ast(formula)
+	if any(isinstance(n, FunctionNode) and n.token.tvalue.upper() in ('LET', 'LAMBDA') for n in walk_ast(ast)):
+		return formula, []
+
+	# LET names must not clash with anything the formula already refers to
+	taken = set(n.token.tvalue.upper() for n in walk_ast(ast))
+
+	# the body hangs below a dummy root so that the top node can be replaced like any other
+	root = FunctionNode(Token('', 'function', ''))
+	root.args = [ast]
+	bindings = []
+	while True:
+		occ = _occurrences([root] + [b.expr for b in bindings])
+		# binding must not evaluate what the formula only evaluates on some condition
+		candidates = [k for k, v in occ.items() if len(v) >= min_count and not all(c for p, i, c in v)]
+		if not candidates:
+			break
+		key = max(candidates, key=len)
+
+		n = len(bindings) + 1
+		while (prefix + str(n)).upper() in taken:
+			n += 1
+		name = prefix + str(n)
+		taken.add(name.upper())
+
+		positions = occ[key]
+		expr = positions[0][0].args[positions[0][1]]
+		for parent, i, c in positions:
+			parent.args[i] = _name_node(name)
+		bindings.append(Binding(name, expr, len(positions)))
+
+	if not bindings:
+		return formula, []
+
+	bindings = _order(bindings)
+	body = root.args[0]
+
+	# textual guard: the rewrite must expand back to the formula as given
+	values = dict((b.name, b.expr) for b in bindings)
+	if _expand(body, values).emit() != compact(formula):
+		return formula, []
+
+	let = FunctionNode(Token('LET', 'function', ''))
+	let.args = [a for b in bindings for a in (_name_node(b.name), b.expr)] + [body]
+	let.num_args = len(let.args)
+	return '=' + let.emit(), bindings
+
+
+########################################################################################################################
+
+if __name__ == '__main__':
+
+	from xlsfiles import read_raw, write_tidy
+
+	if len(sys.argv) < 2:
+		print('usage: python letrewrite.py <name>_raw.txt')
+		sys.exit(2)
+
+	with open(sys.argv[1], 'r') as ff:
+		for name, body in read_raw(ff):
+			rewritten, bindings = dedup(body)
+			if not bindings:
+				continue
+			print('=' * 100)
+			print(name)
+			for b in bindings:
+				print('\t{0} = {1}\t({2} evaluations -> 1)'.format(b.name, b.expr.emit(), b.count))
+			write_tidy(sys.stdout, [(name, XlsParser(rewritten).xlstidy())])
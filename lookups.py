@@ -0,0 +1,266 @@
+# ========================================================================
+# Description: Catalog of exact-match lookups and conditional aggregates
+#
+#              VLOOKUP/HLOOKUP(...,FALSE), MATCH(...,0), XLOOKUP and the
+#              SUMIF/COUNTIF/AVERAGEIF(S) family scan a whole column for
+#              every row they are evaluated on.  analyze() catalogs them
+#              by (table, key column, return column), estimates
+#              rows x lookup-table-rows comparisons and recommends helper
+#              columns, MATCH-once or XLOOKUP rewrites.
+#
+#       Usage: python lookups.py <name>_raw.txt [--table JDEDataTable]
+#                                [--rows Table=N ...] [--default-rows N]
+# ========================================================================
+import collections
+import sys
+
+import structref
+from tokenizer import FunctionNode, RangeNode, get_ast
+
+DEFAULT_ROWS = 10000
+
+# lookup functions by argument layout
+_LOOKUPS = {
+	'VLOOKUP': 'vlookup',
+	'HLOOKUP': 'vlookup',
+	'MATCH': 'match',
+	'XLOOKUP': 'xlookup',
+}
+_AGGREGATES = ('SUMIF', 'COUNTIF', 'AVERAGEIF', 'SUMIFS', 'COUNTIFS', 'AVERAGEIFS', 'MAXIFS', 'MINIFS')
+
+# every function that scans a column or table each time it is evaluated
+SCANNING = tuple(_LOOKUPS) + _AGGREGATES
+
+# ========================================================================
+#       Class: Lookup
+# Description: One lookup or conditional aggregate found in a formula
+#
+#  Attributes:   column - Name of the formula (calculated column)
+#              function - VLOOKUP, SUMIF, ...
+#                   key - Emitted key / criteria expression(s)
+#                 table - (path, table) searched
+#               key_col - Column(s) searched
+#               ret_col - Column returned / aggregated (None for COUNTIF, MATCH)
+#                 exact - Exact match (linear scan) or sorted (binary search)
+#              fallback - Inside IFERROR/IFNA
+#                  text - The emitted call
+# ========================================================================
+Lookup = collections.namedtuple('Lookup', 'column function key table key_col ret_col exact fallback text')
+
+
+def _ref(node, index):
+	# StructRef of a range argument (None for A1-style ranges, names, expressions)
+	if isinstance(node, RangeNode):
+		ref = structref.parse(node.token.tvalue)
+		if ref is not None:
+			return ref._replace(table=ref.table or index.default)
+	return None
+
+
+def _columns(ref):
+	return ref.first if ref.first == ref.last else ref.first + ':' + ref.last
+
+
+def _is_false(node):
+	return node.emit().upper() in ('FALSE', '0')
+
+
+def _lookups(column, ast, index):
+	o = []
+
+	def visit(node, fallback):
+		if isinstance(node, FunctionNode):
+			fn = node.token.tvalue.upper()
+			args = node.args
+			kind = _LOOKUPS.get(fn)
+
+			text = node.emit()
+			if kind == 'vlookup' and len(args) >= 3:
+				ref = _ref(args[1], index)
+				if ref is not None and ref.first is not None:
+					exact = len(args) > 3 and _is_false(args[3])
+					n = args[2].emit()
+					ret = ref.first if n == '1' else '{0}[{1}]'.format(_columns(ref), n)
+					o.append(Lookup(column, fn, args[0].emit(), (ref.path, ref.table), ref.first, ret, exact, fallback, text))
+			elif kind == 'match' and len(args) >= 2:
+				ref = _ref(args[1], index)
+				if ref is not None and ref.first is not None:
+					exact = len(args) > 2 and args[2].emit() == '0'
+					o.append(Lookup(column, fn, args[0].emit(), (ref.path, ref.table), ref.first, None, exact, fallback, text))
+			elif kind == 'xlookup' and len(args) >= 3:
+				ref = _ref(args[1], index)
+				ret = _ref(args[2], index)
+				if ref is not None and ref.first is not None:
+					exact = len(args) < 5 or args[4].emit() == '0'
+					o.append(Lookup(column, fn, args[0].emit(), (ref.path, ref.table), ref.first, ret and ret.first, exact, fallback or len(args) > 3, text))
+			elif fn in _AGGREGATES and len(args) >= 2:
+				if fn == 'COUNTIFS':
+					ret = None
+					pairs = args
+				elif fn.endswith('S'):
+					# SUMIFS(sum_range, criteria_range1, criteria1, ...)
+					ret = _ref(args[0], index)
+					pairs = args[1:]
+				else:
+					# SUMIF(range, criteria, [sum_range])
+					ret = None if fn == 'COUNTIF' else _ref(args[2] if len(args) > 2 else args[0], index)
+					pairs = args[:2]
+				refs = [_ref(pairs[i], index) for i in range(0, len(pairs) - 1, 2)]
+				keys = [pairs[i + 1].emit() for i in range(0, len(pairs) - 1, 2)]
+				if refs and all(r is not None and r.first is not None for r in refs):
+					o.append(Lookup(column, fn, ','.join(keys), (refs[0].path, refs[0].table), ','.join(r.first for r in refs),
+						ret.first if ret is not None and ret.first is not None else None, True, fallback, text))
+
+			inner = fallback or fn in ('IFERROR', 'IFNA')
+			for i, a in enumerate(args):
+				# only the first argument of IFERROR/IFNA is protected
+				visit(a, inner if i == 0 else fallback)
+		else:
+			for a in getattr(node, 'args', []):
+				visit(a, fallback)
+
+	visit(ast, False)
+	return o
+
+
+# ========================================================================
+#       Class: LookupGroup
+# Description: Lookups sharing (table, key column, return column)
+# ========================================================================
+class LookupGroup:
+	def __init__(self, table, key_col, ret_col):
+		self.table = table
+		self.key_col = key_col
+		self.ret_col = ret_col
+		self.lookups = []
+		self.cost = 0
+
+	@property
+	def name(self):
+		path, table = self.table
+		if not path:
+			return table
+		if not path.replace('_', '').replace('.', '').isalnum():
+			path = "'" + path.replace("'", "''") + "'"
+		return path + '!' + table
+
+
+def analyze(formulas, table='', rows=None, default_rows=DEFAULT_ROWS):
+	# formulas: iterable of (name, body) -> (groups sorted by decreasing cost, recommendations)
+	rows = dict((k.lower(), v) for k, v in (rows or {}).items())
+	index = structref.ColumnIndex(table)
+	own_rows = rows.get(table.lower(), default_rows)
+
+	groups = collections.OrderedDict()
+	bodies = {}
+	for name, body in formulas:
+		if not body or not body.lstrip(' =').strip():
+			continue
+		ast = get_ast(body)
+		bodies[name] = ast.emit()
+		for lookup in _lookups(name, ast, index):
+			tid = index.table_id(*lookup.table)
+			key = (tid, lookup.key_col.lower(), (lookup.ret_col or '').lower())
+			group = groups.get(key)
+			if group is None:
+				group = groups[key] = LookupGroup(lookup.table, lookup.key_col, lookup.ret_col)
+			group.lookups.append(lookup)
+
+			# every row of the formula's table scans the lookup table (binary search when sorted)
+			searched = rows.get(lookup.table[1].lower(), default_rows)
+			group.cost += own_rows * (searched if lookup.exact else max(1, searched.bit_length()))
+
+	ordered = sorted(groups.values(), key=lambda g: -g.cost)
+	return ordered, recommend(ordered, bodies)
+
+
+def recommend(groups, bodies):
+	o = []
+
+	# formulas that are nothing but one call: helper columns other formulas can refer to
+	helpers = {}
+	for name, text in bodies.items():
+		helpers.setdefault(text, name)
+
+	by_key = collections.OrderedDict()
+	for g in groups:
+		by_key.setdefault((g.table, g.key_col.lower()), []).append(g)
+
+	for g in groups:
+		first = g.lookups[0]
+		if first.function not in _AGGREGATES:
+			continue
+		sites = len(g.lookups)
+		if sites > 1 and len(set(l.key for l in g.lookups)) == 1:
+			helper = helpers.get(first.text)
+			o.append('{0} over {1}[{2}] keyed by {3}: {4} evaluations in {5} -> {6}'.format(
+				first.function, g.name, g.key_col, first.key, sites, ', '.join(sorted(set(l.column for l in g.lookups))),
+				'reuse helper column [@{0}]'.format(helper) if helper else 'compute once in a helper column and refer to it with [@Helper]'))
+
+	for gs in by_key.values():
+		lookups = [l for g in gs for l in g.lookups if l.function in _LOOKUPS]
+		if not lookups:
+			continue
+		name = gs[0].name
+		key_col = lookups[0].key_col
+
+		exact = [l for l in lookups if l.exact]
+		if exact:
+			o.append('{0} exact-match lookups on {1}[{2}] from {3}: linear scan per row; '
+				'sort {1} by {2} and use a binary search (VLOOKUP(...,TRUE) checked against the key) or an XLOOKUP'.format(
+				len(exact), name, key_col, ', '.join(sorted(set(l.column for l in exact)))))
+
+		if any(l.fallback and l.function == 'VLOOKUP' for l in lookups):
+			o.append('IFERROR(VLOOKUP(...),...) on {0}[{1}]: XLOOKUP(key,{0}[{1}],{0}[return],if_not_found) '
+				'replaces the nested fallback in one call'.format(name, key_col))
+
+		# several return columns fetched with the same key: MATCH once
+		keyed = collections.OrderedDict()
+		for l in lookups:
+			if l.ret_col:
+				keyed.setdefault(l.key, set()).add(l.ret_col)
+		for key, rets in keyed.items():
+			if len(rets) > 1:
+				o.append('{0} columns of {1} fetched by {2} on [{3}]: add a helper column '
+					'=MATCH({2},{1}[{3}],0) and read each with INDEX({1}[column],[@Helper])'.format(len(rets), name, key, key_col))
+	return o
+
+
+########################################################################################################################
+
+if __name__ == '__main__':
+
+	from xlsfiles import read_raw
+
+	args = sys.argv[1:]
+
+	def option(flag, default):
+		if flag in args:
+			i = args.index(flag)
+			value = args[i + 1]
+			del args[i:i + 2]
+			return value
+		return default
+
+	table = option('--table', 'JDEDataTable')
+	default_rows = int(option('--default-rows', str(DEFAULT_ROWS)))
+	rows = {}
+	while '--rows' in args:
+		k, v = option('--rows', None).split('=')
+		rows[k] = int(v)
+
+	if not args:
+		print('usage: python lookups.py <name>_raw.txt [--table JDEDataTable] [--rows Table=N ...] [--default-rows N]')
+		sys.exit(2)
+
+	with open(args[0], 'r') as ff:
+		groups, advice = analyze(read_raw(ff), table, rows, default_rows)
+
+	fmt = '{0:>16}  {1:>5}  {2:<10}  {3}'
+	print(fmt.format('COST (cmp)', 'SITES', 'FUNCTION', 'TABLE[KEY] -> RETURN'))
+	for g in groups:
+		print(fmt.format('{0:,}'.format(g.cost), len(g.lookups), g.lookups[0].function,
+			'{0}[{1}] -> {2}'.format(g.name, g.key_col, g.ret_col or '-')))
+	print()
+	for a in advice:
+		print('* ' + a)
@@ -0,0 +1,110 @@
+# ========================================================================
+# Description: Dead calculated columns of a formula model
+#
+#              The dependency graph of a RAW file (structref.column_graph)
+#              is walked backwards from the output columns: a calculated
+#              column no output reaches is recalculated on every refresh
+#              for nothing and can be dropped.
+#
+#              Savings are estimated per row from the metrics the parser
+#              counts: tokens evaluated, and calls that scan a whole
+#              column or lookup table (VLOOKUP, MATCH, SUMIF, ...).
+#
+#       Usage: python prune.py <name>_raw.txt Output [...]
+#                              [--roots file] [--table JDEDataTable]
+# ========================================================================
+import collections
+import sys
+
+import structref
+from lookups import SCANNING
+from tokenizer import XlsParser
+
+# ========================================================================
+#       Class: Cost
+# Description: Estimated recalculation cost of a column, per row
+#
+#  Attributes: tokens - Tokens evaluated
+#               scans - Lookup / conditional aggregate calls
+# ========================================================================
+Cost = collections.namedtuple('Cost', 'tokens scans')
+
+
+def reachable(graph, roots):
+	# -> set of the columns the roots read, directly or not (roots included)
+	seen = set()
+	stack = list(roots)
+	while stack:
+		column = stack.pop()
+		if column not in seen:
+			seen.add(column)
+			stack.extend(graph.get(column, ()))
+	return seen
+
+
+def cost(body):
+	m = XlsParser(body).metrics
+	return Cost(m.tokens, sum(n for f, n in m.calls.items() if f.upper() in SCANNING))
+
+
+def prune(formulas, roots, table=''):
+	# formulas: iterable of (column, body) -> ([(column, Cost)] that can be dropped, column -> Cost of every calculated column)
+	formulas = [(name, body) for name, body in formulas if body.lstrip().startswith('=')]
+	graph = structref.column_graph(formulas, table)
+
+	spelling = dict((name.lower(), name) for name in graph)
+	unknown = [r for r in roots if r.lower() not in spelling]
+	if unknown:
+		raise KeyError('not a calculated column: ' + ', '.join(unknown))
+	live = reachable(graph, [spelling[r.lower()] for r in roots])
+
+	costs = collections.OrderedDict((name, cost(body)) for name, body in formulas)
+	return [(name, c) for name, c in costs.items() if name not in live], costs
+
+
+########################################################################################################################
+
+if __name__ == '__main__':
+
+	from xlsfiles import read_raw
+
+	args = sys.argv[1:]
+
+	def option(flag, default):
+		if flag in args:
+			i = args.index(flag)
+			value = args[i + 1]
+			del args[i:i + 2]
+			return value
+		return default
+
+	table = option('--table', 'JDEDataTable')
+	roots_file = option('--roots', None)
+
+	if not args or (len(args) < 2 and not roots_file):
+		print('usage: python prune.py <name>_raw.txt Output [...] [--roots file] [--table JDEDataTable]')
+		sys.exit(2)
+
+	roots = args[1:]
+	if roots_file:
+		with open(roots_file, 'r') as ff:
+			roots += [line.strip() for line in ff if line.strip() and not line.startswith('#')]
+
+	with open(args[0], 'r') as ff:
+		try:
+			dead, costs = prune(read_raw(ff), roots, table)
+		except KeyError as e:
+			print(e.args[0])
+			sys.exit(2)
+
+	fmt = '{0:<40} {1:>8} {2:>6}'
+	print(fmt.format('DEAD COLUMN', 'TOKENS', 'SCANS'))
+	for name, c in sorted(dead, key=lambda d: (-d[1].scans, -d[1].tokens)):
+		print(fmt.format(name[:40], c.tokens, c.scans))
+	tokens = sum(c.tokens for name, c in dead)
+	scans = sum(c.scans for name, c in dead)
+	total_tokens = sum(c.tokens for c in costs.values())
+	total_scans = sum(c.scans for c in costs.values())
+	print()
+	print('{0} of {1} calculated columns can be dropped: {2} tokens ({3:.0%}) and {4} lookup scans ({5:.0%}) less per row'.format(
+		len(dead), len(costs), tokens, tokens / float(total_tokens or 1), scans, scans / float(total_scans or 1)))
@@ -0,0 +1,268 @@
+# ========================================================================
+# Description: Level-parallel recalculation of calculated columns
+#
+#              run() walks the tsort levels of a dependency graph: the
+#              columns of one level do not depend on each other and are
+#              computed concurrently on a thread or process pool, a level
+#              starting when the previous one is complete.
+#
+#              Threads only overlap where compute releases the GIL (I/O,
+#              C extensions); pure Python columns, like the synthetic
+#              workload of the command line, get no speed-up from them
+#              and need the process pool (processes=True, --processes).
+#
+#                  compute(column, inputs) -> values of the column
+#                  inputs: dependency -> its values
+#
+#              On a process pool, results that are array.array are
+#              published as shared memory blocks: workers get the block
+#              names and read their inputs as memoryviews, so column data
+#              is never pickled (anything else is).  Inputs are released
+#              when compute returns and must not be kept.  Every block is
+#              unlinked when run() returns or raises, including those of
+#              the columns computed next to one that failed.
+#
+#              Every column is timed; the critical path is the chain of
+#              dependent columns with the largest total compute time, the
+#              refresh time no number of cores can go below.
+#
+#       Usage: python scheduler.py <name>_raw.txt [--table JDEDataTable]
+#                                  [--workers N] [--processes] [--rows N]
+# ========================================================================
+import array
+import collections
+import sys
+import time
+
+from tsort import levels as tsort_levels
+
+# ========================================================================
+#       Class: ColumnTiming
+# Description: One computed column
+#
+#  Attributes:  column - Column name
+#                level - Index of its tsort level
+#                start - Seconds since the start of the run
+#              seconds - Compute time
+# ========================================================================
+ColumnTiming = collections.namedtuple('ColumnTiming', 'column level start seconds')
+
+
+# ------------------------------------------------------------------------
+# Shared memory transport (process pools)
+# ------------------------------------------------------------------------
+def _publish(value):
+	# array.array -> ('shm', block name, typecode, length); anything else travels pickled
+	if not isinstance(value, array.array):
+		return 'value', value
+	from multiprocessing import shared_memory
+	size = len(value) * value.itemsize
+	block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+	block.buf[:size] = memoryview(value).cast('B')
+	name = block.name
+	block.close()
+	return 'shm', name, value.typecode, len(value)
+
+
+def _attach(handle, blocks):
+	# -> memoryview of a published value (the block is appended to blocks, to be closed)
+	if handle[0] == 'value':
+		return handle[1]
+	from multiprocessing import shared_memory
+	block = shared_memory.SharedMemory(handle[1])
+	blocks.append(block)
+	return block.buf[:handle[3] * array.array(handle[2]).itemsize].cast(handle[2])
+
+
+def _materialize(handle):
+	if handle[0] == 'value':
+		return handle[1]
+	blocks = []
+	view = _attach(handle, blocks)
+	value = array.array(handle[2], view)
+	view.release()
+	blocks[0].close()
+	return value
+
+
+def _unlink(handle):
+	if handle[0] == 'shm':
+		from multiprocessing import shared_memory
+		try:
+			block = shared_memory.SharedMemory(handle[1])
+		except FileNotFoundError:
+			return
+		block.close()
+		block.unlink()
+
+
+def _compute_process(compute, column, handles):
+	# Runs in a worker process: inputs from shared memory, result published back
+	blocks = []
+	inputs = dict((dep, _attach(h, blocks)) for dep, h in handles.items())
+	start = time.perf_counter()
+	value = compute(column, inputs)
+	seconds = time.perf_counter() - start
+	for view in inputs.values():
+		if isinstance(view, memoryview):
+			view.release()
+	for block in blocks:
+		block.close()
+	return _publish(value), start, seconds
+
+
+def _compute_thread(compute, column, inputs):
+	start = time.perf_counter()
+	value = compute(column, inputs)
+	return value, start, time.perf_counter() - start
+
+
+# ========================================================================
+#       Class: Schedule
+# Description: Outcome of one run
+#
+#  Attributes:  levels - Column lists, in evaluation order
+#              results - Column -> values
+#              timings - Column -> ColumnTiming, level by level
+#                 graph - Column -> dependencies
+#                  wall - Seconds for the whole run
+#
+#     Methods: Tuple  - critical_path() - (seconds, [columns])
+#              String - report()
+# ========================================================================
+class Schedule:
+	def __init__(self, graph):
+		self.graph = graph
+		self.levels = []
+		self.results = {}
+		self.timings = collections.OrderedDict()
+		self.wall = 0.0
+
+	def critical_path(self):
+		# longest chain of dependent computed columns, weighted by compute time
+		best = {}
+		for level in self.levels:
+			for column in level:
+				before = [best[d] for d in self.graph.get(column, ()) if d in best and d != column]
+				seconds, path = max(before) if before else (0.0, [])
+				best[column] = (seconds + self.timings[column].seconds, path + [column])
+		return max(best.values()) if best else (0.0, [])
+
+	def report(self):
+		seconds, path = self.critical_path()
+		total = sum(t.seconds for t in self.timings.values())
+		lines = ['{0} columns in {1} levels: {2:.3f}s wall, {3:.3f}s compute, critical path {4:.3f}s ({5} columns)'.format(
+			len(self.timings), len(self.levels), self.wall, total, seconds, len(path))]
+		for i, level in enumerate(self.levels):
+			slowest = max(level, key=lambda c: self.timings[c].seconds)
+			lines.append('  level {0:>2}: {1:>3} columns, slowest {2} {3:.3f}s'.format(
+				i + 1, len(level), slowest, self.timings[slowest].seconds))
+		lines.append('  critical path: ' + ' -> '.join(path))
+		return '\n'.join(lines)
+
+
+def run(graph, compute, sources=None, workers=None, processes=False):
+	# graph: column -> dependencies; sources: values of the columns that are not computed
+	graph = dict((k, set(v)) for k, v in graph.items())
+	sources = dict(sources or {})
+	schedule = Schedule(graph)
+	schedule.levels = [[c for c in level if c not in sources] for level in tsort_levels(graph)]
+	schedule.levels = [level for level in schedule.levels if level]
+
+	if processes:
+		from concurrent.futures import ProcessPoolExecutor
+		from multiprocessing import resource_tracker
+		# workers share the parent's tracker, which would otherwise reclaim their blocks when they exit
+		resource_tracker.ensure_running()
+		pool = ProcessPoolExecutor(workers)
+		task = _compute_process
+	else:
+		from concurrent.futures import ThreadPoolExecutor
+		pool = ThreadPoolExecutor(workers)
+		task = _compute_thread
+
+	handles = {}
+	origin = time.perf_counter()
+	try:
+		for k, v in sources.items():
+			handles[k] = _publish(v) if processes else v
+		with pool:
+			for i, level in enumerate(schedule.levels):
+				futures = []
+				error = None
+				try:
+					for column in level:
+						inputs = dict((d, handles[d]) for d in graph.get(column, ()) if d in handles and d != column)
+						futures.append((column, pool.submit(task, compute, column, inputs)))
+				except Exception as e:
+					error = e
+				# collect the whole level even past a failure: its other columns published blocks too
+				for column, future in futures:
+					try:
+						handles[column], start, seconds = future.result()
+					except Exception as e:
+						error = error or e
+						continue
+					schedule.timings[column] = ColumnTiming(column, i, start - origin, seconds)
+				if error is not None:
+					raise error
+		schedule.wall = time.perf_counter() - origin
+		for level in schedule.levels:
+			for column in level:
+				schedule.results[column] = _materialize(handles[column]) if processes else handles[column]
+	finally:
+		if processes:
+			for handle in handles.values():
+				_unlink(handle)
+	return schedule
+
+
+# ------------------------------------------------------------------------
+# Command line: synthetic workload over the dependency graph of a RAW file
+# ------------------------------------------------------------------------
+def _synthetic(rows, column, inputs):
+	# every column costs one pass per row over its inputs
+	values = array.array('d', bytes(8 * rows))
+	for v in inputs.values():
+		for r in range(rows):
+			values[r] += v[r] * 0.5
+	return values
+
+
+########################################################################################################################
+
+if __name__ == '__main__':
+
+	import functools
+
+	import structref
+	from xlsfiles import read_raw
+
+	args = sys.argv[1:]
+
+	def option(flag, default):
+		if flag in args:
+			i = args.index(flag)
+			value = args[i + 1]
+			del args[i:i + 2]
+			return value
+		return default
+
+	table = option('--table', 'JDEDataTable')
+	workers = option('--workers', None)
+	rows = int(option('--rows', '10000'))
+	processes = '--processes' in args
+	if processes:
+		args.remove('--processes')
+
+	if not args:
+		print('usage: python scheduler.py <name>_raw.txt [--table JDEDataTable] [--workers N] [--processes] [--rows N]')
+		sys.exit(2)
+
+	with open(args[0], 'r') as ff:
+		graph = structref.column_graph(read_raw(ff), table)
+
+	data = set().union(*graph.values()) - set(graph)
+	sources = dict((c, array.array('d', [1.0]) * rows) for c in data)
+	schedule = run(graph, functools.partial(_synthetic, rows), sources, workers and int(workers), processes)
+	print(schedule.report())
@@ -0,0 +1,380 @@
+# ========================================================================
+# Description: Partial evaluation of formulas with pinned parameters
+#
+#              Scenario parameters fixed for a run (named ranges such as
+#              CurY, CurM, IncludeAll, or [@Column] references) are
+#              replaced by their values, then the tree is folded bottom-up:
+#
+#                  literal-only operators and pure functions -> constant
+#                  IF / IFERROR with a known condition       -> the branch taken
+#                  AND / OR of constants only                -> TRUE / FALSE
+#                  AND / OR neutral constants               -> dropped
+#                  NOT of a constant                        -> constant
+#
+#              Folding stops at anything whose value would be an error
+#              (#DIV/0!, #VALUE! ...), so error results stay in the
+#              formula.  Excel evaluates every argument of AND/OR, so a
+#              deciding constant only replaces the call when the other
+#              arguments are constants too, unless short_circuit is set
+#              (--short-circuit): then the errors they might raise are
+#              no longer propagated.  The expression tree drops empty
+#              arguments (IF(X,,2)), so formulas holding one are left as
+#              they are.
+#
+#       Usage: python specialize.py <name>_raw.txt Name=value [...] [--short-circuit]
+#              e.g. CurY=2016 CurM=9 IncludeAll="Y"
+# ========================================================================
+import math
+import sys
+
+from tokenizer import ASTNode, FunctionNode, OperatorNode, RangeNode, Token, XlsParser, XlsTokens, get_ast
+
+# A folded value: float, str or bool; anything else is "not a constant"
+_NOT_CONSTANT = object()
+
+_COMPARISONS = ('=', '<>', '<', '>', '<=', '>=')
+
+
+def parse_value(text):
+	# 'CurY=2016' style command line values: number, TRUE/FALSE, "text" or bare text
+	if len(text) >= 2 and text[0] == text[-1] == '"':
+		return text[1:-1].replace('""', '"')
+	if text.upper() in ('TRUE', 'FALSE'):
+		return text.upper() == 'TRUE'
+	try:
+		return float(text)
+	except ValueError:
+		return text
+
+
+def _number_text(v):
+	if v == int(v) and abs(v) < 1e15:
+		return str(int(v))
+	# the 15 significant digits Excel keeps
+	return format(v, '.15g')
+
+
+def constant_node(value):
+	if isinstance(value, bool):
+		return ASTNode(Token('TRUE' if value else 'FALSE', 'operand', 'logical'))
+	if isinstance(value, float):
+		if value < 0:
+			# a negative constant is a prefix minus, as the parser would build it
+			node = OperatorNode(Token('-', 'operator-prefix', ''))
+			node.args = [constant_node(-value)]
+			return node
+		return ASTNode(Token(_number_text(value), 'operand', 'number'))
+	return ASTNode(Token(value, 'operand', 'text'))
+
+
+def has_empty_argument(parser):
+	# F(a,,b), F(,a) or F(a,): arguments the expression tree would drop
+	items = parser.tokens.items if parser.tokens else []
+	for i, t in enumerate(items):
+		if t.ttype == XlsTokens.TT_ARGUMENT:
+			before, after = items[i - 1], items[i + 1:i + 2]
+			if (before.ttype == XlsTokens.TT_ARGUMENT or before.ttype == XlsTokens.TT_FUNCTION and before.tsubtype == XlsTokens.TS_START
+					or after and after[0].ttype == XlsTokens.TT_FUNCTION and after[0].tsubtype == XlsTokens.TS_STOP):
+				return True
+	return False
+
+
+def value_of(node):
+	# Constant value of a (folded) node, or _NOT_CONSTANT
+	t = node.token
+	if t.ttype == 'operand':
+		if t.tsubtype == 'number':
+			return float(t.tvalue)
+		if t.tsubtype == 'text':
+			return t.tvalue
+		if t.tsubtype == 'logical':
+			return t.tvalue.upper() == 'TRUE'
+	elif t.ttype == 'operator-prefix' and t.tvalue == '-':
+		v = value_of(node.args[0])
+		if isinstance(v, float):
+			return -v
+	return _NOT_CONSTANT
+
+
+# ------------------------------------------------------------------------
+# Excel value semantics (None: the result would be an error)
+# ------------------------------------------------------------------------
+def _to_number(v):
+	if isinstance(v, bool):
+		return 1.0 if v else 0.0
+	if isinstance(v, float):
+		return v
+	try:
+		return float(v.strip()) if v.strip() else None
+	except ValueError:
+		return None
+
+
+def _to_text(v):
+	if isinstance(v, bool):
+		return 'TRUE' if v else 'FALSE'
+	if isinstance(v, float):
+		return _number_text(v)
+	return v
+
+
+def _to_logical(v):
+	if isinstance(v, bool):
+		return v
+	if isinstance(v, float):
+		return v != 0
+	return None
+
+
+def _compare(op, a, b):
+	# numbers < text < logicals; text compares case-insensitively
+	def key(v):
+		if isinstance(v, bool):
+			return 2, v
+		if isinstance(v, float):
+			return 0, v
+		return 1, v.upper()
+	ka, kb = key(a), key(b)
+	return {'=': ka == kb, '<>': ka != kb, '<': ka < kb, '>': ka > kb, '<=': ka <= kb, '>=': ka >= kb}[op]
+
+
+def _arithmetic(op, a, b):
+	a, b = _to_number(a), _to_number(b)
+	if a is None or b is None:
+		return None
+	try:
+		if op == '+':
+			r = a + b
+		elif op == '-':
+			r = a - b
+		elif op == '*':
+			r = a * b
+		elif op == '/':
+			r = a / b
+		else:
+			r = a ** b
+	except (ZeroDivisionError, OverflowError, ValueError):
+		return None
+	return r if isinstance(r, float) and math.isfinite(r) else None
+
+
+def _operator(node, values):
+	t = node.token
+	if t.ttype == 'operator-prefix':
+		v = _to_number(values[0])
+		return None if v is None else (-v if t.tvalue == '-' else v)
+	if t.ttype == 'operator-postfix':
+		v = _to_number(values[0])
+		return None if v is None else v / 100.0
+	a, b = values
+	if t.tvalue == '&':
+		return _to_text(a) + _to_text(b)
+	if t.tvalue in _COMPARISONS:
+		return _compare(t.tvalue, a, b)
+	if t.tvalue in ('+', '-', '*', '/', '^'):
+		return _arithmetic(t.tvalue, a, b)
+	return None
+
+
+def _text_function(name, values):
+	if name == 'LEN':
+		return float(len(_to_text(values[0])))
+	if name in ('UPPER', 'LOWER', 'TRIM'):
+		s = _to_text(values[0])
+		if name == 'TRIM':
+			return ' '.join(w for w in s.split(' ') if w)
+		return s.upper() if name == 'UPPER' else s.lower()
+	if name in ('LEFT', 'RIGHT'):
+		s = _to_text(values[0])
+		n = _to_number(values[1]) if len(values) > 1 else 1.0
+		if n is None or n < 0:
+			return None
+		n = int(n)
+		return s[:n] if name == 'LEFT' else (s[-n:] if n else '')
+	if name == 'MID':
+		s = _to_text(values[0])
+		start, n = _to_number(values[1]), _to_number(values[2])
+		if start is None or n is None or start < 1 or n < 0:
+			return None
+		return s[int(start) - 1:int(start) - 1 + int(n)]
+	if name in ('CONCATENATE', 'CONCAT'):
+		return ''.join(_to_text(v) for v in values)
+	return None
+
+
+def _math_function(name, values):
+	numbers = [_to_number(v) for v in values]
+	if any(n is None for n in numbers):
+		return None
+	if name == 'ABS':
+		return abs(numbers[0])
+	if name == 'INT':
+		return float(math.floor(numbers[0]))
+	if name in ('VALUE', 'NUMBERVALUE') and len(values) == 1:
+		return numbers[0] if not isinstance(values[0], bool) else None
+	if name == 'ROUND' and len(numbers) == 2:
+		scale = 10 ** int(numbers[1])
+		return math.floor(abs(numbers[0]) * scale + 0.5) / scale * (1 if numbers[0] >= 0 else -1)
+	if name == 'MOD' and len(numbers) == 2 and numbers[1]:
+		return numbers[0] - numbers[1] * math.floor(numbers[0] / numbers[1])
+	if name in ('SUM', 'MIN', 'MAX') and numbers:
+		return sum(numbers) if name == 'SUM' else min(numbers) if name == 'MIN' else max(numbers)
+	return None
+
+
+# pure functions folded when every argument is a constant: name -> (folder, min args, max args)
+_PURE = {
+	'LEN': (_text_function, 1, 1),
+	'UPPER': (_text_function, 1, 1),
+	'LOWER': (_text_function, 1, 1),
+	'TRIM': (_text_function, 1, 1),
+	'LEFT': (_text_function, 1, 2),
+	'RIGHT': (_text_function, 1, 2),
+	'MID': (_text_function, 3, 3),
+	'CONCATENATE': (_text_function, 1, 255),
+	'CONCAT': (_text_function, 1, 255),
+	'ABS': (_math_function, 1, 1),
+	'INT': (_math_function, 1, 1),
+	'VALUE': (_math_function, 1, 1),
+	'NUMBERVALUE': (_math_function, 1, 1),
+	'ROUND': (_math_function, 2, 2),
+	'MOD': (_math_function, 2, 2),
+	'SUM': (_math_function, 1, 255),
+	'MIN': (_math_function, 1, 255),
+	'MAX': (_math_function, 1, 255),
+}
+
+
+# ========================================================================
+#       Class: Specializer
+# Description: Folds formulas for one set of pinned parameters
+#
+#  Attributes:        params - Reference (upper case) -> value
+#              short_circuit - Fold AND/OR on a deciding constant even when
+#                              the other arguments might raise an error
+#
+#     Methods: Node   - fold(node) - Folded copy of an AST
+#              Tuple  - specialize(formula) - (formula, dropped references)
+# ========================================================================
+class Specializer:
+	def __init__(self, params, short_circuit=False):
+		self.params = dict((k.upper(), v) for k, v in params.items())
+		self.short_circuit = short_circuit
+
+	def fold(self, node):
+		if isinstance(node, RangeNode):
+			key = node.token.tvalue.upper()
+			return constant_node(self.params[key]) if key in self.params else node
+
+		args = getattr(node, 'args', None)
+		if not args:
+			return node
+		copy = node.__class__(node.token)
+		copy.args = [self.fold(a) for a in args]
+		copy.num_args = len(copy.args)
+
+		if isinstance(copy, OperatorNode):
+			return self._fold_operator(copy)
+		if isinstance(copy, FunctionNode):
+			return self._fold_function(copy)
+		return copy
+
+	def _fold_operator(self, node):
+		if node.token.tsubtype in ('union', 'intersect') or node.token.tvalue == ':':
+			return node
+		values = [value_of(a) for a in node.args]
+		if any(v is _NOT_CONSTANT for v in values):
+			return node
+		result = _operator(node, values)
+		return node if result is None else constant_node(result)
+
+	def _fold_function(self, node):
+		name = node.token.tvalue.upper()
+		args = node.args
+		values = [value_of(a) for a in args]
+
+		if name == 'IF' and 2 <= len(args) <= 3:
+			c = _to_logical(values[0]) if values[0] is not _NOT_CONSTANT else None
+			if c is None:
+				return node
+			if c:
+				return args[1]
+			return args[2] if len(args) == 3 else constant_node(False)
+
+		if name in ('IFERROR', 'IFNA') and len(args) == 2:
+			# folding never produces an error, so a constant first argument is the result
+			return args[0] if values[0] is not _NOT_CONSTANT else node
+
+		if name in ('AND', 'OR'):
+			decide = name == 'OR'
+			kept = []
+			decided = False
+			for a, v in zip(args, values):
+				b = _to_logical(v) if v is not _NOT_CONSTANT else None
+				if b is None:
+					kept.append(a)
+				elif b == decide:
+					decided = True
+			if decided and (not kept or self.short_circuit):
+				return constant_node(decide)
+			if not kept:
+				return constant_node(not decide)
+			if decided:
+				# the other arguments are still evaluated, and their errors propagated
+				kept.append(constant_node(decide))
+			if len(kept) < len(args):
+				node.args = kept
+				node.num_args = len(kept)
+			return node
+
+		if name == 'NOT' and len(args) == 1:
+			b = _to_logical(values[0]) if values[0] is not _NOT_CONSTANT else None
+			return node if b is None else constant_node(not b)
+
+		if name in _PURE and _PURE[name][1] <= len(args) <= _PURE[name][2] and not any(v is _NOT_CONSTANT for v in values):
+			result = _PURE[name][0](name, values)
+			if result is not None:
+				return constant_node(result)
+		return node
+
+	def specialize(self, formula):
+		# -> (folded formula with '=', references no longer used); the formula is returned unchanged when nothing folds
+		if not formula or not formula.lstrip(' =').strip() or has_empty_argument(XlsParser(formula)):
+			return formula, []
+		ast = get_ast(formula)
+		folded = '=' + self.fold(ast).emit()
+		if folded == '=' + ast.emit():
+			return formula, []
+		before = XlsParser(formula).dependencies()
+		after = set(r.upper() for r in XlsParser(folded).dependencies())
+		return folded, [r for r in before if r.upper() not in after]
+
+
+########################################################################################################################
+
+if __name__ == '__main__':
+
+	from xlsfiles import read_raw, write_tidy
+
+	args = sys.argv[1:]
+	short_circuit = '--short-circuit' in args
+	if short_circuit:
+		args.remove('--short-circuit')
+	if len(args) < 2:
+		print('usage: python specialize.py <name>_raw.txt Name=value [...] [--short-circuit]')
+		sys.exit(2)
+
+	params = {}
+	for a in args[1:]:
+		k, v = a.split('=', 1)
+		params[k] = parse_value(v)
+	specializer = Specializer(params, short_circuit)
+
+	with open(args[0], 'r') as ff:
+		for name, body in read_raw(ff):
+			folded, dropped = specializer.specialize(body)
+			if folded == body:
+				continue
+			print('=' * 100)
+			print(name + (': no longer depends on ' + ', '.join(dropped) if dropped else ''))
+			write_tidy(sys.stdout, [(name, XlsParser(folded).xlstidy())])
@@ -0,0 +1,101 @@
+# ========================================================================
+# Description: Start-up budget of the command line entry points
+#
+#              The tools run as many short-lived processes, so the import
+#              cost of each entry point (best of N runs of -X importtime,
+#              interpreter start-up excluded) is checked against its
+#              budget.  Modules that must stay lazy are checked not to be
+#              loaded.  The runs share a bytecode cache kept in a
+#              temporary directory (PYTHONPYCACHEPREFIX), warmed by a
+#              first import, so the source tree is left untouched.
+#
+#       Usage: python startup.py [--runs N]
+#              exit status 1 when a budget is exceeded
+# ========================================================================
+import os
+import subprocess
+import sys
+import tempfile
+from os.path import abspath, dirname
+
+HERE = dirname(abspath(__file__))
+
+# entry point -> milliseconds allowed for its import
+BUDGETS = {
+	'tokenizer': 8.0,
+	'xlsfiles': 8.0,
+	'untidy': 10.0,
+	'xlscheck': 10.0,
+	'tsort': 2.0,
+	'tidyxls': 2.0,
+}
+
+# modules an entry point must not load at import
+LAZY = {
+	'tokenizer': ('xlsast', 're'),
+	'untidy': ('xlsast', 're'),
+	'xlscheck': ('xlsast', 're'),
+	'tsort': ('functools', 'tokenizer'),
+	'tidyxls': ('tokenizer',),
+}
+
+
+def environment(cache):
+	# Environment of the measured runs: bytecode written to and read from `cache`
+	env = dict(os.environ, PYTHONPYCACHEPREFIX=cache)
+	env.pop('PYTHONDONTWRITEBYTECODE', None)
+	return env
+
+
+def _import_time(module, env=None):
+	# Cumulative import time of the module, from the interpreter's own -X importtime trace (us)
+	trace = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+		cwd=HERE, env=env, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, check=True).stderr.decode()
+	for line in trace.splitlines():
+		fields = line.split('|')
+		if len(fields) == 3 and fields[2].rstrip() == ' ' + module:
+			return int(fields[1])
+	raise ValueError('no import time for {0} in the -X importtime trace'.format(module))
+
+
+def measure(module, runs=20, env=None):
+	# -> best of `runs` import times of the module, in milliseconds
+	return min(_import_time(module, env) for _ in range(runs)) / 1000.0
+
+
+def loaded(module, names, env=None):
+	# -> the names among `names` that importing `module` loads
+	code = 'import sys, {0}; print(" ".join(n for n in {1!r} if n in sys.modules))'.format(module, tuple(names))
+	return subprocess.check_output([sys.executable, '-c', code], cwd=HERE, env=env).decode().split()
+
+
+########################################################################################################################
+
+if __name__ == '__main__':
+
+	args = sys.argv[1:]
+	runs = 20
+	if '--runs' in args:
+		i = args.index('--runs')
+		runs = int(args[i + 1])
+		del args[i:i + 2]
+
+	failed = False
+	with tempfile.TemporaryDirectory(prefix='startup-') as cache:
+		env = environment(cache)
+		for module, budget in sorted(BUDGETS.items()):
+			try:
+				# short-lived runs reuse the bytecode cache; the first import fills it
+				loaded(module, (), env)
+				ms = measure(module, runs, env)
+			except (subprocess.CalledProcessError, ValueError) as e:
+				failed = True
+				print('{0:<4}  {1:<10}  {2}'.format('FAIL', module, e))
+				continue
+			eager = loaded(module, LAZY.get(module, ()), env)
+			ok = ms <= budget and not eager
+			failed = failed or not ok
+			print('{0:<4}  {1:<10}  {2:6.1f} ms  (budget {3:.1f} ms){4}'.format(
+				'OK' if ok else 'SLOW', module, ms, budget, '  loads ' + ', '.join(eager) if eager else ''))
+
+	sys.exit(1 if failed else 0)
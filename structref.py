@@ -0,0 +1,317 @@
+# ========================================================================
+# Description: Excel structured (table) references
+#
+#              [@MainOrder]                       -> this row of column MainOrder
+#              JDEDataTable[[IsHW66]:[IsHW66]]    -> column span of JDEDataTable
+#              'parts'!PartNumFiltersTable[[Part '#]:[Part '#]]
+#              T[[#Headers],[#Data],[A]:[B]]
+#
+#              parse() decomposes a range operand into path, table, column
+#              span and row specifiers; ColumnIndex interns tables and
+#              columns so that later passes compare integer IDs instead
+#              of re-parsing strings; column_graph() is the dependency
+#              graph of a table's calculated columns, as tsort takes it;
+#              split_path() separates the workbook/sheet prefix of any
+#              other range operand (A1 ranges, defined names).
+# ========================================================================
+import collections
+
+from tokenizer import XlsParser, XlsTokens
+
+# Row specifiers, canonical spelling
+SPECIFIERS = {
+	'#all': '#All',
+	'#data': '#Data',
+	'#headers': '#Headers',
+	'#totals': '#Totals',
+	'#this row': '#This Row',
+}
+THIS_ROW = '#This Row'
+
+
+# ========================================================================
+#       Class: StructRef
+# Description: A decomposed structured reference
+#
+#  Attributes:       path - Workbook/sheet prefix, unquoted ('' if none)
+#                   table - Table name ('' for the formula's own table)
+#                   first - First column of the span (None: whole table)
+#                    last - Last column of the span
+#              specifiers - Row specifiers, e.g. ('#This Row',) for '@'
+# ========================================================================
+class StructRef(collections.namedtuple('StructRef', 'path table first last specifiers')):
+	__slots__ = ()
+
+	@property
+	def this_row(self):
+		return THIS_ROW in self.specifiers
+
+	def columns(self):
+		# The span as a tuple of one or two column names
+		if self.first is None:
+			return ()
+		return (self.first,) if self.first == self.last else (self.first, self.last)
+
+
+def _unescape(name):
+	# ' escapes [ ] # and ' inside column names
+	out = []
+	i = 0
+	while i < len(name):
+		if name[i] == "'" and i + 1 < len(name):
+			i += 1
+		out.append(name[i])
+		i += 1
+	return ''.join(out)
+
+
+def _closing(text, i):
+	# Index of the ']' matching the '[' at text[i], or -1
+	depth = 0
+	n = len(text)
+	while i < n:
+		c = text[i]
+		if c == "'":
+			i += 2
+			continue
+		if c == '[':
+			depth += 1
+		elif c == ']':
+			depth -= 1
+			if depth == 0:
+				return i
+		i += 1
+	return -1
+
+
+def _split_prefix(prefix):
+	# "'parts'!PartNumFiltersTable" -> ('parts', 'PartNumFiltersTable')
+	if prefix.startswith("'"):
+		end = prefix.rfind("'!")
+		if end <= 0:
+			return None
+		return prefix[1:end].replace("''", "'"), prefix[end + 2:]
+	if '!' in prefix:
+		path, table = prefix.rsplit('!', 1)
+		return path, table
+	return '', prefix
+
+
+def split_path(text):
+	# Range operand -> (path, rest): "'[wb.xlsx]Sheet'!$A$1" -> ('[wb.xlsx]Sheet', '$A$1'), 'Name' -> ('', 'Name')
+	prefix = _split_prefix(text)
+	return prefix if prefix is not None else ('', text)
+
+
+def _parse_body(body):
+	# Contents of the outer brackets -> (specifiers, columns)
+	specs = []
+	columns = []
+
+	if '[' not in body.replace("'[", ''):
+		# simple form: [Col], [@Col], [#Data]
+		if body.startswith('@'):
+			specs.append(THIS_ROW)
+			body = body[1:]
+		if body:
+			key = body.lower()
+			if key in SPECIFIERS:
+				specs.append(SPECIFIERS[key])
+			else:
+				columns.append(_unescape(body))
+		return specs, columns
+
+	i = 0
+	n = len(body)
+	while i < n:
+		c = body[i]
+		if c == '@':
+			specs.append(THIS_ROW)
+			i += 1
+		elif c == '[':
+			j = _closing(body, i)
+			if j < 0:
+				return None
+			name = body[i + 1:j]
+			key = name.lower()
+			if key in SPECIFIERS:
+				specs.append(SPECIFIERS[key])
+			else:
+				columns.append(_unescape(name))
+			i = j + 1
+		elif c in ',: ':
+			i += 1
+		else:
+			return None
+	return specs, columns
+
+
+def _skip_quoted(text, i):
+	# Index just past the quoted path starting at text[i] ('' is an embedded quote), or -1
+	n = len(text)
+	i += 1
+	while i < n:
+		if text[i] == "'":
+			if text[i + 1:i + 2] != "'":
+				return i + 1
+			i += 1
+		i += 1
+	return -1
+
+
+# parse() results kept, least recently used dropped first: bounded for long-running processes
+CACHE_SIZE = 4096
+_cache = collections.OrderedDict()
+
+
+def parse(text):
+	# Range operand -> StructRef, or None if it is not a structured reference (A1, named range...)
+	try:
+		ref = _cache[text]
+		_cache.move_to_end(text)
+		return ref
+	except KeyError:
+		pass
+
+	ref = None
+	i = _skip_quoted(text, 0) if text.startswith("'") else 0
+	start = text.find('[', i) if i >= 0 else -1
+	if start >= 0:
+		if _closing(text, start) == len(text) - 1:
+			prefix = _split_prefix(text[:start])
+			body = _parse_body(text[start + 1:-1])
+			if prefix is not None and body is not None:
+				specs, columns = body
+				first = columns[0] if columns else None
+				last = columns[-1] if columns else None
+				ref = StructRef(prefix[0], prefix[1], first, last, tuple(specs))
+		else:
+			# 'x'!T[A]:'x'!T[B] - the two halves of a column span
+			ref = _parse_span(text)
+
+	while len(_cache) >= CACHE_SIZE:
+		_cache.popitem(last=False)
+	_cache[text] = ref
+	return ref
+
+
+def _parse_span(text):
+	i = 0
+	n = len(text)
+	while i < n:
+		c = text[i]
+		if c == "'":
+			i = _skip_quoted(text, i)
+			if i < 0:
+				return None
+		elif c == '[':
+			j = _closing(text, i)
+			if j < 0:
+				return None
+			i = j + 1
+		elif c == ':':
+			a = parse(text[:i])
+			b = parse(text[i + 1:])
+			if a is None or b is None or (a.path, a.table.lower()) != (b.path, b.table.lower()):
+				return None
+			return StructRef(a.path, a.table, a.first, b.last, a.specifiers)
+		else:
+			i += 1
+	return None
+
+
+# ========================================================================
+#       Class: ColumnIndex
+# Description: Interned tables and columns of one or more formulas
+#
+#              Names are matched case-insensitively (as Excel does) and
+#              keep the spelling they were first seen with.
+#
+#  Attributes:   default - Table of unqualified references ([@Col])
+#                 tables - Table names, by table ID
+#                columns - Per table ID: column names, by column ID
+#
+#     Methods: Int     - table_id(path, table)
+#              Int     - column_id(table_id, column)
+#              Tuple   - intern(ref) - (table ID, first ID, last ID, specifiers)
+#              Tuple   - resolve(text) - intern(parse(text)) or None
+#              String  - name(table_id, column_id) - Back from IDs to names
+#              List    - references(items) - Interned keys found in a token list
+# ========================================================================
+class ColumnIndex:
+	def __init__(self, default=''):
+		self.default = default
+		self.tables = []
+		self.columns = []
+		self._table_ids = {}
+		self._column_ids = []
+		self._resolved = {}
+
+	def table_id(self, path, table):
+		key = (path.lower(), (table or self.default).lower())
+		tid = self._table_ids.get(key)
+		if tid is None:
+			tid = len(self.tables)
+			self._table_ids[key] = tid
+			self.tables.append((path, table or self.default))
+			self.columns.append([])
+			self._column_ids.append({})
+		return tid
+
+	def column_id(self, tid, column):
+		ids = self._column_ids[tid]
+		key = column.lower()
+		cid = ids.get(key)
+		if cid is None:
+			cid = len(self.columns[tid])
+			ids[key] = cid
+			self.columns[tid].append(column)
+		return cid
+
+	def intern(self, ref):
+		tid = self.table_id(ref.path, ref.table)
+		if ref.first is None:
+			return tid, None, None, ref.specifiers
+		return tid, self.column_id(tid, ref.first), self.column_id(tid, ref.last), ref.specifiers
+
+	def resolve(self, text):
+		try:
+			return self._resolved[text]
+		except KeyError:
+			pass
+		ref = parse(text)
+		key = self.intern(ref) if ref is not None else None
+		self._resolved[text] = key
+		return key
+
+	def name(self, tid, cid=None):
+		return self.tables[tid][1] if cid is None else self.columns[tid][cid]
+
+	def references(self, items):
+		# Interned keys of the structured references among a token list (XlsParser.items)
+		o = []
+		for t in items:
+			if t.ttype == XlsTokens.TT_OPERAND and t.tsubtype == XlsTokens.TS_RANGE:
+				key = self.resolve(t.tvalue)
+				if key is not None and key not in o:
+					o.append(key)
+		return o
+
+
+def column_graph(formulas, table=''):
+	# formulas: iterable of (column, body) -> OrderedDict column -> set of what it reads:
+	# columns of its own table by name, other tables as Table[Column], anything else as written
+	formulas = [(name, body) for name, body in formulas if body.lstrip().startswith('=')]
+	spelling = dict((name.lower(), name) for name, body in formulas)
+	graph = collections.OrderedDict()
+	for name, body in formulas:
+		deps = graph[name] = set()
+		for text in XlsParser(body).dependencies():
+			ref = parse(text)
+			if ref is None or ref.first is None:
+				deps.add(text if ref is None else ref.table)
+			elif not ref.table or ref.table.lower() == table.lower():
+				deps.update(spelling.get(c.lower(), c) for c in ref.columns())
+			else:
+				deps.update('{0}[{1}]'.format(ref.table, c) for c in ref.columns())
+	return graph
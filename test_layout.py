@@ -0,0 +1,72 @@
+# ========================================================================
+# Description: Width layouts stay within the width wherever they can
+#
+#       Usage: python -m unittest test_layout
+# ========================================================================
+import glob
+import unittest
+from os.path import dirname, join
+
+from tokenizer import XlsLayout, XlsParser
+from xlsfiles import read_raw
+
+HERE = dirname(__file__)
+
+
+def first_break(line, tab_width=4):
+	# Column just after the first call's opening bracket (a possible break), or None
+	quote = None
+	for i, c in enumerate(line):
+		if quote:
+			if c == quote:
+				quote = None
+		elif c in '"\'':
+			quote = c
+		elif c == '(' and i and (line[i - 1].isalnum() or line[i - 1] in '._'):
+			return len(line[:i + 1].expandtabs(tab_width))
+	return None
+
+
+def overflows(layout, formula):
+	# Lines longer than the width although they could have been broken in time
+	o = []
+	for line in layout.format(XlsParser(formula).items).split('\n'):
+		column = first_break(line, layout.tab_width)
+		if len(line.expandtabs(layout.tab_width)) > layout.width and column is not None and column <= layout.width:
+			o.append(line)
+	return o
+
+
+class Width(unittest.TestCase):
+	def formulas(self):
+		for filename in sorted(glob.glob(join(HERE, '*_raw.txt'))):
+			with open(filename, 'r') as ff:
+				for name, body in read_raw(ff):
+					if body.startswith('='):
+						yield name, body
+
+	def check(self, layout):
+		for name, body in self.formulas():
+			self.assertEqual(overflows(layout, body), [], name)
+
+	def test_presets(self):
+		self.check(XlsLayout.get('width'))
+		self.check(XlsLayout.get('compact'))
+
+	def test_narrow(self):
+		for width in (30, 60):
+			self.check(XlsLayout(width=width, breaks={'IF': XlsLayout.ALWAYS}))
+			self.check(XlsLayout(width=width, indent='  ', leading_comma=False))
+
+	def test_suffix(self):
+		# SUMIF(...) alone fits in 22 columns, not with the '>0' that follows it
+		layout = XlsLayout(width=22)
+		self.assertEqual(layout.format(XlsParser('=IF(SUMIF(A:A,B1,C:C)>0,1,2)').items),
+			'IF(\n\tSUMIF(\n\t\tA:A\n\t\t,B1\n\t\t,C:C\n\t)>0\n\t,1\n\t,2\n)')
+		layout = XlsLayout(width=23)
+		self.assertEqual(layout.format(XlsParser('=IF(SUMIF(A:A,B1,C:C)>0,1,2)').items),
+			'IF(\n\tSUMIF(A:A,B1,C:C)>0\n\t,1\n\t,2\n)')
+
+
+if __name__ == '__main__':
+	unittest.main()
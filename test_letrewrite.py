@@ -0,0 +1,30 @@
+# ========================================================================
+# Description: letrewrite binds only what Excel evaluates anyway
+#
+#       Usage: python -m unittest test_letrewrite
+# ========================================================================
+import unittest
+
+from letrewrite import dedup
+
+# formula -> rewritten
+CASES = [
+	('=IF(SUM(A1:A2)>0,SUM(A1:A2),1)', '=LET(_x1,SUM(A1:A2),IF(_x1>0,_x1,1))'),
+	('=IF(SUM(A1:A2)>0, SUM(A1:A2),1)', '=LET(_x1,SUM(A1:A2),IF(_x1>0,_x1,1))'),
+	('=SUM(T[V])+IF([@A],SUM(T[V]),0)', '=LET(_x1,SUM(T[V]),_x1+IF([@A],_x1,0))'),
+	# only evaluated in a branch
+	('=IF([@A]>0,SUM(T[V])/[@A],SUM(T[V])*2)', '=IF([@A]>0,SUM(T[V])/[@A],SUM(T[V])*2)'),
+	# empty arguments, which the expression tree would drop
+	('=IF(SUM(A1:A2)>0,,SUM(A1:A2))', '=IF(SUM(A1:A2)>0,,SUM(A1:A2))'),
+	('=MID("abc",SUM(A1),)&SUM(A1)', '=MID("abc",SUM(A1),)&SUM(A1)'),
+]
+
+
+class Dedup(unittest.TestCase):
+	def test_cases(self):
+		for formula, rewritten in CASES:
+			self.assertEqual(dedup(formula)[0], rewritten, formula)
+
+
+if __name__ == '__main__':
+	unittest.main()
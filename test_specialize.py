@@ -0,0 +1,37 @@
+# ========================================================================
+# Description: specialize folds without changing what Excel computes
+#
+#       Usage: python -m unittest test_specialize
+# ========================================================================
+import unittest
+
+from specialize import Specializer
+
+# formula -> folded with X = 1
+CASES = [
+	('=IF(X,1,2)', '=1'),
+	('=IF(X=2,"a",[@B])', '=[@B]'),
+	('=IF(X,,2)', '=IF(X,,2)'),
+	('=IFERROR(X,,)', '=IFERROR(X,,)'),
+	('=LEFT("abc",X)&MID("abc",2,)', '=LEFT("abc",X)&MID("abc",2,)'),
+	('=OR(X=1,FALSE)', '=TRUE'),
+	('=AND(X=1,[@B])', '=AND([@B])'),
+	('=OR(X=1,1/[@B])', '=OR(TRUE,1/[@B])'),
+	('=OR(TRUE,1/0)', '=OR(TRUE,1/0)'),
+]
+
+
+class Folding(unittest.TestCase):
+	def test_cases(self):
+		specializer = Specializer({'X': 1.0})
+		for formula, folded in CASES:
+			self.assertEqual(specializer.specialize(formula)[0], folded, formula)
+
+	def test_short_circuit(self):
+		# opt-in: the deciding constant wins, errors of the other arguments are lost
+		specializer = Specializer({'X': 1.0}, short_circuit=True)
+		self.assertEqual(specializer.specialize('=OR(X=1,1/[@B])')[0], '=TRUE')
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,65 @@
+# ========================================================================
+# Description: xlscolumns files read back with pyarrow (skipped without it)
+#
+#       Usage: python -m unittest test_xlscolumns
+# ========================================================================
+import importlib.util
+import tempfile
+import unittest
+from os.path import join
+
+import xlscolumns
+from tokenizer import XlsParser
+from xlsfiles import write_raw
+
+FORMULAS = [
+	('Total', 'SUMIF(Parts[[Key]:[Key]],[@Key],Parts[[Qty]:[Qty]])*2'),
+	('Flag', 'IF(OR([@A]="x",[@A]="y"),1,0)'),
+	('Cell', "'[Book.xlsx]S'!A1+CurY"),
+	('Blank', ''),
+]
+
+
+@unittest.skipUnless(importlib.util.find_spec('pyarrow'), 'pyarrow is not installed')
+class RoundTrip(unittest.TestCase):
+	def expected(self):
+		tokens, edges = [], []
+		for name, body in FORMULAS:
+			if body:
+				p = XlsParser('=' + body)
+				tokens.extend(xlscolumns.token_rows('t_raw.txt', name, p.items))
+				edges.extend(xlscolumns.edge_rows('t_raw.txt', name, p.dependencies()))
+		return tokens, edges
+
+	def read(self, filename, fmt):
+		import pyarrow as pa
+		if fmt == 'parquet':
+			import pyarrow.parquet as pq
+			table = pq.read_table(filename)
+		else:
+			with pa.memory_map(filename) as source:
+				table = pa.ipc.open_file(source).read_all()
+		return [tuple(row[c] for c in table.column_names) for row in table.to_pylist()]
+
+	def check(self, fmt):
+		with tempfile.TemporaryDirectory() as out_dir:
+			raw = join(out_dir, 't_raw.txt')
+			with open(raw, 'w') as ff:
+				write_raw(ff, FORMULAS)
+			tokens, edges = self.expected()
+			# a batch smaller than the output: several record batches per file
+			self.assertEqual(xlscolumns.export([raw], out_dir, fmt, batch=5), (len(tokens), len(edges)))
+
+			decoded = [r[:3] + (xlscolumns.TOKEN_TYPES[r[3]], xlscolumns.TOKEN_SUBTYPES[r[4]]) + r[5:] for r in tokens]
+			self.assertEqual(self.read(join(out_dir, 'tokens.' + fmt), fmt), decoded)
+			self.assertEqual(self.read(join(out_dir, 'edges.' + fmt), fmt), edges)
+
+	def test_parquet(self):
+		self.check('parquet')
+
+	def test_arrow(self):
+		self.check('arrow')
+
+
+if __name__ == '__main__':
+	unittest.main()
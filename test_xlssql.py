@@ -0,0 +1,73 @@
+# ========================================================================
+# Description: xlssql results checked against Excel on a reference table
+#
+#       Usage: python -m unittest test_xlssql
+# ========================================================================
+import sqlite3
+import unittest
+
+from xlssql import compile_table, schema_of
+
+# Key, A, B, Note (NULL: blank cell)
+ROWS = [
+	('k1', 2, 0, None),
+	('k2', 4, 1, 'x'),
+	('K1', 3, 2, ''),
+]
+PARTS = [
+	('k1', 'one'),
+	('k2', 'two'),
+]
+
+# column -> (formula, values Excel computes on ROWS)
+EXPECTED = [
+	('Err', '=IFERROR(IF([@A]/[@B]>1,"big","small"),"err")', ['err', 'big', 'big']),
+	('OrErr', '=IFERROR(OR(TRUE,[@A]/[@B]>1),"err")', ['err', 1, 1]),
+	('AndErr', '=IF(AND([@B]>0,[@A]/[@B]>1),"y","n")', [None, 'y', 'y']),
+	('Half', '="n"&[@A]/2', ['n1', 'n2', 'n1.5']),
+	('Concat', '=[@A]&"-"&([@A]*1.5)', ['2-3', '4-6', '3-4.5']),
+	('Blank', '=IFERROR([@Note],"err")', ['', 'x', '']),
+	('Grade', '=IF([@A]>3,"hi",IF([@A]>2,"mid","lo"))', ['lo', 'hi', 'mid']),
+	('SumA', '=SUMIF([Key],[@Key],[A])', [5, 4, 5]),
+	('Name', '=IFERROR(VLOOKUP([@Key],Parts[[Key]:[Name]],2,FALSE),"none")', ['one', 'two', 'one']),
+	('Year', '=IF([@A]>CurY,"after","before")', ['before', 'after', 'before']),
+]
+
+
+class ReferenceTable(unittest.TestCase):
+	def setUp(self):
+		self.conn = sqlite3.connect(':memory:')
+		self.conn.execute('CREATE TABLE T (Key, A, B, Note)')
+		self.conn.executemany('INSERT INTO T VALUES (?, ?, ?, ?)', ROWS)
+		self.conn.execute('CREATE TABLE Parts (Key, Name)')
+		self.conn.executemany('INSERT INTO Parts VALUES (?, ?)', PARTS)
+
+	def tearDown(self):
+		self.conn.close()
+
+	def test_results(self):
+		plan = compile_table([(c, f) for c, f, v in EXPECTED], 'T', schema_of(self.conn))
+		self.assertEqual(dict(plan.rejected), {})
+		plan.run(self.conn, {'CurY': 3})
+		for column, formula, values in EXPECTED:
+			got = [r[0] for r in self.conn.execute('SELECT "{0}" FROM T ORDER BY rowid'.format(column))]
+			self.assertEqual(got, values, formula)
+
+	def test_own_lookup(self):
+		# Key, A, B, Note, L, D: a VLOOKUP into the table itself reads D, ordered after it even before D is in the schema
+		formulas = [('L', '=VLOOKUP([@Key],T[[Key]:[D]],6,FALSE)'), ('D', '=[@A]*10')]
+		plan = compile_table(formulas, 'T', schema_of(self.conn))
+		self.assertEqual(dict(plan.rejected), {})
+		self.assertEqual([level.columns for level in plan.levels], [['D'], ['L']])
+		plan.run(self.conn)
+		got = [r[0] for r in self.conn.execute('SELECT L FROM T ORDER BY rowid')]
+		self.assertEqual(got, [20, 40, 20])
+
+	def test_rejected(self):
+		# IFNA cannot tell #N/A from the other errors but around a VLOOKUP
+		plan = compile_table([('Na', '=IFNA([@A]/[@B],0)'), ('Dep', '=[@Na]+1')], 'T', schema_of(self.conn))
+		self.assertEqual(list(plan.rejected), ['Na', 'Dep'])
+
+
+if __name__ == '__main__':
+	unittest.main()
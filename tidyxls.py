@@ -1,5 +1,3 @@
-from tokenizer import XlsParser, XlsTokens
-
 ############################################
 
 expr = (
@@ -18,6 +16,8 @@ def print_tokens(tokens):
 
 
 if __name__ == '__main__':
+    from tokenizer import XlsParser
+
     for e in expr:
         print_tokens(XlsParser(e).items)
         print(XlsParser(e, ';').xlstidy())
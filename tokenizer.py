@@ -2,7 +2,6 @@
 # Description: Tokenise an Excel formula using an implementation of
 # ========================================================================
 import collections
-import re
 
 
 # ========================================================================
@@ -169,40 +168,445 @@ class TokenStack(XlsTokens):
 		return ((self.token()) and [(self.token()).tsubtype] or [""])[0]
 
 
+# ========================================================================
+#       Class: Diagnostic
+# Description: A problem found while scanning a formula
+#
+#  Attributes:    kind - One of the kinds below
+#               offset - Offset in the formula as given
+#                 text - Offending text
+#              context - Enclosing functions, outermost first ('(' for a
+#                        subexpression)
+# ========================================================================
+class Diagnostic(collections.namedtuple('Diagnostic', 'kind offset text context')):
+	__slots__ = ()
+
+	# Kinds
+	UNEXPECTED = 'unexpected'               # text before a quote, '#' or '{'
+	UNMATCHED_CLOSE = 'unmatched-close'     # ')' '}' or row delimiter with nothing open
+	MISMATCHED_CLOSE = 'mismatched-close'   # ')' closing an array, '}' closing a function...
+	UNCLOSED = 'unclosed'                   # function, subexpression or array open at the end
+	UNTERMINATED = 'unterminated'           # string, path, [..] or error value open at the end
+
+	def __str__(self):
+		where = ' in ' + ' > '.join(self.context) if self.context else ''
+		return '{0} {1!r} at {2}{3}'.format(self.kind, self.text, self.offset, where)
+
+
+# ========================================================================
+#       Class: Metrics
+# Description: Size and nesting of a formula, counted by the scan itself
+#
+#  Attributes:     length - Characters of the formula (without '=')
+#                  tokens - Tokens of the stream
+#                   depth - Deepest nesting of calls and parentheses
+#                if_depth - Deepest nesting of conditionals (CONDITIONALS)
+#               functions - Function calls
+#                   calls - Function name -> number of calls
+#                operands - Operands (constants and references)
+#              references - Distinct references (fan-out)
+# ========================================================================
+Metrics = collections.namedtuple('Metrics', 'length tokens depth if_depth functions calls operands references')
+
+CONDITIONALS = ('IF', 'IFS', 'IFERROR', 'IFNA', 'SWITCH')
+
+
+# ========================================================================
+#       Class: ParseError
+# Description: A formula that cannot be turned into an expression tree
+#
+#  Attributes: diagnostics - Diagnostics of the scan, when available
+# ========================================================================
+class ParseError(Exception):
+	def __init__(self, message, diagnostics=()):
+		Exception.__init__(self, message)
+		self.diagnostics = list(diagnostics)
+
+
+# ========================================================================
+#       Class: XlsLocale
+# Description: Input conventions of a (localised) Excel formula
+#
+#  Attributes:      arg_sep - List (function argument / union) separator
+#                   decimal - Decimal mark of numeric constants
+#                   col_sep - Array constant column delimiter
+#                   row_sep - Array constant row delimiter
+#                 logicals  - Localised TRUE/FALSE -> canonical TRUE/FALSE
+#                 dispatch  - Special character -> scanner action, compiled
+#                             once per profile from the attributes above
+#
+#     Methods: Boolean     - sci_notation(token) - Mantissa awaiting its exponent sign?
+#              XlsLocale   - get(name) - Return a registered profile
+#              None        - register(name, locale) - Add a profile
+# ========================================================================
+class XlsLocale:
+	# Scanner actions
+	K_STRING = 1
+	K_PATH = 2
+	K_RANGE = 3
+	K_ERROR = 4
+	K_ARRAY_START = 5
+	K_ARRAY_STOP = 6
+	K_ROW = 7
+	K_COLUMN = 8
+	K_ARGUMENT = 9
+	K_ARG_OR_ROW = 10
+	K_SPACE = 11
+	K_COMPARE = 12
+	K_SIGN = 13
+	K_INFIX = 14
+	K_POSTFIX = 15
+	K_OPEN = 16
+	K_CLOSE = 17
+
+	_profiles = {}
+
+	def __init__(self, arg_sep=',', decimal='.', col_sep=',', row_sep=';', true='TRUE', false='FALSE'):
+		self.arg_sep = arg_sep
+		self.decimal = decimal
+		self.col_sep = col_sep
+		self.row_sep = row_sep
+		self.logicals = {'TRUE': 'TRUE', 'FALSE': 'FALSE', true: 'TRUE', false: 'FALSE'}
+
+		dispatch = {
+			'"': self.K_STRING,
+			"'": self.K_PATH,
+			'[': self.K_RANGE,
+			'#': self.K_ERROR,
+			'{': self.K_ARRAY_START,
+			'}': self.K_ARRAY_STOP,
+			' ': self.K_SPACE,
+			'>': self.K_COMPARE,
+			'<': self.K_COMPARE,
+			'+': self.K_SIGN,
+			'-': self.K_SIGN,
+			'*': self.K_INFIX,
+			'/': self.K_INFIX,
+			'^': self.K_INFIX,
+			'&': self.K_INFIX,
+			'=': self.K_INFIX,
+			'%': self.K_POSTFIX,
+			'(': self.K_OPEN,
+			')': self.K_CLOSE,
+		}
+		if col_sep != arg_sep:
+			dispatch[col_sep] = self.K_COLUMN
+		dispatch[row_sep] = self.K_ROW
+		dispatch[arg_sep] = self.K_ARG_OR_ROW if arg_sep == row_sep else self.K_ARGUMENT
+		self.dispatch = dispatch
+
+	def sci_notation(self, token):
+		# '1E', '2.5e': the sign that follows is part of the number ([1-9](<decimal>[0-9]+)?[eE])
+		n = len(token)
+		if n < 2 or token[0] not in '123456789' or token[-1] not in 'eE':
+			return False
+		if n == 2:
+			return True
+		return n > 3 and token[1] == self.decimal and all(c in '0123456789' for c in token[2:-1])
+
+	@classmethod
+	def get(cls, name):
+		return cls._profiles[name]
+
+	@classmethod
+	def register(cls, name, locale):
+		cls._profiles[name] = locale
+
+
+XlsLocale.register('en', XlsLocale())
+XlsLocale.register('it', XlsLocale(arg_sep=';', decimal=',', col_sep='.', row_sep=';', true='VERO', false='FALSO'))
+
+
+# ========================================================================
+#       Class: XlsLayout
+# Description: Line breaking and indentation of tidy formulas
+#
+#              A Wadler/Oppen style pretty printer over the call tree:
+#              every call nests its arguments one level deeper, and a call
+#              is laid out either flat, F(a,b), or broken, one argument
+#              per line.  Flat widths are measured once, bottom-up, so the
+#              layout is linear in the formula length.
+#
+#  Attributes:     width - Target line width (columns)
+#                 indent - One indentation level ('\t' or spaces)
+#              tab_width - Columns of a tab when measuring
+#                 breaks - Function -> ALWAYS / NEVER / AUTO
+#                default - Policy of the functions not in breaks
+#          leading_comma - Separator at the start (True) or end of a line
+#
+#              AUTO breaks a call when it does not fit in the remaining
+#              width, together with the text that follows it up to the
+#              next possible break (a ',' or ')', a '>0'...), as Oppen's
+#              algorithm does; a call holding an ALWAYS call never fits.
+#
+#     Methods: XlsLayout   - get(name) - Return a registered preset
+#              None        - register(name, layout) - Add a preset
+#              String      - format(items, spans) - Lay out XlsParser.items
+#              Tuple       - fragment(items, level) - Lay out one call argument
+#              Boolean     - relocatable() - Text of a call independent of its column?
+# ========================================================================
+class XlsLayout:
+	ALWAYS = 'always'
+	NEVER = 'never'
+	AUTO = 'auto'
+
+	_presets = {}
+
+	def __init__(self, width=100, indent='\t', tab_width=4, breaks=None, default=AUTO, leading_comma=True):
+		self.width = width
+		self.indent = indent
+		self.tab_width = tab_width
+		self.breaks = dict((k.upper(), v) for k, v in (breaks or {}).items())
+		self.default = default
+		self.leading_comma = leading_comma
+		self._indent_cols = len(indent.expandtabs(tab_width))
+
+	@classmethod
+	def get(cls, name):
+		return cls._presets[name]
+
+	@classmethod
+	def register(cls, name, layout):
+		cls._presets[name] = layout
+
+	def policy(self, name):
+		if name in ('ARRAY', 'ARRAYROW'):
+			return self.NEVER
+		return self.breaks.get(name.upper(), self.default)
+
+	# --------------------------------------------------------------------
+	# call tree
+	# --------------------------------------------------------------------
+	class _Call:
+		__slots__ = ('name', 'sep', 'args', 'closed', 'width', 'index')
+
+		def __init__(self, name, index=-1):
+			self.name = name
+			self.sep = ','
+			self.args = [[]]
+			self.closed = False
+			self.width = 0
+			self.index = index
+
+	def _tree(self, items):
+		root = self._Call('')
+		stack = [root]
+		for i, t in enumerate(items):
+			tv, tt, ts = t.get()
+			top = stack[-1]
+			if tt == XlsTokens.TT_FUNCTION:
+				if ts == XlsTokens.TS_START:
+					call = self._Call(tv, i)
+					top.args[-1].append(call)
+					stack.append(call)
+				elif ts == XlsTokens.TS_STOP and len(stack) > 1:
+					top.closed = True
+					stack.pop()
+			elif tt == XlsTokens.TT_ARGUMENT:
+				if ts != XlsTokens.TS_START:
+					top.sep = ';' if top.name == 'ARRAY' else tv
+					top.args.append([])
+			elif tt == XlsTokens.TT_OPERAND:
+				top.args[-1].append('"' + tv.replace('"', '""') + '"' if ts == XlsTokens.TS_TEXT else tv)
+			elif tt == XlsTokens.TT_SUBEXPR:
+				top.args[-1].append('(' if ts == XlsTokens.TS_START else ')')
+			elif tt == XlsTokens.TT_OP_IN:
+				top.args[-1].append(' ' if ts == XlsTokens.TS_INTERSECT else tv)
+			elif tt in (XlsTokens.TT_OP_PRE, XlsTokens.TT_OP_POST):
+				top.args[-1].append(tv)
+		return root
+
+	def _brackets(self, call):
+		if call.name == 'ARRAY':
+			return '{', '}' if call.closed else ''
+		if call.name == 'ARRAYROW':
+			return '', ''
+		return call.name + '(', ')' if call.closed else ''
+
+	def _measure(self, call):
+		# Flat width of every call, None when it holds an ALWAYS call (it cannot be flat)
+		width = 0
+		for arg in call.args:
+			for part in arg:
+				w = len(part) if isinstance(part, str) else self._measure(part)
+				width = None if w is None or width is None else width + w
+		if width is not None:
+			open_, close = self._brackets(call)
+			width += len(open_) + len(close) + len(call.sep) * (len(call.args) - 1)
+		call.width = width if self.policy(call.name) != self.ALWAYS else None
+		return call.width
+
+	# --------------------------------------------------------------------
+	# layout
+	# --------------------------------------------------------------------
+	def relocatable(self):
+		# Without AUTO calls the text of a call only depends on its level, not on its column
+		return self.default != self.AUTO and self.AUTO not in self.breaks.values()
+
+	def format(self, items, spans=None):
+		# spans: if a dict, receives item index of each call -> [(start, end)] offsets of its arguments in the output
+		root = self._tree(items)
+		for arg in root.args:
+			for part in arg:
+				if not isinstance(part, str):
+					self._measure(part)
+
+		# separators outside any call are kept inline
+		out = []
+		col = 0
+		rests = self._rests(root, False, 0)
+		for k, arg in enumerate(root.args):
+			if k:
+				out.append(root.sep)
+				col += len(root.sep)
+			for part, rest in zip(arg, rests[k]):
+				col = self._emit(part, 0, col, out, spans, rest)
+		return self._join(out, spans)
+
+	def fragment(self, items, level):
+		# The items of one call argument laid out at `level` -> (text, spans), for relocatable layouts
+		root = self._tree(items)
+		spans = {}
+		out = []
+		for part in root.args[0]:
+			if not isinstance(part, str):
+				self._measure(part)
+			self._emit(part, level, 0, out, spans)
+		return self._join(out, spans), spans
+
+	@staticmethod
+	def _join(out, spans):
+		if spans:
+			# spans were recorded as indices into out
+			ends = [0]
+			for s in out:
+				ends.append(ends[-1] + len(s))
+			for index, args in spans.items():
+				spans[index] = [(ends[a], ends[b]) for a, b in args]
+		return ''.join(out)
+
+	def _newline(self, level, out):
+		out.append('\n' + self.indent * level)
+		return level * self._indent_cols
+
+	def _rests(self, call, broken, rest):
+		# Per argument, per part: columns that follow the part up to the next possible line break
+		# (rest: the same for the call itself)
+		close = self._brackets(call)[1]
+		last = len(call.args) - 1
+		rests = [None] * len(call.args)
+		after = len(close) + rest
+		for k in range(last, -1, -1):
+			if not broken:
+				cur = after
+			elif k == last:
+				# the closing bracket goes on a new line
+				cur = 0 if call.closed else rest
+			else:
+				cur = 0 if self.leading_comma else len(call.sep)
+			arg = call.args[k]
+			rests[k] = parts = [0] * len(arg)
+			for j in range(len(arg) - 1, -1, -1):
+				parts[j] = cur
+				p = arg[j]
+				if isinstance(p, str):
+					cur += len(p)
+				elif self.policy(p.name) == self.NEVER and p.width is not None:
+					cur += p.width
+				else:
+					# a call that can break may do so right after its opening bracket
+					cur = len(self._brackets(p)[0])
+			after = len(call.sep) + cur
+		return rests
+
+	def _emit(self, part, level, col, out, spans=None, rest=0):
+		if isinstance(part, str):
+			out.append(part)
+			return col + len(part)
+
+		call = part
+		policy = self.policy(call.name)
+		broken = policy == self.ALWAYS or policy == self.AUTO and (call.width is None or col + call.width + rest > self.width)
+		rests = self._rests(call, broken, rest)
+
+		open_, close = self._brackets(call)
+		out.append(open_)
+		col += len(open_)
+		last = len(call.args) - 1
+		if spans is not None:
+			args = spans[call.index] = []
+		for k, arg in enumerate(call.args):
+			if broken:
+				col = self._newline(level + 1, out)
+				if k and self.leading_comma:
+					out.append(call.sep)
+					col += len(call.sep)
+			elif k:
+				out.append(call.sep)
+				col += len(call.sep)
+			start = len(out)
+			for p, r in zip(arg, rests[k]):
+				col = self._emit(p, level + 1, col, out, spans, r)
+			if spans is not None:
+				args.append((start, len(out)))
+			if broken and k < last and not self.leading_comma:
+				out.append(call.sep)
+				col += len(call.sep)
+		if broken and call.closed:
+			col = self._newline(level, out)
+		out.append(close)
+		return col + len(close)
+
+
+# the layout of the committed *_tidy.txt snapshots
+XlsLayout.register('classic', XlsLayout(
+	width=None, breaks=dict.fromkeys(('IF', 'IFERROR', 'AND', 'OR', 'NOT', 'LET'), XlsLayout.ALWAYS), default=XlsLayout.NEVER))
+# conditionals always broken, anything else only when it does not fit
+XlsLayout.register('width', XlsLayout(
+	width=100, breaks=dict.fromkeys(('IF', 'IFS', 'IFERROR', 'SWITCH', 'LET'), XlsLayout.ALWAYS)))
+# as compact as the width allows, 4-space indent and trailing commas
+XlsLayout.register('compact', XlsLayout(width=100, indent='    ', leading_comma=False))
+
+
 # ========================================================================
 #       Class: XlsParser(formula)
 # Description: Parse an Excel formula into a stream of tokens
 #
-#  Attributes:
+#  Attributes: diagnostics - Diagnostic of every problem met by the scan
+#                  unknown - (offset, text) of the unexpected tokens
+#                  metrics - Metrics of the formula
 #
 #     Methods: Tokens - parse(formula) - return a token stream (list)
 # ========================================================================
 class XlsParser(XlsTokens):
-	def __init__(self, formula='', arg_sep=','):
+	# Opt-in instrumentation (see xlsstats.py); None costs one attribute test per phase
+	stats = None
+
+	def __init__(self, formula='', arg_sep=',', locale='en'):
 		self._formula = formula
 		self._arg_sep = arg_sep
+		self._locale = locale if isinstance(locale, XlsLocale) else XlsLocale.get(locale)
 		self.items = []
+		self.tokens = None
+		self.diagnostics = []
+		self.metrics = None
 		self._parse()
 
+	@property
+	def unknown(self):
+		return [(d.offset, d.text) for d in self.diagnostics if d.kind == Diagnostic.UNEXPECTED]
+
+	@property
+	def valid(self):
+		return not self.diagnostics
+
 	def _get_tokens(self):
-		def current_char():
-			return self._formula[offset]
-
-		def double_char():
-			return self._formula[offset:offset + 2]
-
-		def next_char():
-			# JavaScript returns an empty string if the index is out of bounds,
-			# Python throws an IndexError.  We mimic this behaviour here.
-			try:
-				self._formula[offset + 1]
-			except IndexError:
-				return ""
-			else:
-				return self._formula[offset + 1]
+		stats = XlsParser.stats
+		if stats is not None:
+			mark = stats.mark()
 
-		def eof():
-			return offset >= len(self._formula)
+		loc = self._locale
+		dispatch = loc.dispatch
 
 		tokens = Tokens()
 		token_stack = TokenStack()
@@ -210,26 +614,37 @@ class XlsParser(XlsTokens):
 		token = ""
 		in_string = False
 		in_path = False
+		path_start = 0
 		in_range = False
 		in_error = False
+		depth = 0
+		conditionals = 0
+		if_depth = 0
+
+		formula = self._formula.lstrip(' ')
+		if formula[0:1] == '=':
+			formula = formula[1:]
+		# problems are collected as they are met, offsets into the formula as given
+		diagnostics = self.diagnostics = []
+		skipped = len(self._formula) - len(formula)
+		literal_start = 0
+		self._formula = formula
+		n = len(formula)
 
-		while len(self._formula) > 0:
-			if self._formula[0] == ' ':
-				self._formula = self._formula[1:]
-			else:
-				if self._formula[0] == '=':
-					self._formula = self._formula[1:]
-				break
+		def diagnose(kind, at, text):
+			context = tuple(t.tvalue or '(' for t in token_stack.items)
+			diagnostics.append(Diagnostic(kind, skipped + at, text, context))
 
 			# state-dependent character evaluation (order is important)
-		while not eof():
+		while offset < n:
+			c = formula[offset]
 
 			# double-quoted strings
 			# embeds are doubled
 			# end marks token
 			if in_string:
-				if current_char() == '"':
-					if next_char() == '"':
+				if c == '"':
+					if formula[offset + 1:offset + 2] == '"':
 						token += '"'
 						offset += 1
 					else:
@@ -237,7 +652,7 @@ class XlsParser(XlsTokens):
 						tokens.add(token, self.TT_OPERAND, self.TS_TEXT)
 						token = ""
 				else:
-					token += current_char()
+					token += c
 				offset += 1
 				continue
 
@@ -245,15 +660,15 @@ class XlsParser(XlsTokens):
 			# embeds are double
 			# end does not mark a token
 			if in_path:
-				if current_char() == "'":
-					if next_char() == "'":
-						token += "'"
+				if c == "'":
+					if formula[offset + 1:offset + 2] == "'":
+						token += "''"
 						offset += 1
 					else:
-						token = "'" + token + "'"
+						token = token[:path_start] + "'" + token[path_start:] + "'"
 						in_path = False
 				else:
-					token += current_char()
+					token += c
 				offset += 1
 				continue
 
@@ -261,16 +676,16 @@ class XlsParser(XlsTokens):
 			# no embeds (changed to "()" by Excel)
 			# end does not mark a token
 			if in_range:
-				if current_char() == ']':
+				if c == ']':
 					in_range = False
-				token += current_char()
+				token += c
 				offset += 1
 				continue
 
 			# error values
 			# end marks a token, determined from absolute list of values
 			if in_error:
-				token += current_char()
+				token += c
 				offset += 1
 				if ',#NULL!,#DIV/0!,#VALUE!,#REF!,#NAME?,#NUM!,#N/A,'.find(',' + token + ',') != -1:
 					in_error = False
@@ -278,56 +693,85 @@ class XlsParser(XlsTokens):
 					token = ""
 				continue
 
+			# independent character evaulation (order not important)
+			# the locale's dispatch table maps every special character to its action,
+			# anything else is accumulated into the current token
+			kind = dispatch.get(c)
+			if kind is None:
+				token += c
+				offset += 1
+				continue
+
 			# scientific notation check
-			regexsn = '^[1-9]{1}(\.[0-9]+)?[eE]{1}$'
-			if '+-'.find(current_char()) != -1:
+			if kind == XlsLocale.K_SIGN:
 				if len(token) > 1:
-					if re.match(regexsn, token):
-						token += current_char()
+					if loc.sci_notation(token):
+						token += c
 						offset += 1
 						continue
 
-			# independent character evaulation (order not important)
-			#
 			# establish state-dependent character evaluations
-			if current_char() == '"':
+			if kind == XlsLocale.K_STRING:
 				if len(token) > 0:
 					# not expected
+					diagnose(Diagnostic.UNEXPECTED, offset - len(token), token)
 					tokens.add(token, self.TT_UNKNOWN)
 					token = ""
 				in_string = True
+				literal_start = offset
 				offset += 1
 				continue
 
-			if current_char() == "'":
-				if len(token) > 0:
+			if kind == XlsLocale.K_PATH:
+				if len(token) > 0 and token[-1] != ':':
 					# not expected
+					diagnose(Diagnostic.UNEXPECTED, offset - len(token), token)
 					tokens.add(token, self.TT_UNKNOWN)
 					token = ""
+				# a quoted path may also start the second half of a range (...!A1:'path'!B2)
+				path_start = len(token)
 				in_path = True
+				literal_start = offset
 				offset += 1
 				continue
 
-			if current_char() == '[':
+			if kind == XlsLocale.K_RANGE:
 				in_range = True
-				token += current_char()
+				literal_start = offset
+				token += c
 				offset += 1
 				continue
 
-			if current_char() == '#':
+			if kind == XlsLocale.K_ERROR:
 				if len(token) > 0:
 					# not expected
+					diagnose(Diagnostic.UNEXPECTED, offset - len(token), token)
 					tokens.add(token, self.TT_UNKNOWN)
 					token = ""
 				in_error = True
-				token += current_char()
+				literal_start = offset
+				token += c
 				offset += 1
 				continue
 
+			# the array column delimiter is only special inside an array row
+			if kind == XlsLocale.K_COLUMN:
+				if token_stack.value() != 'ARRAYROW':
+					token += c
+					offset += 1
+					continue
+				kind = XlsLocale.K_ARGUMENT
+
+			# with locales where the list separator is also the array row delimiter
+			# the enclosing token decides what the character means
+			if kind == XlsLocale.K_ARG_OR_ROW:
+				kind = XlsLocale.K_ROW if token_stack.value() == 'ARRAYROW' else XlsLocale.K_ARGUMENT
+
 			# mark start and end of arrays and array rows
-			if current_char() == '{':
+			if kind == XlsLocale.K_ARRAY_START:
 				if len(token) > 0:
 					# not expected
+					diagnose(Diagnostic.UNEXPECTED, offset - len(token), token)
 					tokens.add(token, self.TT_UNKNOWN)
 					token = ""
 				token_stack.push(tokens.add('ARRAY', self.TT_FUNCTION, self.TS_START))
@@ -335,102 +779,131 @@ class XlsParser(XlsTokens):
 				offset += 1
 				continue
 
-			if current_char() == ';':
+			if kind == XlsLocale.K_ROW:
 				if len(token) > 0:
 					tokens.add(token, self.TT_OPERAND)
 					token = ""
+				if token_stack.value() != 'ARRAYROW':
+					diagnose(Diagnostic.MISMATCHED_CLOSE if token_stack.items else Diagnostic.UNMATCHED_CLOSE, offset, c)
 				tokens.add_ref(token_stack.pop())
 				tokens.add(',', self.TT_ARGUMENT)
 				token_stack.push(tokens.add('ARRAYROW', self.TT_FUNCTION, self.TS_START))
 				offset += 1
 				continue
 
-			if current_char() == '}':
+			if kind == XlsLocale.K_ARRAY_STOP:
 				if len(token) > 0:
 					tokens.add(token, self.TT_OPERAND)
 					token = ""
+				if len(token_stack.items) < 2 or token_stack.value() != 'ARRAYROW':
+					diagnose(Diagnostic.MISMATCHED_CLOSE if token_stack.items else Diagnostic.UNMATCHED_CLOSE, offset, c)
 				tokens.add_ref(token_stack.pop())
 				tokens.add_ref(token_stack.pop())
 				offset += 1
 				continue
 
 			# trim white-space
-			if current_char() == ' ':
+			if kind == XlsLocale.K_SPACE:
 				if len(token) > 0:
 					tokens.add(token, self.TT_OPERAND)
 					token = ""
 				tokens.add("", self.TT_WSPACE)
 				offset += 1
-				while (current_char() == ' ') and (not eof()):
+				while offset < n and formula[offset] == ' ':
 					offset += 1
 				continue
 
 			# multi-character comparators
-			if ',>=,<=,<>,'.find(',' + double_char() + ',') != -1:
-				if len(token) > 0:
-					tokens.add(token, self.TT_OPERAND)
-					token = ""
-				tokens.add(double_char(), self.TT_OP_IN, self.TS_LOGICAL)
-				offset += 2
-				continue
+			if kind == XlsLocale.K_COMPARE:
+				double_char = formula[offset:offset + 2]
+				if double_char in ('>=', '<=', '<>'):
+					if len(token) > 0:
+						tokens.add(token, self.TT_OPERAND)
+						token = ""
+					tokens.add(double_char, self.TT_OP_IN, self.TS_LOGICAL)
+					offset += 2
+					continue
+				kind = XlsLocale.K_INFIX
 
 			# standard infix operators
-			if '+-*/^&=><'.find(current_char()) != -1:
+			if kind == XlsLocale.K_INFIX or kind == XlsLocale.K_SIGN:
 				if len(token) > 0:
 					tokens.add(token, self.TT_OPERAND)
 					token = ""
-				tokens.add(current_char(), self.TT_OP_IN)
+				tokens.add(c, self.TT_OP_IN)
 				offset += 1
 				continue
 
 			# standard postfix operators
-			if '%'.find(current_char()) != -1:
+			if kind == XlsLocale.K_POSTFIX:
 				if len(token) > 0:
 					tokens.add(token, self.TT_OPERAND)
 					token = ""
-				tokens.add(current_char(), self.TT_OP_POST)
+				tokens.add(c, self.TT_OP_POST)
 				offset += 1
 				continue
 
 			# start subexpression or function
-			if current_char() == '(':
+			if kind == XlsLocale.K_OPEN:
 				if len(token) > 0:
 					token_stack.push(tokens.add(token, self.TT_FUNCTION, self.TS_START))
+					if token.lstrip('@').upper() in CONDITIONALS:
+						conditionals += 1
+						if conditionals > if_depth:
+							if_depth = conditionals
 					token = ""
 				else:
 					token_stack.push(tokens.add("", self.TT_SUBEXPR, self.TS_START))
+				if len(token_stack.items) > depth:
+					depth = len(token_stack.items)
 				offset += 1
 				continue
 
 			# function, subexpression, array parameters
-			if current_char() == ',':
+			# (always stored with the canonical ',' whatever the locale's separator)
+			if kind == XlsLocale.K_ARGUMENT:
 				if len(token) > 0:
 					tokens.add(token, self.TT_OPERAND)
 					token = ""
 				if not (token_stack.type() == self.TT_FUNCTION):
-					tokens.add(current_char(), self.TT_OP_IN, self.TS_UNION)
+					tokens.add(',', self.TT_OP_IN, self.TS_UNION)
 				else:
-					tokens.add(current_char(), self.TT_ARGUMENT)
+					tokens.add(',', self.TT_ARGUMENT)
 				offset += 1
 				continue
 
 			# stop subexpression
-			if current_char() == ')':
+			if kind == XlsLocale.K_CLOSE:
 				if len(token) > 0:
 					tokens.add(token, self.TT_OPERAND)
 					token = ""
+				if not token_stack.items:
+					diagnose(Diagnostic.UNMATCHED_CLOSE, offset, c)
+				elif token_stack.value() in ('ARRAY', 'ARRAYROW'):
+					diagnose(Diagnostic.MISMATCHED_CLOSE, offset, c)
+				elif conditionals and token_stack.value().lstrip('@').upper() in CONDITIONALS:
+					conditionals -= 1
 				tokens.add_ref(token_stack.pop())
 				offset += 1
 				continue
 
 			# token accumulation
-			token += current_char()
+			token += c
 			offset += 1
 
 		# dump remaining accumulation
 		if len(token) > 0:
 			tokens.add(token, self.TT_OPERAND)
 
+		if in_string or in_path or in_range or in_error:
+			diagnose(Diagnostic.UNTERMINATED, literal_start, formula[literal_start:])
+		while token_stack.items:
+			t = token_stack.items.pop()
+			diagnose(Diagnostic.UNCLOSED, n, t.tvalue + '(' if t.ttype == self.TT_FUNCTION else '(')
+
+		if stats is not None:
+			mark = stats.lap('scan', mark, len(tokens.items))
+
 		# move all tokens to a new collection, excluding all unnecessary white-space tokens
 		tokens2 = Tokens()
 
@@ -454,8 +927,13 @@ class XlsParser(XlsTokens):
 
 			tokens2.add_ref(token)
 
+		if stats is not None:
+			mark = stats.lap('cleanup', mark, len(tokens2.items))
+
 		# switch infix '-' operator to prefix when appropriate, switch infix '+' operator to noop when appropriate,
 		# identify operand and infix-operator subtypes, pull '@' from in front of function names
+		calls = {}
+		references = set()
 		while tokens2.move_next():
 			token = tokens2.current()
 			if token.ttype == self.TT_OP_IN and token.tvalue == '-':
@@ -492,31 +970,46 @@ class XlsParser(XlsTokens):
 				continue
 
 			if token.ttype == self.TT_OPERAND and len(token.tsubtype) == 0:
+				tvalue = token.tvalue if loc.decimal == '.' else token.tvalue.replace(loc.decimal, '.')
 				try:
-					float(token.tvalue)
+					float(tvalue)
 				except ValueError:  # as e:
-					if token.tvalue == 'TRUE' or token.tvalue == 'FALSE':
+					if token.tvalue in loc.logicals:
+						token.tvalue = loc.logicals[token.tvalue]
 						token.tsubtype = self.TS_LOGICAL
 					else:
 						token.tsubtype = self.TS_RANGE
+						references.add(token.tvalue)
 				else:
+					token.tvalue = tvalue
 					token.tsubtype = self.TS_NUMBER
 				continue
 
 			if token.ttype == self.TT_FUNCTION:
 				if token.tvalue[0:1] == '@':
 					token.tvalue = token.tvalue[1:]
+				if token.tsubtype == self.TS_START and token.tvalue not in ('ARRAY', 'ARRAYROW'):
+					name = token.tvalue.upper()
+					calls[name] = calls.get(name, 0) + 1
 				continue
 
 		tokens2.reset()
 
 		# move all tokens to a new collection, excluding all noops
 		tokens = Tokens()
+		operands = 0
 		while tokens2.move_next():
-			if tokens2.current().ttype != self.TT_NOOP:
-				tokens.add_ref(tokens2.current())
+			token = tokens2.current()
+			if token.ttype != self.TT_NOOP:
+				tokens.add_ref(token)
+				if token.ttype == self.TT_OPERAND:
+					operands += 1
 
 		tokens.reset()
+		self.metrics = Metrics(n, len(tokens.items), depth, if_depth, sum(calls.values()), calls, operands, len(references))
+
+		if stats is not None:
+			stats.lap('fixup', mark, len(tokens.items))
 		return tokens
 
 	def _parse(self, formula=None):
@@ -525,8 +1018,15 @@ class XlsParser(XlsTokens):
 		if not self._formula:
 			return
 
+		stats = XlsParser.stats
+		if stats is not None:
+			start = stats.mark()
+
 		self.tokens = self._get_tokens()
 
+		if stats is not None:
+			mark = stats.mark()
+
 		stack = []
 		for tok in self.tokens.items:
 			t = None
@@ -566,27 +1066,43 @@ class XlsParser(XlsTokens):
 			if t:
 				self.items.append(t)
 
+		if stats is not None:
+			stats.lap('parse', mark, len(self.items))
+			stats.formula(self._formula, start)
+
 	def render(self):
-		output = ""
+		out = []
+		func_stack = []
 		if self.tokens:
 			for t in self.tokens.items:
 				if t.ttype == self.TT_FUNCTION and t.tsubtype == self.TS_START:
-					output += t.tvalue + '('
+					func_stack.append(t.tvalue)
+					if t.tvalue == 'ARRAY':
+						out.append('{')
+					elif t.tvalue != 'ARRAYROW':
+						out.append(t.tvalue + '(')
 				elif t.ttype == self.TT_FUNCTION and t.tsubtype == self.TS_STOP:
-					output += ')'
+					fn = func_stack.pop() if func_stack else ''
+					if fn == 'ARRAY':
+						out.append('}')
+					elif fn != 'ARRAYROW':
+						out.append(')')
 				elif t.ttype == self.TT_SUBEXPR and t.tsubtype == self.TS_START:
-					output += '('
+					func_stack.append('')
+					out.append('(')
 				elif t.ttype == self.TT_SUBEXPR and t.tsubtype == self.TS_STOP:
-					output += ')'
-				# TODO: add in RE substitution of " with "" for strings
+					if func_stack:
+						func_stack.pop()
+					out.append(')')
+				elif t.ttype == self.TT_ARGUMENT:
+					out.append(';' if func_stack and func_stack[-1] == 'ARRAY' else self._arg_sep)
 				elif t.ttype == self.TT_OPERAND and t.tsubtype == self.TS_TEXT:
-					output += '"' + t.tvalue + '"'
+					out.append('"' + t.tvalue.replace('"', '""') + '"')
 				elif t.ttype == self.TT_OP_IN and t.tsubtype == self.TS_INTERSECT:
-					output += ' '
-
+					out.append(' ')
 				else:
-					output += t.tvalue
-		return output
+					out.append(t.tvalue)
+		return ''.join(out)
 
 	def prettyprint(self):
 		indent = 0
@@ -603,72 +1119,19 @@ class XlsParser(XlsTokens):
 					indent += 1
 		return output
 
-	def xlstidy(self):
-		func_stack = []
-
-		def sp(n=1):
-			return '\t' * n if n > 0 else ''
-
-		def push(fn):
-			func_stack.append(fn)
-
-		def pop():
-			return func_stack.pop()
-
-		def top(i=0):
-			x = len(func_stack) - 1 - i
-			return func_stack[x] if x >= 0 else None
-
-		def _do_nl():
-			fn = ('IF', 'IFERROR', 'AND', 'OR', 'NOT')
-			return '\n' if top() in fn else ''
-
-		def tidy(tokens, i=0, indent=''):
-			if not tokens:
-				return ''
-
-			nextindent = ''
-			o = ''
-			tv, tt, ts = tokens[0].get()
-
-			if tt == XlsTokens.TT_FUNCTION:
-				if ts == XlsTokens.TS_START:
-					push(tv)
-					o += indent + tv + '(' + _do_nl()
-					i += 1
-					nextindent = sp(i)
-				elif ts == XlsTokens.TS_STOP:
-					i -= 1
-					nextindent = sp(i) if _do_nl() else ''
-					o += _do_nl() + (sp(i) if _do_nl() else '') + ')'
-					pop()
-			elif tt == XlsTokens.TT_OPERAND:
-				if ts == XlsTokens.TS_TEXT:
-					o += '"' + tv + '"'
-				else:
-					o += tv
-			elif tt == XlsTokens.TT_ARGUMENT:
-				if ts == XlsTokens.TS_START:
-					o += sp(i) if _do_nl() else ''
-				else:
-					o += _do_nl() + (sp(i) if _do_nl() else '') + tv
-			elif tt == XlsTokens.TT_SUBEXPR:
-				if ts == XlsTokens.TS_START:
-					o += '('
-				elif ts == XlsTokens.TS_STOP:
-					o += ')'
-			elif tt == XlsTokens.TT_OP_PRE:
-				o += tv
-			elif tt == XlsTokens.TT_OP_POST:
-				o += tv
-			elif tt == XlsTokens.TT_OP_IN:
-				o += tv
-
-			return o + tidy(tokens[1:], i, nextindent)
+	def xlstidy(self, layout='classic'):
+		# layout: an XlsLayout or the name of a registered preset
+		if not isinstance(layout, XlsLayout):
+			layout = XlsLayout.get(layout)
 
-		#
-		return tidy(self.items)
+		stats = XlsParser.stats
+		if stats is None:
+			return layout.format(self.items)
 
+		mark = stats.mark()
+		o = layout.format(self.items)
+		stats.lap('tidy', mark)
+		return o
 
 	def dependencies(self):
 		o = []
@@ -682,218 +1145,39 @@ class XlsParser(XlsTokens):
 		return o
 
 
-class Operator:
-	def __init__(self, value, precedence, associativity):
-		self.value = value
-		self.precedence = precedence
-		self.associativity = associativity
+# ------------------------------------------------------------------------
+# Expression trees (RPN/AST) live in xlsast and are only imported on first use,
+# so that tokenizing and tidying do not pay for them
+# ------------------------------------------------------------------------
+_LAZY = {
+	'xlsast': ('Operator', 'operators', 'get_operator', 'ASTNode', 'OperatorNode', 'RangeNode', 'FunctionNode',
+				'create_node', 'get_rpn', 'get_ast', 'walk_ast'),
+}
+_lazy_names = dict((name, module) for module, names in _LAZY.items() for name in names)
 
 
-class ASTNode(object):
-	def __init__(self, token):
-		super(ASTNode, self).__init__()
-		self.token = token
+def __getattr__(name):
+	module = _lazy_names.get(name)
+	if module is None:
+		raise AttributeError("module 'tokenizer' has no attribute {0!r}".format(name))
+	value = getattr(__import__(module), name)
+	globals()[name] = value
+	return value
 
-	def emit(self):
-		return self.token.tvalue
-
-	def __str__(self):
-		return self.token.tvalue
-
-
-class OperatorNode(ASTNode):
-	def __init__(self, *args):
-		super(OperatorNode, self).__init__(*args)
-
-	def emit(self):
-		pass
-
-
-class RangeNode(ASTNode):
-	def __init__(self, *args):
-		super(RangeNode, self).__init__(*args)
-
-	def emit(self):
-		pass
-
-
-class FunctionNode(ASTNode):
-	def __init__(self, *args):
-		super(FunctionNode, self).__init__(*args)
-		self.num_args = 0
-
-	def emit(self):
-		pass
-
-
-def create_node(t):
-	if t.ttype == 'operand' and t.tsubtype == 'range':
-		return RangeNode(t)
-	elif t.ttype == 'function':
-		return FunctionNode(t)
-	elif t.ttype == 'operator':
-		return OperatorNode(t)
-	else:
-		return ASTNode(t)
-
-
-def get_rpn(expression):
-	# remove leading =
-	if expression.startswith('='):
-		expression = expression[1:]
-
-	p = XlsParser()
-	p._parse(expression)
-
-	# insert tokens for '(' and ')', to make things cleaner below
-	tokens = []
-	for t in p.tokens.items:
-		if t.ttype == 'function' and t.tsubtype == 'start':
-			t.tsubtype = ""
-			tokens.append(t)
-			tokens.append(Token('(', 'arglist', 'start'))
-		elif t.ttype == 'function' and t.tsubtype == 'stop':
-			# t.tsubtype = ""
-			# tokens.append(t)
-			tokens.append(Token(')', 'arglist', 'stop'))
-		elif t.ttype == 'subexpression' and t.tsubtype == 'start':
-			t.tvalue = '('
-			tokens.append(t)
-		elif t.ttype == 'subexpression' and t.tsubtype == 'stop':
-			t.tvalue = ')'
-			tokens.append(t)
-		else:
-			tokens.append(t)
-
-		# print('tokens: ', '|'.join([x.tvalue for x in tokens]))
-
-	# http://office.microsoft.com/en-us/excel-help/calculation-operators-and-precedence-HP010078886.aspx
-	operators = {
-		':': Operator(':', 8, 'left'),
-		'': Operator(' ', 8, 'left'),
-		',': Operator(',', 8, 'left'),
-		'u-': Operator('u-', 7, 'left'),
-		'%': Operator('%', 6, 'left'),
-		'^': Operator('^', 5, 'left'),
-		'*': Operator('*', 4, 'left'),
-		'/': Operator('/', 4, 'left'),
-		'+': Operator('+', 3, 'left'),
-		'-': Operator('-', 3, 'left'),
-		'&': Operator('&', 2, 'left'),
-		'=': Operator('=', 1, 'left'),
-		'<': Operator('<', 1, 'left'),
-		'>': Operator('>', 1, 'left'),
-		'<=': Operator('<=', 1, 'left'),
-		'>=': Operator('>=', 1, 'left'),
-		'<>': Operator('<>', 1, 'left')
-	}
-
-	output = collections.deque()
-	stack = []
-	were_values = []
-	arg_count = []
-
-	for t in tokens:
-		if t.ttype == 'operand':
-			output.append(create_node(t))
-
-			if were_values:
-				were_values.pop()
-				were_values.append(True)
-
-		elif t.ttype == 'function':
-			stack.append(t)
-			arg_count.append(0)
-			if were_values:
-				were_values.pop()
-				were_values.append(True)
-			were_values.append(False)
-
-		elif t.ttype == 'argument':
-			while stack and (stack[-1].tsubtype != 'start'):
-				output.append(create_node(stack.pop()))
-
-			if were_values.pop():
-				arg_count[-1] += 1
-			were_values.append(False)
-
-			if not len(stack):
-				raise Exception('Mismatched or misplaced parentheses')
-
-		elif t.ttype.startswith('operator'):
-			if t.ttype.endswith('-prefix') and t.tvalue == '-':
-				o1 = operators['u-']
-			else:
-				o1 = operators[t.tvalue]
-
-			while stack and stack[-1].ttype.startswith('operator'):
-
-				if stack[-1].ttype.endswith('-prefix') and stack[-1].tvalue == '-':
-					o2 = operators['u-']
-				else:
-					o2 = operators[stack[-1].tvalue]
-
-				if o1.associativity == 'left' and o1.precedence <= o2.precedence or o1.associativity == 'right' and o1.precedence < o2.precedence:
-					output.append(create_node(stack.pop()))
-				else:
-					break
-
-			stack.append(t)
-
-		elif t.tsubtype == 'start':
-			stack.append(t)
-
-		elif t.tsubtype == 'stop':
-			while stack and stack[-1].tsubtype != 'start':
-				output.append(create_node(stack.pop()))
-
-			if not stack:
-				raise Exception('Mismatched or misplaced parentheses')
-
-			stack.pop()
-
-			if stack and stack[-1].ttype == 'function':
-				f = create_node(stack.pop())
-				a = arg_count.pop()
-				w = were_values.pop()
-				if w:
-					a += 1
-				f.num_args = a
-				# print(f, 'has ', a, ' args')
-				output.append(f)
-
-	while stack:
-		if stack[-1].tsubtype == 'start' or stack[-1].tsubtype == 'stop':
-			raise Exception('Mismatched or misplaced parentheses')
-
-		output.append(create_node(stack.pop()))
-
-	# print('Stack is: ', '|'.join(stack))
-	# print('Ouput is: ', '|'.join([x.node.tvalue for x in output]))
-
-	return output
 
+# ----------------------------------------------------------------------------------------------------------------------
 
-def get_ast(expression):
-	rpn = get_rpn(expression)
-	stack = []
-	for n in rpn:
-		num_args = (
-			2 if n.token.ttype == 'operator-infix'
-			else 1 if n.token.ttype.startswith('operator')
-			else n.num_args if n.token.ttype == 'function'
-			else 0
-		)
-		n.args = [stack.pop() for _ in range(num_args)][::-1]
-		stack.append(n)
-	return stack[0]
+def untidy(lines, arg_sep=','):
+	# Join the indented lines produced by xlstidy() (any layout) back into a single-line formula
+	if isinstance(lines, str):
+		lines = lines.split('\n')
+	formula = ''.join([line.rstrip('\r').lstrip(' \t') for line in lines])
+	return XlsParser(formula, arg_sep).render()
 
 
-def walk_ast(ast):
-	yield ast
-	for arg in getattr(ast, 'args', []):
-		for n in walk_ast(arg):
-			yield n
+def compact(formula, arg_sep=','):
+	# Canonical single-line form of a raw formula (insignificant white-space dropped, no leading '=')
+	return XlsParser(formula, arg_sep).render()
 
 # ----------------------------------------------------------------------------------------------------------------------
 
@@ -910,20 +1194,11 @@ def	print_dependencies(formulas):
 
 ########################################################################################################################
 
-"""
-# Formato del file RAW:
->>>\tnome_formula
-testo_formula
-<<<
->>>\tnome_formula
-testo_formula
-<<<
-... ecc.
-"""
-
 if __name__ == '__main__':
 
+	import sys
 	from os.path import join, sep
+	from xlsfiles import read_raw_records, write_tidy
 
 	# ------------------------------------------------------------------------------------------------------------------
 
@@ -936,37 +1211,25 @@ if __name__ == '__main__':
 
 	# ------------------------------------------------------------------------------------------------------------------
 
-	formulas = []
-
 	with open(raw_filename, 'r') as ff:
-		formula_name = ''
-		formula_body = ''
-		for line in ff:
-			line = line.strip(' \t\n\r')
-
-			if line.startswith('>>>\t'):
-				formula_name = line.split('\t')[1]
-			elif line.startswith('<<<'):
-				if formula_name:
-					formulas.append((formula_name, formula_body))
-				formula_name = ''
-				formula_body = ''
-			else:
-				formula_body += line
+		records = list(read_raw_records(ff))
+	formulas = [(r.name, r.body) for r in records]
 
 ##	print_dependencies(formulas);	exit()
 
+	def tidy(record):
+		# problems are reported at their line of the RAW file
+		try:
+			parser = XlsParser(record.body)
+			for d in parser.diagnostics:
+				print('{0}: {1} {2!r} in {3}'.format(record.source.where(d.offset), d.kind, d.text, record.name), file=sys.stderr)
+			return record.name, parser.xlstidy()
+		except Exception as e:
+			print('{0}: {1} in {2}'.format(record.source.where(0), e, record.name), file=sys.stderr)
+			raise
+
 	with open(tidy_filename, 'w') as tidy_file:
-		for f in formulas:
-			for line in (
-						'-' * 100
-					,   '----- ' + f[0]
-					,   '-' * 100
-					,   XlsParser(f[1]).xlstidy()
-					,   '-' * 100
-					,   ''
-					):
-				tidy_file.write(line + '\n')
+		write_tidy(tidy_file, (tidy(r) for r in records))
 
 	# for node in get_rpn(e):
 	#    print('{0:15}\t{1:25}\t\t{2}'.format('Token type', 'Token value', 'Token sub-type'))
@@ -1,12 +1,10 @@
 #######################################################################################################
 ##	Topological sort
 
-from functools import reduce
-
 def tsort(data):
 	for k, v in data.items():
 		v.discard(k)  # Ignore self dependencies
-	extra_items_in_deps = reduce(set.union, data.values()) - set(data.keys())
+	extra_items_in_deps = set().union(*data.values()) - set(data.keys())
 	data.update({item: set() for item in extra_items_in_deps})
 	while True:
 		ordered = set(item for item, dep in data.items() if not dep)
@@ -17,6 +15,14 @@ def tsort(data):
 				if item not in ordered}
 	assert not data, "A cyclic dependency exists amongst %r" % data
 
+
+def levels(data):
+	# tsort() levels as lists of names, also for names containing spaces; data is left untouched
+	names = sorted(set(data).union(*data.values()))
+	ids = dict((name, '{0:06d}'.format(i)) for i, name in enumerate(names))
+	for level in tsort(dict((ids[k], set(ids[d] for d in v)) for k, v in data.items())):
+		yield [names[int(i)] for i in level.split()]
+
 ########################################################################################################
 
 if __name__ == "__main__":
@@ -0,0 +1,67 @@
+# ========================================================================
+# Description: Convert a TIDY file back to a RAW file of single-line formulas
+#
+#       Usage: python untidy.py <name>_tidy.txt [<name>_raw.txt] [--sep ;]
+#              python untidy.py --check [<name>_raw.txt ...]
+# ========================================================================
+import sys
+from os.path import dirname, join
+
+from tokenizer import XlsParser, compact, untidy
+from xlsfiles import read_raw, read_tidy, write_raw
+
+
+def tidy_to_raw(tidy_filename, raw_filename, arg_sep=','):
+	# Streaming: one banner block at a time is held in memory
+	with open(tidy_filename, 'r') as tidy_file, open(raw_filename, 'w') as raw_file:
+		write_raw(raw_file, ((name, untidy(lines, arg_sep)) for name, lines in read_tidy(tidy_file)))
+
+
+def check_roundtrip(raw_filename):
+	# raw -> tidy -> raw must give back the compact form of every formula
+	errors = []
+	with open(raw_filename, 'r') as ff:
+		for name, body in read_raw(ff):
+			if compact(body) != untidy(XlsParser(body).xlstidy()):
+				errors.append(name)
+	return errors
+
+
+def snapshots():
+	# glob pulls in re: only loaded when the snapshots are actually listed
+	import glob
+	here = dirname(__file__)
+	return sorted(glob.glob(join(here, '*_raw.txt')) + glob.glob(join(here, 'PreviousFormulaVersions', '*_raw.txt')))
+
+
+########################################################################################################################
+
+if __name__ == '__main__':
+
+	args = sys.argv[1:]
+
+	if args and args[0] == '--check':
+		failed = 0
+		for filename in args[1:] or snapshots():
+			errors = check_roundtrip(filename)
+			print('{0:6}\t{1}'.format('OK' if not errors else 'FAILED', filename))
+			for name in errors:
+				print('\t' + name)
+			failed += len(errors)
+		sys.exit(1 if failed else 0)
+
+	sep = ','
+	if '--sep' in args:
+		i = args.index('--sep')
+		sep = args[i + 1]
+		del args[i:i + 2]
+
+	if not args:
+		print('usage: python untidy.py <name>_tidy.txt [<name>_raw.txt] [--sep ;]')
+		print('       python untidy.py --check [<name>_raw.txt ...]')
+		sys.exit(2)
+
+	tidy_filename = args[0]
+	raw_filename = args[1] if len(args) > 1 else tidy_filename.rsplit('_tidy', 1)[0] + '_raw_new.txt'
+
+	tidy_to_raw(tidy_filename, raw_filename, sep)
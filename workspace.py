@@ -0,0 +1,293 @@
+# ========================================================================
+# Description: Formula models spread over several workbooks
+#
+#              A Workspace loads the RAW files of several workbooks
+#              (budget, lanes, parts...) and resolves the references of
+#              all their formulas into one symbol table: table columns,
+#              whole tables, defined names and cell ranges, each owned
+#              by a workbook.  A workbook is known by the name it is
+#              loaded with and by its aliases, e.g. the file name that
+#              external links spell out ('Part num filters.xlsx'),
+#              matched on the file name of the link, path or URL, case-
+#              insensitively and with or without the extension; links
+#              naming no loaded workbook stay external workbooks.
+#
+#              Resolution is memoized per (workbook, reference text), so
+#              the many formulas repeating [@Column] or a lookup table
+#              parse it once.  The graph links every calculated column
+#              to the symbols it reads across files, and impact() walks
+#              it backwards once for any set of changed symbols.
+#
+#       Usage: python workspace.py budget=budget_0929_raw.txt lanes_0929_raw.txt
+#                                  [--alias File.xlsx=name ...] [--table JDEDataTable]
+#                                  [--impact "parts!Table[Column]" ...]
+# ========================================================================
+import collections
+import sys
+
+import structref
+from tokenizer import XlsParser
+
+# Symbol kinds
+COLUMN = 'column'       # scope: table, name: column
+TABLE = 'table'         # scope: table
+NAME = 'name'           # defined name (named range)
+RANGE = 'range'         # scope: sheet, name: A1 range
+
+
+# ========================================================================
+#       Class: Symbol
+# Description: Anything a formula can read, owned by a workbook
+#
+#  Attributes:     kind - COLUMN, TABLE, NAME or RANGE
+#              workbook - Owning workbook (name it was loaded with)
+#                 scope - Table (COLUMN, TABLE) or sheet (RANGE, NAME of a
+#                         sheet), else ''
+#                  name - Column, defined name or A1 range, else ''
+# ========================================================================
+class Symbol(collections.namedtuple('Symbol', 'kind workbook scope name')):
+	__slots__ = ()
+
+	def __str__(self):
+		if self.kind == COLUMN:
+			return '{0}!{1}[{2}]'.format(self.workbook, self.scope, self.name)
+		if self.kind == TABLE:
+			return '{0}!{1}'.format(self.workbook, self.scope)
+		if self.kind == RANGE or self.scope:
+			return "'[{0}]{1}'!{2}".format(self.workbook, self.scope, self.name)
+		return '{0}!{1}'.format(self.workbook, self.name)
+
+
+def _split_book(path):
+	# Path of a reference -> (workbook, sheet): 'C:\\dir\\[Book.xlsx]Sheet' -> ('C:\\dir\\Book.xlsx', 'Sheet'),
+	# None as workbook when the path does not name one in brackets
+	start = path.find('[')
+	end = path.find(']', start + 1)
+	if start < 0 or end < 0:
+		return None, path
+	return path[:start] + path[start + 1:end], path[end + 1:]
+
+
+def _is_cells(text):
+	# A1 style range: A1, $A$1:$B$2, A:A, 1:1 (defined names are never one)
+	for part in text.replace('$', '').split(':'):
+		letters = part.rstrip('0123456789')
+		if not part or letters and not (letters.isalpha() and len(letters) <= 3):
+			return False
+	return True
+
+
+_EXTENSIONS = ('.xlsx', '.xlsm', '.xlsb', '.xls')
+
+
+def _basename(path):
+	# 'https://host/dir/Book.xlsx', 'C:\\dir\\Book.xlsx' -> 'Book.xlsx'
+	return path.replace('\\', '/').rsplit('/', 1)[-1]
+
+
+def _stem(path):
+	# Workbook path or URL -> lookup key: its file name, whatever the case and extension
+	key = _basename(path).lower()
+	for ext in _EXTENSIONS:
+		if key.endswith(ext):
+			return key[:-len(ext)]
+	return key
+
+
+# ========================================================================
+#       Class: Workspace
+# Description: Workbooks, their symbols and the cross-file graph
+#
+#  Attributes: workbooks - Workbook name -> table of its formulas
+#                symbols - Interned symbols, by symbol ID
+#                  graph - Calculated column ID -> set of symbol IDs it reads
+#
+#     Methods: None  - add(name, formulas, table, aliases) - Load a workbook
+#              None  - alias(path, name) - One more name for a workbook
+#              Tuple - resolve(workbook, text) - Symbol IDs a reference reads
+#              Int   - intern(kind, workbook, scope, name)
+#              Set   - impact(ids) - Calculated columns reading any of them
+# ========================================================================
+class Workspace:
+	def __init__(self, table='JDEDataTable'):
+		self.table = table
+		self.workbooks = collections.OrderedDict()
+		self.symbols = []
+		self._ids = {}
+		self._aliases = {}
+		self._formulas = []
+		self._resolved = {}
+		self._graph = None
+		self._readers = None
+
+	def add(self, name, formulas, table=None, aliases=()):
+		# formulas: iterable of (column, body) of the workbook's table
+		self.workbooks[name] = table or self.table
+		self.alias(name, name)
+		for path in aliases:
+			self.alias(path, name)
+		self._formulas.extend((name, column, body) for column, body in formulas if body.lstrip().startswith('='))
+		self._graph = None
+
+	def alias(self, path, name):
+		self._aliases[_stem(path)] = name
+		# what a path resolves to may have changed
+		self._resolved.clear()
+		self._graph = None
+
+	def workbook(self, path, default=''):
+		# Path of a reference -> owning workbook ('' is the referencing workbook)
+		if not path:
+			return default
+		return self._aliases.get(_stem(path), _basename(path))
+
+	def intern(self, kind, workbook, scope='', name=''):
+		key = (kind, _stem(workbook), scope.lower(), name.lower())
+		sid = self._ids.get(key)
+		if sid is None:
+			sid = self._ids[key] = len(self.symbols)
+			self.symbols.append(Symbol(kind, workbook, scope, name))
+		return sid
+
+	def resolve(self, workbook, text):
+		# Range operand of a formula of `workbook` -> tuple of the symbol IDs it reads
+		key = (workbook, text)
+		try:
+			return self._resolved[key]
+		except KeyError:
+			pass
+
+		ref = structref.parse(text)
+		if ref is not None:
+			# tables are workbook wide: the path names a workbook
+			book, sheet = _split_book(ref.path)
+			owner = self.workbook(ref.path if book is None else book, workbook)
+			table = ref.table or self.workbooks.get(owner, self.table)
+			if ref.first is None:
+				ids = (self.intern(TABLE, owner, table),)
+			else:
+				ids = tuple(self.intern(COLUMN, owner, table, c) for c in ref.columns())
+		else:
+			path, rest = structref.split_path(text)
+			book, sheet = _split_book(path)
+			if book is None and not _is_cells(rest) and self._is_workbook(path):
+				# parts!Name, 'Book.xlsx'!Name: a name of another workbook
+				book, sheet = path, ''
+			owner = workbook if book is None else self.workbook(book, workbook)
+			if _is_cells(rest):
+				ids = (self.intern(RANGE, owner, sheet, rest.replace('$', '').upper()),)
+			else:
+				# Sheet1!Name: a name scoped to a sheet
+				ids = (self.intern(NAME, owner, sheet, rest),)
+
+		self._resolved[key] = ids
+		return ids
+
+	def _is_workbook(self, path):
+		# a loaded or aliased workbook, or a file; anything else is a sheet
+		return _stem(path) in self._aliases or path.lower().endswith(_EXTENSIONS) or _basename(path) != path
+
+	@property
+	def graph(self):
+		if self._graph is None:
+			graph = collections.OrderedDict()
+			for workbook, column, body in self._formulas:
+				node = self.intern(COLUMN, workbook, self.workbooks[workbook], column)
+				deps = graph.setdefault(node, set())
+				for text in XlsParser(body).dependencies():
+					deps.update(self.resolve(workbook, text))
+			self._graph = graph
+			self._readers = None
+		return self._graph
+
+	def impact(self, ids):
+		# -> set of the calculated columns that read any of the symbols, directly or not
+		graph = self.graph
+		if self._readers is None:
+			readers = self._readers = {}
+			for node, deps in graph.items():
+				for d in deps:
+					readers.setdefault(d, []).append(node)
+		seen = set()
+		stack = list(ids)
+		while stack:
+			for node in self._readers.get(stack.pop(), ()):
+				if node not in seen:
+					seen.add(node)
+					stack.append(node)
+		return seen
+
+	def external(self):
+		# -> workbook -> number of symbols read from it, for the workbooks that are not loaded
+		o = collections.Counter()
+		for d in set().union(*self.graph.values()):
+			owner = self.symbols[d].workbook
+			if owner not in self.workbooks:
+				o[owner] += 1
+		return o
+
+
+########################################################################################################################
+
+if __name__ == '__main__':
+
+	from os.path import basename
+
+	from xlsfiles import read_raw
+
+	args = sys.argv[1:]
+
+	def option(flag, default):
+		if flag in args:
+			i = args.index(flag)
+			value = args[i + 1]
+			del args[i:i + 2]
+			return value
+		return default
+
+	workspace = Workspace(option('--table', 'JDEDataTable'))
+	aliases = []
+	while '--alias' in args:
+		aliases.append(option('--alias', None).rsplit('=', 1))
+	impacts = []
+	while '--impact' in args:
+		impacts.append(option('--impact', None))
+
+	if not args:
+		print('usage: python workspace.py [name=]<name>_raw.txt ... [--alias File.xlsx=name ...] [--table JDEDataTable] [--impact "book!Table[Column]" ...]')
+		sys.exit(2)
+
+	for arg in args:
+		name, path = arg.split('=', 1) if '=' in arg else (basename(arg).split('_')[0], arg)
+		with open(path, 'r') as ff:
+			workspace.add(name, read_raw(ff))
+	for path, name in aliases:
+		workspace.alias(path, name)
+
+	graph = workspace.graph
+	symbols = workspace.symbols
+	fmt = '{0:<12} {1:<16} {2:>8} {3:>6} {4:>11}'
+	print(fmt.format('WORKBOOK', 'TABLE', 'COLUMNS', 'READS', 'CROSS-FILE'))
+	for workbook, table in workspace.workbooks.items():
+		nodes = [n for n in graph if symbols[n].workbook == workbook]
+		reads = sum(len(graph[n]) for n in nodes)
+		cross = sum(1 for n in nodes for d in graph[n] if symbols[d].workbook != workbook)
+		print(fmt.format(workbook[:12], table[:16], len(nodes), reads, cross))
+
+	kinds = collections.Counter(s.kind for s in symbols)
+	print()
+	print('{0} symbols: {1}'.format(len(symbols), ', '.join('{0} {1}s'.format(kinds[k], k) for k in (COLUMN, TABLE, NAME, RANGE))))
+	for owner, n in workspace.external().most_common():
+		print('  not loaded: {0} ({1} symbols read)'.format(owner, n))
+
+	first = next(iter(workspace.workbooks))
+	for text in impacts:
+		book, _ = structref.split_path(text)
+		ids = workspace.resolve(workspace.workbook(book, first), text)
+		hit = workspace.impact(ids)
+		print()
+		print('{0}: {1} calculated columns'.format(', '.join(str(symbols[i]) for i in ids), len(hit)))
+		for workbook in workspace.workbooks:
+			names = [symbols[n].name for n in graph if n in hit and symbols[n].workbook == workbook]
+			if names:
+				print('  {0}: {1}'.format(workbook, ', '.join(names)))
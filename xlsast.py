@@ -0,0 +1,246 @@
+# ========================================================================
+# Description: Expression trees of tokenized formulas
+#
+#              get_rpn() orders the tokens of XlsParser by shunting-yard,
+#              get_ast() builds the node tree from it.  Imported lazily by
+#              tokenizer (tokenizer.get_ast & co. still work).
+# ========================================================================
+import collections
+
+from tokenizer import ParseError, Token, XlsParser
+
+
+class Operator:
+	def __init__(self, value, precedence, associativity):
+		self.value = value
+		self.precedence = precedence
+		self.associativity = associativity
+
+
+# http://office.microsoft.com/en-us/excel-help/calculation-operators-and-precedence-HP010078886.aspx
+operators = {
+	':': Operator(':', 8, 'left'),
+	'': Operator(' ', 8, 'left'),
+	',': Operator(',', 8, 'left'),
+	'u-': Operator('u-', 7, 'left'),
+	'%': Operator('%', 6, 'left'),
+	'^': Operator('^', 5, 'left'),
+	'*': Operator('*', 4, 'left'),
+	'/': Operator('/', 4, 'left'),
+	'+': Operator('+', 3, 'left'),
+	'-': Operator('-', 3, 'left'),
+	'&': Operator('&', 2, 'left'),
+	'=': Operator('=', 1, 'left'),
+	'<': Operator('<', 1, 'left'),
+	'>': Operator('>', 1, 'left'),
+	'<=': Operator('<=', 1, 'left'),
+	'>=': Operator('>=', 1, 'left'),
+	'<>': Operator('<>', 1, 'left')
+}
+
+
+def get_operator(t):
+	if t.ttype.endswith('-prefix') and t.tvalue == '-':
+		return operators['u-']
+	return operators[t.tvalue]
+
+
+class ASTNode(object):
+	def __init__(self, token):
+		super(ASTNode, self).__init__()
+		self.token = token
+
+	def emit(self):
+		# compact formula text of the subtree (no leading '=')
+		if self.token.ttype == 'operand' and self.token.tsubtype == 'text':
+			return '"' + self.token.tvalue.replace('"', '""') + '"'
+		return self.token.tvalue
+
+	def __str__(self):
+		return self.token.tvalue
+
+
+class OperatorNode(ASTNode):
+	def __init__(self, *args):
+		super(OperatorNode, self).__init__(*args)
+
+	def precedence(self):
+		return get_operator(self.token).precedence
+
+	def _operand(self, node, right):
+		# parenthesize where the tree shape is not implied by precedence and left associativity
+		s = node.emit()
+		if isinstance(node, OperatorNode):
+			p = node.precedence()
+			if p < self.precedence() or right and p == self.precedence() and node.token.ttype == 'operator-infix':
+				return '(' + s + ')'
+		return s
+
+	def emit(self):
+		t = self.token
+		if t.ttype == 'operator-prefix':
+			return t.tvalue + self._operand(self.args[0], True)
+		if t.ttype == 'operator-postfix':
+			return self._operand(self.args[0], False) + t.tvalue
+		return self._operand(self.args[0], False) + (' ' if t.tsubtype == 'intersect' else t.tvalue) + self._operand(self.args[1], True)
+
+
+class RangeNode(ASTNode):
+	def __init__(self, *args):
+		super(RangeNode, self).__init__(*args)
+
+
+class FunctionNode(ASTNode):
+	def __init__(self, *args):
+		super(FunctionNode, self).__init__(*args)
+		self.num_args = 0
+
+	def emit(self):
+		def arg(node):
+			# a union inside an argument list needs its own parentheses
+			s = node.emit()
+			return '(' + s + ')' if node.token.tsubtype == 'union' else s
+
+		if self.token.tvalue == 'ARRAY':
+			return '{' + ';'.join(','.join(arg(a) for a in row.args) for row in self.args) + '}'
+		return self.token.tvalue + '(' + ','.join(arg(a) for a in self.args) + ')'
+
+
+def create_node(t):
+	if t.ttype == 'operand' and t.tsubtype == 'range':
+		return RangeNode(t)
+	elif t.ttype == 'function':
+		return FunctionNode(t)
+	elif t.ttype.startswith('operator'):
+		return OperatorNode(t)
+	else:
+		return ASTNode(t)
+
+
+def get_rpn(expression):
+	# the leading = is skipped by the scanner, so diagnostic offsets refer to the expression as given
+	p = XlsParser()
+	p._parse(expression)
+
+	# insert tokens for '(' and ')', to make things cleaner below
+	tokens = []
+	for t in p.tokens.items:
+		if t.ttype == 'function' and t.tsubtype == 'start':
+			t.tsubtype = ""
+			tokens.append(t)
+			tokens.append(Token('(', 'arglist', 'start'))
+		elif t.ttype == 'function' and t.tsubtype == 'stop':
+			# t.tsubtype = ""
+			# tokens.append(t)
+			tokens.append(Token(')', 'arglist', 'stop'))
+		elif t.ttype == 'subexpression' and t.tsubtype == 'start':
+			t.tvalue = '('
+			tokens.append(t)
+		elif t.ttype == 'subexpression' and t.tsubtype == 'stop':
+			t.tvalue = ')'
+			tokens.append(t)
+		else:
+			tokens.append(t)
+
+		# print('tokens: ', '|'.join([x.tvalue for x in tokens]))
+
+	output = collections.deque()
+	stack = []
+	were_values = []
+	arg_count = []
+
+	for t in tokens:
+		if t.ttype == 'operand':
+			output.append(create_node(t))
+
+			if were_values:
+				were_values.pop()
+				were_values.append(True)
+
+		elif t.ttype == 'function':
+			stack.append(t)
+			arg_count.append(0)
+			if were_values:
+				were_values.pop()
+				were_values.append(True)
+			were_values.append(False)
+
+		elif t.ttype == 'argument':
+			while stack and (stack[-1].tsubtype != 'start'):
+				output.append(create_node(stack.pop()))
+
+			if were_values.pop():
+				arg_count[-1] += 1
+			were_values.append(False)
+
+			if not len(stack):
+				raise ParseError('Mismatched or misplaced parentheses', p.diagnostics)
+
+		elif t.ttype.startswith('operator'):
+			o1 = get_operator(t)
+
+			while stack and stack[-1].ttype.startswith('operator'):
+
+				o2 = get_operator(stack[-1])
+
+				if o1.associativity == 'left' and o1.precedence <= o2.precedence or o1.associativity == 'right' and o1.precedence < o2.precedence:
+					output.append(create_node(stack.pop()))
+				else:
+					break
+
+			stack.append(t)
+
+		elif t.tsubtype == 'start':
+			stack.append(t)
+
+		elif t.tsubtype == 'stop':
+			while stack and stack[-1].tsubtype != 'start':
+				output.append(create_node(stack.pop()))
+
+			if not stack:
+				raise ParseError('Mismatched or misplaced parentheses', p.diagnostics)
+
+			stack.pop()
+
+			if stack and stack[-1].ttype == 'function':
+				f = create_node(stack.pop())
+				a = arg_count.pop()
+				w = were_values.pop()
+				if w:
+					a += 1
+				f.num_args = a
+				# print(f, 'has ', a, ' args')
+				output.append(f)
+
+	while stack:
+		if stack[-1].tsubtype == 'start' or stack[-1].tsubtype == 'stop':
+			raise ParseError('Mismatched or misplaced parentheses', p.diagnostics)
+
+		output.append(create_node(stack.pop()))
+
+	# print('Stack is: ', '|'.join(stack))
+	# print('Ouput is: ', '|'.join([x.node.tvalue for x in output]))
+
+	return output
+
+
+def get_ast(expression):
+	rpn = get_rpn(expression)
+	stack = []
+	for n in rpn:
+		num_args = (
+			2 if n.token.ttype == 'operator-infix'
+			else 1 if n.token.ttype.startswith('operator')
+			else n.num_args if n.token.ttype == 'function'
+			else 0
+		)
+		n.args = [stack.pop() for _ in range(num_args)][::-1]
+		stack.append(n)
+	return stack[0]
+
+
+def walk_ast(ast):
+	yield ast
+	for arg in getattr(ast, 'args', []):
+		for n in walk_ast(arg):
+			yield n
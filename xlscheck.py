@@ -0,0 +1,80 @@
+# ========================================================================
+# Description: Validation sweep over RAW files
+#
+#              Every formula is scanned once; the diagnostics collected by
+#              XlsParser on the way are located in the RAW file and
+#              summarised per kind, so a check costs what tokenizing does.
+#
+#       Usage: python xlscheck.py <name>_raw.txt [...] [--quiet]
+#              exit status 1 when any formula has a diagnostic
+# ========================================================================
+import collections
+import sys
+
+from tokenizer import Diagnostic, XlsParser
+from xlsfiles import read_raw_records
+
+# ========================================================================
+#       Class: Finding
+# Description: One diagnostic of one formula
+#
+#  Attributes:       name - Name of the formula
+#                   where - 'file:line:column' of the diagnostic
+#              diagnostic - The Diagnostic
+# ========================================================================
+Finding = collections.namedtuple('Finding', 'name where diagnostic')
+
+
+def check(records):
+	# records: iterable of RawRecord -> (formulas checked, [Finding])
+	checked = 0
+	findings = []
+	for record in records:
+		if not record.body:
+			continue
+		checked += 1
+		for d in XlsParser(record.body).diagnostics:
+			findings.append(Finding(record.name, record.source.where(d.offset), d))
+	return checked, findings
+
+
+def summary(checked, findings):
+	# -> lines of the batch summary
+	kinds = collections.Counter(f.diagnostic.kind for f in findings)
+	broken = len(set((f.where.rsplit(':', 2)[0], f.name) for f in findings))
+	o = ['{0} formulas checked, {1} with diagnostics'.format(checked, broken)]
+	for kind in (Diagnostic.UNEXPECTED, Diagnostic.UNMATCHED_CLOSE, Diagnostic.MISMATCHED_CLOSE, Diagnostic.UNCLOSED, Diagnostic.UNTERMINATED):
+		if kinds[kind]:
+			o.append('\t{0:<18}{1:>6}'.format(kind, kinds[kind]))
+	return o
+
+
+########################################################################################################################
+
+if __name__ == '__main__':
+
+	args = sys.argv[1:]
+	quiet = '--quiet' in args
+	if quiet:
+		args.remove('--quiet')
+
+	if not args:
+		print('usage: python xlscheck.py <name>_raw.txt [...] [--quiet]')
+		sys.exit(2)
+
+	checked = 0
+	findings = []
+	for filename in args:
+		with open(filename, 'r') as ff:
+			n, found = check(read_raw_records(ff))
+		checked += n
+		findings.extend(found)
+
+	if not quiet:
+		for f in findings:
+			print('{0}: {1} {2!r} in {3}{4}'.format(f.where, f.diagnostic.kind, f.diagnostic.text, f.name,
+				' > ' + ' > '.join(f.diagnostic.context) if f.diagnostic.context else ''))
+	for line in summary(checked, findings):
+		print(line)
+
+	sys.exit(1 if findings else 0)
@@ -0,0 +1,214 @@
+# ========================================================================
+# Description: Columnar export of token streams and dependency edges
+#
+#              Every formula of one or more RAW files is tokenized once;
+#              its tokens and its references are appended to two column
+#              sets that are flushed as record batches every `batch`
+#              rows, so memory stays bounded whatever the input size.
+#
+#              tokens: file, formula, position, type, subtype, value, depth
+#              edges : file, formula, reference, table, first_column,
+#                      last_column, this_row
+#
+#              type and subtype are dictionary encoded against the fixed
+#              XlsTokens vocabularies, identical in every batch.  Written
+#              with pyarrow (optional dependency, imported on first use)
+#              as Parquet (.parquet) or Arrow IPC (.arrow) files.
+#
+#       Usage: python xlscolumns.py <out_dir> <name>_raw.txt [...]
+#                                   [--format parquet|arrow] [--batch N]
+# ========================================================================
+import contextlib
+import sys
+from os.path import basename, join
+
+import structref
+from tokenizer import XlsParser, XlsTokens
+
+DEFAULT_BATCH = 65536
+
+TOKEN_TYPES = sorted(set(v for k, v in vars(XlsTokens).items() if k.startswith('TT_')))
+TOKEN_SUBTYPES = sorted(set(v for k, v in vars(XlsTokens).items() if k.startswith('TS_')) | {''})
+
+_TYPE_CODES = dict((v, i) for i, v in enumerate(TOKEN_TYPES))
+_SUBTYPE_CODES = dict((v, i) for i, v in enumerate(TOKEN_SUBTYPES))
+
+TOKEN_COLUMNS = ('file', 'formula', 'position', 'type', 'subtype', 'value', 'depth')
+EDGE_COLUMNS = ('file', 'formula', 'reference', 'table', 'first_column', 'last_column', 'this_row')
+
+
+def token_rows(filename, name, items):
+	# (file, formula, position, type code, subtype code, value, depth) of every token
+	depth = 0
+	for position, t in enumerate(items):
+		tv, tt, ts = t.get()
+		if ts == XlsTokens.TS_STOP and tt in (XlsTokens.TT_FUNCTION, XlsTokens.TT_SUBEXPR):
+			depth -= 1
+		yield filename, name, position, _TYPE_CODES[tt], _SUBTYPE_CODES.get(ts, 0), tv, depth
+		if ts == XlsTokens.TS_START and tt in (XlsTokens.TT_FUNCTION, XlsTokens.TT_SUBEXPR):
+			depth += 1
+
+
+def edge_rows(filename, name, references):
+	# (file, formula, reference, table, first column, last column, this row) of every reference
+	for reference in references:
+		ref = structref.parse(reference)
+		if ref is None:
+			yield filename, name, reference, None, None, None, False
+		else:
+			yield filename, name, reference, ref.table, ref.first, ref.last, ref.this_row
+
+
+# ========================================================================
+#       Class: ColumnBuffer
+# Description: Rows accumulated column by column until the next flush
+#
+#     Methods: None - append(row)
+#              List - take() - The columns, emptying the buffer
+# ========================================================================
+class ColumnBuffer:
+	def __init__(self, names):
+		self.names = names
+		self.columns = [[] for _ in names]
+
+	def __len__(self):
+		return len(self.columns[0])
+
+	def append(self, row):
+		for column, value in zip(self.columns, row):
+			column.append(value)
+
+	def take(self):
+		columns = self.columns
+		self.columns = [[] for _ in self.names]
+		return columns
+
+
+# ========================================================================
+#       Class: ArrowSink
+# Description: Record batch writer of one table (pyarrow)
+#
+#     Methods: None - write(columns) - Append one batch
+#              None - close()
+# ========================================================================
+class ArrowSink:
+	def __init__(self, filename, fields, fmt='parquet'):
+		import pyarrow as pa
+		self._pa = pa
+		self.fields = fields
+		self.schema = pa.schema([(name, kind) for name, kind, dictionary in fields])
+		self._dictionaries = [pa.array(dictionary, pa.string()) if dictionary is not None else None for name, kind, dictionary in fields]
+		if fmt == 'parquet':
+			import pyarrow.parquet as pq
+			self._writer = pq.ParquetWriter(filename, self.schema)
+			self._write = lambda batch: self._writer.write_table(pa.Table.from_batches([batch]))
+		elif fmt == 'arrow':
+			self._writer = pa.ipc.new_file(filename, self.schema)
+			self._write = self._writer.write_batch
+		else:
+			raise ValueError('unknown format {0!r}'.format(fmt))
+
+	def write(self, columns):
+		pa = self._pa
+		arrays = []
+		for (name, kind, dictionary), values, dictionary_array in zip(self.fields, columns, self._dictionaries):
+			if dictionary_array is not None:
+				arrays.append(pa.DictionaryArray.from_arrays(pa.array(values, kind.index_type), dictionary_array))
+			else:
+				arrays.append(pa.array(values, kind))
+		self._write(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+
+	def close(self):
+		self._writer.close()
+
+
+def _fields():
+	import pyarrow as pa
+	vocabulary = pa.dictionary(pa.int8(), pa.string())
+	tokens = [
+		('file', pa.string(), None),
+		('formula', pa.string(), None),
+		('position', pa.int32(), None),
+		('type', vocabulary, TOKEN_TYPES),
+		('subtype', vocabulary, TOKEN_SUBTYPES),
+		('value', pa.string(), None),
+		('depth', pa.int16(), None),
+	]
+	edges = [
+		('file', pa.string(), None),
+		('formula', pa.string(), None),
+		('reference', pa.string(), None),
+		('table', pa.string(), None),
+		('first_column', pa.string(), None),
+		('last_column', pa.string(), None),
+		('this_row', pa.bool_(), None),
+	]
+	return tokens, edges
+
+
+def export(raw_filenames, out_dir, fmt='parquet', batch=DEFAULT_BATCH):
+	# -> (tokens written, edges written)
+	from xlsfiles import read_raw
+
+	token_fields, edge_fields = _fields()
+	buffers = (ColumnBuffer(TOKEN_COLUMNS), ColumnBuffer(EDGE_COLUMNS))
+	totals = [0, 0]
+
+	def flush(i, force=False):
+		if len(buffers[i]) >= batch or force and len(buffers[i]):
+			totals[i] += len(buffers[i])
+			sinks[i].write(buffers[i].take())
+
+	with contextlib.ExitStack() as stack:
+		# each sink is closed even when a later one fails to open
+		sinks = []
+		for table, fields in (('tokens', token_fields), ('edges', edge_fields)):
+			sink = ArrowSink(join(out_dir, table + '.' + fmt), fields, fmt)
+			stack.callback(sink.close)
+			sinks.append(sink)
+
+		for raw_filename in raw_filenames:
+			filename = basename(raw_filename)
+			with open(raw_filename, 'r') as ff:
+				for name, body in read_raw(ff):
+					if not body:
+						continue
+					p = XlsParser(body)
+					for row in token_rows(filename, name, p.items):
+						buffers[0].append(row)
+					for row in edge_rows(filename, name, p.dependencies()):
+						buffers[1].append(row)
+					flush(0)
+					flush(1)
+		flush(0, True)
+		flush(1, True)
+	return tuple(totals)
+
+
+########################################################################################################################
+
+if __name__ == '__main__':
+
+	args = sys.argv[1:]
+
+	def option(flag, default):
+		if flag in args:
+			i = args.index(flag)
+			value = args[i + 1]
+			del args[i:i + 2]
+			return value
+		return default
+
+	fmt = option('--format', 'parquet')
+	batch = int(option('--batch', DEFAULT_BATCH))
+
+	if len(args) < 2:
+		print('usage: python xlscolumns.py <out_dir> <name>_raw.txt [...] [--format parquet|arrow] [--batch N]')
+		sys.exit(2)
+
+	try:
+		ntokens, nedges = export(args[1:], args[0], fmt, batch)
+	except ImportError as e:
+		print('xlscolumns needs pyarrow ({0})'.format(e))
+		sys.exit(2)
+	print('{0} tokens, {1} edges -> {2}'.format(ntokens, nedges, args[0]))
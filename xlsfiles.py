@@ -0,0 +1,151 @@
+# ========================================================================
+# Description: Read and write the RAW and TIDY formula files
+# ========================================================================
+
+"""
+# Formato del file RAW:
+>>>\tnome_formula
+testo_formula
+<<<
+>>>\tnome_formula
+testo_formula
+<<<
+... ecc.
+
+# Formato del file TIDY:
+----------------------------------------------------------------------------------------------------
+----- nome_formula
+----------------------------------------------------------------------------------------------------
+testo_formula (indentato)
+----------------------------------------------------------------------------------------------------
+<riga vuota>
+... ecc.
+"""
+
+import bisect
+import collections
+from array import array
+
+TIDY_RULER = '-' * 100
+TIDY_TITLE = '----- '
+
+
+# ========================================================================
+#       Class: SourceMap
+# Description: Where each character of a record body came from
+#
+#              A body is joined from stripped physical lines; one entry
+#              per line is enough to map a body offset back to the file.
+#
+#  Attributes: filename - Name of the RAW file ('' for anonymous streams)
+#                starts - Body offset where each physical line begins
+#                 lines - File line (1-based) of each physical line
+#               columns - Column (1-based) of its first kept character
+#
+#     Methods: (line, column) - locate(offset)
+#              String         - where(offset) - 'file:line:column'
+# ========================================================================
+class SourceMap:
+	def __init__(self, filename=''):
+		self.filename = filename
+		self.starts = array('l')
+		self.lines = array('l')
+		self.columns = array('l')
+
+	def add(self, offset, line, column):
+		self.starts.append(offset)
+		self.lines.append(line)
+		self.columns.append(column)
+
+	def locate(self, offset):
+		if not self.starts:
+			return 0, 0
+		i = max(0, bisect.bisect_right(self.starts, offset) - 1)
+		return self.lines[i], self.columns[i] + offset - self.starts[i]
+
+	def where(self, offset=0):
+		line, column = self.locate(offset)
+		return '{0}:{1}:{2}'.format(self.filename or '<raw>', line, column)
+
+
+RawRecord = collections.namedtuple('RawRecord', 'name body source')
+
+
+# ------------------------------------------------------------------------
+# RAW files
+# ------------------------------------------------------------------------
+def read_raw_records(ff):
+	# Yield a RawRecord (name, body, SourceMap) for every record of an open RAW file
+	filename = getattr(ff, 'name', '')
+	formula_name = ''
+	parts = []
+	size = 0
+	source = SourceMap(filename)
+	for number, line in enumerate(ff, 1):
+		line = line.rstrip('\n\r')
+		text = line.strip(' \t')
+
+		if text.startswith('>>>\t'):
+			formula_name = text.split('\t')[1]
+		elif text.startswith('<<<'):
+			if formula_name:
+				yield RawRecord(formula_name, ''.join(parts), source)
+			formula_name = ''
+			parts = []
+			size = 0
+			source = SourceMap(filename)
+		elif text:
+			source.add(size, number, len(line) - len(line.lstrip(' \t')) + 1)
+			parts.append(text)
+			size += len(text)
+
+
+def read_raw(ff):
+	# Yield (name, body) for every record of an open RAW file
+	for record in read_raw_records(ff):
+		yield record.name, record.body
+
+
+def write_raw(ff, formulas):
+	# formulas: iterable of (name, compact formula without the leading '=')
+	for name, body in formulas:
+		ff.write('>>>\t' + name + '\n')
+		ff.write(('=' + body if body else '') + '\n')
+		ff.write('<<<\n')
+
+
+# ------------------------------------------------------------------------
+# TIDY files
+# ------------------------------------------------------------------------
+def read_tidy(ff):
+	# Yield (name, lines) for every banner block of an open TIDY file
+	formula_name = None
+	body = []
+	in_header = False
+	for line in ff:
+		line = line.rstrip('\n\r')
+
+		if formula_name is None:
+			if line.startswith(TIDY_TITLE):
+				formula_name = line[len(TIDY_TITLE):]
+				in_header = True
+			continue
+
+		if in_header:
+			# closing ruler of the banner
+			in_header = False
+			continue
+
+		if line == TIDY_RULER:
+			yield formula_name, body
+			formula_name = None
+			body = []
+		else:
+			body.append(line)
+
+
+def write_tidy(ff, formulas):
+	# formulas: iterable of (name, tidy text)
+	for name, text in formulas:
+		for line in (TIDY_RULER, TIDY_TITLE + name, TIDY_RULER, text, TIDY_RULER, ''):
+			ff.write(line + '\n')
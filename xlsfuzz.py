@@ -0,0 +1,274 @@
+# ========================================================================
+# Description: Differential fuzzing of the formula engines
+#
+#              The reference is tokenizer.py (XlsParser._get_tokens,
+#              xlstidy, get_rpn); every candidate engine must give the
+#              same token stream, tidy text and RPN for every formula,
+#              raising the same exception type where the reference does.
+#              Divergences are shrunk to a smallest reproducing formula.
+#
+#       Usage: python xlsfuzz.py [--engine module|file.py ...] [--reference module|file.py]
+#                                [--cases N] [--seed S] [--jobs J] [--roundtrip]
+# ========================================================================
+import glob
+import importlib
+import importlib.util
+import random
+import sys
+import time
+from os.path import basename, dirname, join, splitext
+
+from xlsfiles import read_raw
+
+_ALPHABET = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcxyz0123456789_.$!:@ ()[]{}",;\'#+-*/^&=<>%'
+_ERRORS = ('#NULL!', '#DIV/0!', '#VALUE!', '#REF!', '#NAME?', '#NUM!', '#N/A')
+_OPERATORS = ('+', '-', '*', '/', '^', '&', '=', '<>', '<=', '>=', '<', '>', ':', ' ', ',')
+
+
+# ------------------------------------------------------------------------
+# Engines
+# ------------------------------------------------------------------------
+def load_engine(spec):
+	# spec: importable module name or path to a .py file exposing XlsParser and get_rpn
+	if spec.endswith('.py'):
+		name = '_xlsfuzz_' + splitext(basename(spec))[0]
+		module_spec = importlib.util.spec_from_file_location(name, spec)
+		module = importlib.util.module_from_spec(module_spec)
+		module_spec.loader.exec_module(module)
+		return module
+	return importlib.import_module(spec)
+
+
+def run_engine(engine, formula):
+	# The comparable outputs of one engine, each either a value or ('raise', exception type)
+	def guard(fn):
+		try:
+			return fn()
+		except Exception as e:
+			return 'raise', type(e).__name__
+
+	p = guard(lambda: engine.XlsParser(formula))
+	if isinstance(p, tuple):
+		return p, p, p
+
+	tokens = guard(lambda: [t.get() for t in p.tokens.items] if p.tokens else [])
+	tidy = guard(p.xlstidy)
+	rpn = guard(lambda: [n.token.get() + (getattr(n, 'num_args', 0),) for n in engine.get_rpn(formula)])
+	return tokens, tidy, rpn
+
+
+def run_roundtrip(engine, formula):
+	# Property check: raw -> tidy -> raw must give back the compact formula
+	try:
+		tidy = engine.XlsParser(formula).xlstidy()
+		return engine.compact(formula) == engine.untidy(tidy)
+	except Exception as e:
+		return 'raise', type(e).__name__
+
+
+# ------------------------------------------------------------------------
+# Case generation
+# ------------------------------------------------------------------------
+def load_corpus(path=None):
+	path = path or dirname(__file__)
+	formulas = []
+	for filename in sorted(glob.glob(join(path, '*_raw.txt')) + glob.glob(join(path, 'PreviousFormulaVersions', '*_raw.txt'))):
+		with open(filename, 'r') as ff:
+			formulas.extend(body for name, body in read_raw(ff) if body)
+	return formulas
+
+
+class CaseGenerator:
+	def __init__(self, corpus, seed=0):
+		self.rnd = random.Random(seed)
+		self.corpus = corpus
+		self.functions = set()
+		self.operands = set()
+
+		# harvest function names and operands to build new formulas from
+		engine = load_engine('tokenizer')
+		for formula in corpus:
+			for t in engine.XlsParser(formula).items:
+				if t.ttype == 'function' and t.tsubtype == 'start':
+					self.functions.add(t.tvalue)
+				elif t.ttype == 'operand':
+					self.operands.add('"' + t.tvalue.replace('"', '""') + '"' if t.tsubtype == 'text' else t.tvalue)
+
+		self.functions = sorted(self.functions) or ['IF']
+		self.operands = sorted(self.operands) or ['A1']
+
+	def mutate(self, formula):
+		rnd = self.rnd
+		s = list(formula)
+		for _ in range(rnd.randint(1, 4)):
+			op = rnd.randint(0, 4)
+			i = rnd.randint(0, len(s))
+			if op == 0 and s:
+				del s[min(i, len(s) - 1)]
+			elif op == 1:
+				s.insert(i, rnd.choice(_ALPHABET))
+			elif op == 2 and s:
+				s[min(i, len(s) - 1)] = rnd.choice(_ALPHABET)
+			elif op == 3 and s:
+				# duplicate a slice
+				j = rnd.randint(i, min(len(s), i + 20))
+				s[i:i] = s[i:j]
+			else:
+				# splice a slice of another corpus formula
+				other = rnd.choice(self.corpus)
+				j = rnd.randint(0, len(other))
+				s[i:i] = other[j:j + rnd.randint(1, 30)]
+		return ''.join(s)
+
+	def expression(self, depth=0):
+		rnd = self.rnd
+		r = rnd.random()
+		if depth > 4 or r < 0.35:
+			r = rnd.random()
+			if r < 0.05:
+				return rnd.choice(_ERRORS)
+			if r < 0.10:
+				return '{' + ';'.join(','.join(str(rnd.randint(0, 9)) for _ in range(2)) for _ in range(rnd.randint(1, 2))) + '}'
+			return rnd.choice(self.operands)
+		if r < 0.65:
+			fn = rnd.choice(self.functions)
+			return fn + '(' + ','.join(self.expression(depth + 1) for _ in range(rnd.randint(0, 4))) + ')'
+		if r < 0.75:
+			return '(' + self.expression(depth + 1) + ')'
+		if r < 0.82:
+			return rnd.choice(('-', '+')) + self.expression(depth + 1)
+		if r < 0.85:
+			return self.expression(depth + 1) + '%'
+		return self.expression(depth + 1) + rnd.choice(_OPERATORS) + self.expression(depth + 1)
+
+	def __call__(self):
+		rnd = self.rnd
+		r = rnd.random()
+		if r < 0.45:
+			return self.mutate(rnd.choice(self.corpus))
+		if r < 0.90:
+			return '=' + self.expression()
+		return ''.join(rnd.choice(_ALPHABET) for _ in range(rnd.randint(0, 40)))
+
+
+# ------------------------------------------------------------------------
+# Minimization
+# ------------------------------------------------------------------------
+def minimize(formula, diverges):
+	# ddmin over characters: smallest formula for which diverges() still holds
+	n = 2
+	while len(formula) >= 2:
+		chunk = max(1, len(formula) // n)
+		reduced = False
+		for start in range(0, len(formula), chunk):
+			candidate = formula[:start] + formula[start + chunk:]
+			if diverges(candidate):
+				formula = candidate
+				n = max(n - 1, 2)
+				reduced = True
+				break
+		if not reduced:
+			if chunk == 1:
+				break
+			n = min(n * 2, len(formula))
+	return formula
+
+
+# ------------------------------------------------------------------------
+# Driver
+# ------------------------------------------------------------------------
+def fuzz(reference, engines, cases, seed=0, roundtrip=False, corpus=None, report=print, first=0):
+	# Returns the list of (engine name, minimized formula, reference output, engine output)
+	# cases first .. first+cases-1: the corpus formulas in that range are replayed, the others generated
+	corpus = corpus if corpus is not None else load_corpus()
+	gen = CaseGenerator(corpus, seed)
+	check = run_roundtrip if roundtrip else run_engine
+
+	def diverges(engine, formula):
+		if roundtrip:
+			return check(engine, formula) is not True
+		return check(reference, formula) != check(engine, formula)
+
+	found = []
+	seen = set()
+	for case in range(first, first + cases):
+		formula = corpus[case] if case < len(corpus) else gen()
+		for name, engine in engines:
+			if not diverges(engine, formula):
+				continue
+			small = minimize(formula, lambda f: diverges(engine, f))
+			if (name, small) in seen:
+				continue
+			seen.add((name, small))
+			found.append((name, small, None if roundtrip else check(reference, small), check(engine, small)))
+			report('{0}: {1!r}'.format(name, small))
+	return found
+
+
+def _worker(args):
+	reference, engines, first, cases, seed, roundtrip = args
+	reference = load_engine(reference)
+	engines = [(spec, load_engine(spec)) for spec in engines]
+	return fuzz(reference, engines, cases, seed, roundtrip, report=lambda s: None, first=first)
+
+
+def split_cases(cases, jobs):
+	# -> [(first case, number of cases)] of each job: the first cases % jobs jobs run one more
+	size, extra = divmod(cases, jobs)
+	o = []
+	first = 0
+	for j in range(jobs):
+		n = size + (1 if j < extra else 0)
+		o.append((first, n))
+		first += n
+	return o
+
+
+########################################################################################################################
+
+if __name__ == '__main__':
+
+	args = sys.argv[1:]
+
+	def option(flag, default):
+		if flag in args:
+			i = args.index(flag)
+			value = args[i + 1]
+			del args[i:i + 2]
+			return value
+		return default
+
+	reference = option('--reference', 'tokenizer')
+	cases = int(option('--cases', '10000'))
+	seed = int(option('--seed', '0'))
+	jobs = int(option('--jobs', '1'))
+	roundtrip = '--roundtrip' in args
+	engines = []
+	while '--engine' in args:
+		engines.append(option('--engine', None))
+	if not engines:
+		# without a candidate the reference is checked against itself (determinism) or the round-trip property
+		engines = [reference]
+
+	start = time.time()
+	if jobs > 1:
+		from multiprocessing import Pool
+		with Pool(jobs) as pool:
+			# consecutive case ranges: each job replays its own share of the corpus
+			chunks = [(reference, engines, first, n, seed + j, roundtrip) for j, (first, n) in enumerate(split_cases(cases, jobs))]
+			found = list({(x[0], x[1]): x for part in pool.map(_worker, chunks) for x in part}.values())
+		for name, small, expected, got in found:
+			print('{0}: {1!r}'.format(name, small))
+	else:
+		found = fuzz(load_engine(reference), [(spec, load_engine(spec)) for spec in engines], cases, seed, roundtrip)
+
+	for name, small, expected, got in found:
+		print('-' * 100)
+		print('engine   : ' + name)
+		print('formula  : ' + repr(small))
+		if expected is not None:
+			print('reference: ' + repr(expected))
+		print('got      : ' + repr(got))
+
+	print('{0} cases, {1} divergences, {2:.1f}s'.format(cases, len(found), time.time() - start))
+	sys.exit(1 if found else 0)
@@ -0,0 +1,557 @@
+# ========================================================================
+# Description: Incremental re-tokenization of an edited formula
+#
+#              IncrementalParser keeps the tokens, items and tidy text of
+#              a formula together with its structural marks: the
+#              parentheses, separators and array braces met outside
+#              string, path, bracket and error literals.
+#
+#              An edit (offset, deleted, inserted) is re-scanned within
+#              the innermost call argument or subexpression holding it.
+#              Scanning restarts after a mark and stops at the next one,
+#              where no literal is open, so the rest of the stream is
+#              the same as before: only the window's tokens and items
+#              are replaced, and with a layout that does not depend on
+#              the column (classic) only the tidy text of the enclosing
+#              call argument is laid out again.
+#
+#              A window whose new text does not scan cleanly on its own
+#              (unterminated literal, unbalanced parentheses, an extra
+#              call argument, ...) grows to the enclosing one; at the
+#              top level, or while the formula has diagnostics, the
+#              whole formula is parsed again.
+#
+#       Usage: p = IncrementalParser(formula)
+#              p.edit(offset, deleted, inserted)
+#              p.items, p.xlstidy()
+#
+#              python xlsincr.py <name>_raw.txt [--edits N] [--seed N]
+#              replays random edits on every formula against full parses
+# ========================================================================
+from array import array
+import bisect
+import sys
+
+from tokenizer import CONDITIONALS, Metrics, XlsLayout, XlsLocale, XlsParser, XlsTokens
+
+# Mark kinds: function / subexpression open, separator, close, array open, array row, array close
+OPEN_CALL, OPEN_SUB, SEPARATOR, CLOSE, ARRAY_OPEN, ROW, ARRAY_CLOSE = 'F', 'S', ',', ')', '{', ';', '}'
+
+# tokens and items that stand for one mark
+_TOKENS = {OPEN_CALL: 1, OPEN_SUB: 1, SEPARATOR: 1, CLOSE: 1, ARRAY_OPEN: 2, ROW: 3, ARRAY_CLOSE: 2}
+_ITEMS = {OPEN_CALL: 2, OPEN_SUB: 1, SEPARATOR: 1, CLOSE: 1, ARRAY_OPEN: 4, ROW: 4, ARRAY_CLOSE: 2}
+# calls (XlsLayout levels) an open mark adds
+_LEVELS = {OPEN_CALL: 1, OPEN_SUB: 0, ARRAY_OPEN: 2}
+_OPENS = OPEN_CALL + OPEN_SUB + ARRAY_OPEN
+_CLOSES = CLOSE + ARRAY_CLOSE
+
+_ERRORS = ',#NULL!,#DIV/0!,#VALUE!,#REF!,#NAME?,#NUM!,#N/A,'
+
+
+def structure(formula, locale):
+	# (offsets, kinds) of the marks of a formula without its '=', following the scanner's states
+	dispatch = locale.dispatch
+	offsets = array('l')
+	kinds = []
+	arrays = []
+	token = ''
+	n = len(formula)
+	i = 0
+	while i < n:
+		c = formula[i]
+		kind = dispatch.get(c)
+		if kind is None:
+			token += c
+		elif kind == XlsLocale.K_STRING or kind == XlsLocale.K_PATH:
+			j = i + 1
+			while j < n:
+				if formula[j] == c:
+					if formula[j + 1:j + 2] != c:
+						break
+					j += 1
+				j += 1
+			token = '' if kind == XlsLocale.K_STRING else token + formula[i:j + 1]
+			i = j
+		elif kind == XlsLocale.K_RANGE:
+			j = formula.find(']', i)
+			j = n if j < 0 else j
+			token += formula[i:j + 1]
+			i = j
+		elif kind == XlsLocale.K_ERROR:
+			j = i + 1
+			while j <= n and _ERRORS.find(',' + formula[i:j] + ',') == -1:
+				j += 1
+			token = ''
+			i = j - 1
+		elif kind == XlsLocale.K_SIGN and len(token) > 1 and locale.sci_notation(token):
+			token += c
+		elif kind == XlsLocale.K_COLUMN and arrays[-1:] != [True]:
+			token += c
+		else:
+			mark = None
+			if kind == XlsLocale.K_OPEN:
+				mark = OPEN_CALL if token else OPEN_SUB
+				arrays.append(False)
+			elif kind == XlsLocale.K_ARRAY_START:
+				mark = ARRAY_OPEN
+				arrays.append(True)
+			elif kind == XlsLocale.K_CLOSE or kind == XlsLocale.K_ARRAY_STOP:
+				mark = CLOSE if kind == XlsLocale.K_CLOSE else ARRAY_CLOSE
+				if arrays:
+					arrays.pop()
+			elif kind == XlsLocale.K_ROW or kind == XlsLocale.K_ARG_OR_ROW and arrays[-1:] == [True]:
+				mark = ROW
+			elif kind in (XlsLocale.K_ARGUMENT, XlsLocale.K_ARG_OR_ROW, XlsLocale.K_COLUMN):
+				mark = SEPARATOR
+			elif kind == XlsLocale.K_COMPARE and formula[i:i + 2] in ('>=', '<=', '<>'):
+				i += 1
+			if mark:
+				offsets.append(i)
+				kinds.append(mark)
+			token = ''
+		i += 1
+	return offsets, ''.join(kinds)
+
+
+def _signature(t):
+	# mark kind of a structural token (None for any other), function name
+	tt, ts = t.ttype, t.tsubtype
+	if tt == XlsTokens.TT_FUNCTION:
+		return (OPEN_CALL if ts == XlsTokens.TS_START else CLOSE), t.tvalue
+	if tt == XlsTokens.TT_SUBEXPR:
+		return (OPEN_SUB if ts == XlsTokens.TS_START else CLOSE), ''
+	if tt == XlsTokens.TT_ARGUMENT or tt == XlsTokens.TT_OP_IN and ts == XlsTokens.TS_UNION:
+		return SEPARATOR, ''
+	return None, ''
+
+
+# structural tokens of each mark kind
+_EXPECTED = {
+	OPEN_CALL: (OPEN_CALL,),
+	OPEN_SUB: (OPEN_SUB,),
+	SEPARATOR: (SEPARATOR,),
+	CLOSE: (CLOSE,),
+	ARRAY_OPEN: (OPEN_CALL, OPEN_CALL),
+	ROW: (CLOSE, SEPARATOR, OPEN_CALL),
+	ARRAY_CLOSE: (CLOSE, CLOSE),
+}
+
+
+def align(kinds, tokens):
+	# -> (token indices, item indices) of the first token of each mark, None when the tokens disagree
+	toks = array('l')
+	items = array('l')
+	i = 0
+	item = 0
+	n = len(tokens)
+	for kind in kinds:
+		while i < n and _signature(tokens[i])[0] is None:
+			i += 1
+			item += 1
+		toks.append(i)
+		items.append(item)
+		for expected in _EXPECTED[kind]:
+			if i >= n:
+				return None
+			sig, name = _signature(tokens[i])
+			if sig != expected or sig == OPEN_CALL and (kind == OPEN_CALL) == (name in ('ARRAY', 'ARRAYROW')):
+				return None
+			i += 1
+		item += _ITEMS[kind]
+	if any(_signature(t)[0] is not None for t in tokens[i:]):
+		return None
+	return toks, items
+
+
+def levels(kinds, base=0):
+	# XlsLayout level of the text that follows each mark
+	o = array('l')
+	stack = []
+	level = base
+	for kind in kinds:
+		if kind in _OPENS:
+			stack.append(_LEVELS[kind])
+			level += stack[-1]
+		elif kind in _CLOSES and stack:
+			level -= stack.pop()
+		o.append(level)
+	return o
+
+
+def recount(length, tokens):
+	# Metrics of a token stream, as XlsParser counts them while scanning
+	depth = if_depth = conditionals = operands = 0
+	stack = []
+	calls = {}
+	references = set()
+	for t in tokens:
+		tt, ts = t.ttype, t.tsubtype
+		if tt == XlsTokens.TT_OPERAND:
+			operands += 1
+			if ts == XlsTokens.TS_RANGE:
+				references.add(t.tvalue)
+		elif tt == XlsTokens.TT_FUNCTION or tt == XlsTokens.TT_SUBEXPR:
+			if ts == XlsTokens.TS_START:
+				stack.append(t)
+				if t.tvalue not in ('ARRAY', 'ARRAYROW'):
+					depth = max(depth, len(stack))
+				if tt == XlsTokens.TT_FUNCTION and t.tvalue not in ('ARRAY', 'ARRAYROW'):
+					name = t.tvalue.upper()
+					calls[name] = calls.get(name, 0) + 1
+					if name in CONDITIONALS:
+						conditionals += 1
+						if_depth = max(if_depth, conditionals)
+			elif stack:
+				if stack.pop().tvalue.upper() in CONDITIONALS:
+					conditionals -= 1
+	return Metrics(length, len(tokens), depth, if_depth, sum(calls.values()), calls, operands, len(references))
+
+
+# ========================================================================
+#       Class: IncrementalParser(formula)
+# Description: A formula kept tokenized across edits
+#
+#  Attributes:     formula - The formula as given
+#                   tokens - Scanner tokens (XlsParser.tokens.items)
+#                    items - Parser items (XlsParser.items)
+#              diagnostics - XlsParser.diagnostics
+#                  metrics - XlsParser.metrics
+#                   window - (start, end) offsets of the text the last
+#                            edit scanned again
+#
+#     Methods: None   - edit(offset, deleted, inserted)
+#              String - xlstidy(layout)
+# ========================================================================
+class IncrementalParser:
+	def __init__(self, formula, arg_sep=',', locale='en'):
+		self._arg_sep = arg_sep
+		self._locale = locale if isinstance(locale, XlsLocale) else XlsLocale.get(locale)
+		self._full(formula)
+
+	def _full(self, formula):
+		parser = XlsParser(formula, self._arg_sep, self._locale)
+		self.formula = formula
+		self.tokens = parser.tokens.items if parser.tokens else []
+		self.items = parser.items
+		self.diagnostics = parser.diagnostics
+		self.window = (0, len(formula))
+		self._metrics = parser.metrics
+		self._tidy = None
+
+		body = formula.lstrip(' ')
+		if body[0:1] == '=':
+			body = body[1:]
+		self._skipped = len(formula) - len(body)
+		self._body = body
+
+		# edits are only patched in on a clean formula whose marks match its tokens
+		self._kinds = None
+		if not self.diagnostics:
+			offsets, kinds = structure(body, self._locale)
+			aligned = align(kinds, self.tokens)
+			if aligned is not None:
+				self._offsets = offsets
+				self._kinds = kinds
+				self._tok, self._item = aligned
+				self._levels = levels(kinds)
+
+	@property
+	def metrics(self):
+		if self._metrics is None and self.tokens:
+			self._metrics = recount(len(self._body), self.tokens)
+		return self._metrics
+
+	# --------------------------------------------------------------------
+	# marks
+	# --------------------------------------------------------------------
+	def _left(self, i):
+		# first separator or unmatched open mark left of mark i, -1 if none
+		kinds = self._kinds
+		depth = 0
+		for j in range(i - 1, -1, -1):
+			kind = kinds[j]
+			if kind in _CLOSES:
+				depth += 1
+			elif kind in _OPENS:
+				if not depth:
+					return j
+				depth -= 1
+			elif not depth:
+				return j
+		return -1
+
+	def _right(self, i):
+		# first separator or unmatched close mark right of mark i, -1 if none
+		kinds = self._kinds
+		depth = 0
+		for j in range(i + 1, len(kinds)):
+			kind = kinds[j]
+			if kind in _OPENS:
+				depth += 1
+			elif kind in _CLOSES:
+				if not depth:
+					return j
+				depth -= 1
+			elif not depth:
+				return j
+		return -1
+
+	def _container(self, i):
+		# unmatched open mark left of mark i, -1 at the top level
+		j = self._left(i)
+		while j >= 0 and self._kinds[j] not in _OPENS:
+			j = self._left(j)
+		return j
+
+	def _closing(self, i):
+		j = self._right(i)
+		while j >= 0 and self._kinds[j] not in _CLOSES:
+			j = self._right(j)
+		return j
+
+	def _window(self, lo, hi):
+		# -> (opener, start, end) marks around the body text [lo, hi), None at the top level
+		first = bisect.bisect_left(self._offsets, lo)
+		last = bisect.bisect_left(self._offsets, hi)
+		start = self._left(first)
+		end = self._right(last - 1)
+		if start < 0 or end < 0:
+			return None
+		opener = start if self._kinds[start] in _OPENS else self._container(start)
+		if opener < 0:
+			return None
+
+		# the text replaced holds whole calls and no separator of the window's own level
+		depth = 0
+		for kind in self._kinds[first:last]:
+			if kind in _OPENS:
+				depth += 1
+			elif kind in _CLOSES:
+				depth -= 1
+			if depth < 0 or not depth and kind in SEPARATOR + ROW:
+				return self._wider(opener, lo, hi)
+		return (opener, start, end) if not depth else self._wider(opener, lo, hi)
+
+	def _wider(self, opener, lo, hi):
+		# the window around [lo, hi) and the whole call or subexpression opened by mark `opener`
+		close = self._closing(opener)
+		if close < 0:
+			return None
+		return self._window(min(lo, self._offsets[opener]), max(hi, self._offsets[close] + 1))
+
+	# --------------------------------------------------------------------
+	# edits
+	# --------------------------------------------------------------------
+	def edit(self, offset, deleted, inserted):
+		formula = self.formula[:offset] + inserted + self.formula[offset + deleted:]
+		a = offset - self._skipped
+		if self._kinds is None or a < 0:
+			return self._full(formula)
+
+		window = self._window(a, a + deleted)
+		while window is not None:
+			opener, start, end = window
+			s, e = self._offsets[start] + 1, self._offsets[end]
+			text = self._body[s:a] + inserted + self._body[a + deleted:e]
+			patch = self._rescan(text, self._kinds[opener])
+			if patch is not None:
+				break
+			window = self._wider(opener, a, a + deleted)
+		else:
+			return self._full(formula)
+
+		self._splice(start, end, text, patch)
+		self.formula = formula
+		self._body = self._body[:a] + inserted + self._body[a + deleted:]
+		self.window = (self._skipped + s, self._skipped + s + len(text))
+		if self._tidy is not None:
+			self._patch_tidy(opener, start)
+
+	def _rescan(self, text, opener):
+		# (tokens, items, offsets, kinds, token indices, item indices) of a window's new text,
+		# None when the text would not scan the same on its own as in its place
+		if opener == ARRAY_OPEN:
+			return None
+		body = text.lstrip(' ')
+		if not body:
+			return [], [], array('l'), '', array('l'), array('l')
+		if body[0] == '=':
+			return None
+		parser = XlsParser(text, self._arg_sep, self._locale)
+		if parser.diagnostics:
+			return None
+		offsets, kinds = structure(body, self._locale)
+		if opener == OPEN_CALL and SEPARATOR in kinds:
+			# a separator outside any parentheses of the text is an argument of the call, not a union
+			depth = 0
+			for kind in kinds:
+				if kind in _OPENS:
+					depth += 1
+				elif kind in _CLOSES:
+					depth -= 1
+				elif not depth:
+					return None
+		aligned = align(kinds, parser.tokens.items)
+		if aligned is None:
+			return None
+		skipped = len(text) - len(body)
+		offsets = array('l', [o + skipped for o in offsets])
+		return (parser.tokens.items, parser.items, offsets, kinds) + aligned
+
+	def _splice(self, start, end, text, patch):
+		tokens, items, offsets, kinds, toks, item_indices = patch
+		kind = self._kinds[start]
+		tok_lo = self._tok[start] + _TOKENS[kind]
+		item_lo = self._item[start] + _ITEMS[kind]
+		tok_hi = self._tok[end]
+		item_hi = self._item[end]
+		base = self._offsets[start] + 1
+
+		chars = len(text) - (self._offsets[end] - base)
+		dtok = len(tokens) - (tok_hi - tok_lo)
+		ditem = len(items) - (item_hi - item_lo)
+		self._ditem = ditem
+
+		self.tokens[tok_lo:tok_hi] = tokens
+		self.items[item_lo:item_hi] = items
+		k = start + 1
+		self._offsets[k:] = array('l', [o + base for o in offsets] + [o + chars for o in self._offsets[end:]])
+		self._tok[k:] = array('l', [t + tok_lo for t in toks] + [t + dtok for t in self._tok[end:]])
+		self._item[k:] = array('l', [t + item_lo for t in item_indices] + [t + ditem for t in self._item[end:]])
+		self._levels[k:] = levels(kinds, self._levels[start]) + self._levels[end:]
+		self._kinds = self._kinds[:k] + kinds + self._kinds[end:]
+		self._metrics = None
+
+	# --------------------------------------------------------------------
+	# tidy
+	# --------------------------------------------------------------------
+	def xlstidy(self, layout='classic'):
+		# layout: an XlsLayout or the name of a registered preset
+		if not isinstance(layout, XlsLayout):
+			layout = XlsLayout.get(layout)
+		if self._tidy is None or self._tidy[0] is not layout:
+			spans = {} if layout.relocatable() else None
+			self._tidy = [layout, layout.format(self.items, spans), spans]
+		return self._tidy[1]
+
+	def _patch_tidy(self, opener, start):
+		# lay out again the function argument holding the window that starts at mark `start`
+		layout, text, spans = self._tidy
+		self._tidy = None
+		if spans is None:
+			return
+		while self._kinds[opener] == OPEN_SUB:
+			start = self._left(opener)
+			if start < 0:
+				return
+			opener = start if self._kinds[start] in _OPENS else self._container(start)
+		if self._kinds[opener] != OPEN_CALL:
+			return
+
+		k = 0
+		i = start
+		while i != opener:
+			i = self._left(i)
+			k += 1
+		call = self._item[opener]
+		lo_item = self._item[start] + _ITEMS[self._kinds[start]]
+		hi_item = self._item[self._right(start)]
+		ditem = self._ditem
+		old_hi = hi_item - ditem
+
+		lo, hi = spans[call][k]
+		fragment, inner = layout.fragment(self.items[lo_item:hi_item], self._levels[opener])
+		delta = len(fragment) - (hi - lo)
+
+		moved = {}
+		for index, args in spans.items():
+			if lo_item <= index < old_hi:
+				continue
+			if index >= old_hi:
+				index += ditem
+			moved[index] = [(a + delta if a >= hi else a, b + delta if b >= hi else b) for a, b in args]
+		moved[call][k] = (lo, lo + len(fragment))
+		for index, args in inner.items():
+			moved[index + lo_item] = [(a + lo, b + lo) for a, b in args]
+		self._tidy = [layout, text[:lo] + fragment + text[hi:], moved]
+
+
+########################################################################################################################
+
+if __name__ == '__main__':
+
+	import random
+	import time
+
+	from xlsfiles import read_raw
+
+	args = sys.argv[1:]
+
+	def option(flag, default):
+		if flag in args:
+			i = args.index(flag)
+			value = args[i + 1]
+			del args[i:i + 2]
+			return value
+		return default
+
+	edits = int(option('--edits', '20'))
+	rng = random.Random(int(option('--seed', '0')))
+
+	if not args:
+		print('usage: python xlsincr.py <name>_raw.txt [--edits N] [--seed N]')
+		sys.exit(2)
+
+	with open(args[0], 'r') as ff:
+		formulas = [body for name, body in read_raw(ff) if body.lstrip().startswith('=')]
+
+	snippets = ('1', 'A1', '"x"', ',', '(', ')', ' ', '-', '""', '[@Col]', 'IF(', 'SUM(B1:B2)')
+	done = patched = failed = 0
+	incremental = full = 0.0
+
+	def check(p, edit):
+		# one edit, timed and compared with a full parse -> False on a mismatch
+		global done, patched, incremental, full
+		start = time.perf_counter()
+		p.edit(*edit)
+		tidy = p.xlstidy()
+		seconds = time.perf_counter() - start
+
+		start = time.perf_counter()
+		parser = XlsParser(p.formula)
+		expected = parser.xlstidy()
+
+		# timings of the edits patched in place
+		done += 1
+		if p.window != (0, len(p.formula)):
+			patched += 1
+			full += time.perf_counter() - start
+			incremental += seconds
+		if ([t.get() for t in p.tokens] != [t.get() for t in (parser.tokens.items if parser.tokens else [])]
+				or [t.get() for t in p.items] != [t.get() for t in parser.items]
+				or tidy != expected or p.metrics != parser.metrics):
+			print('MISMATCH after edit {0!r}: {1}'.format(edit, p.formula[:100]))
+			return False
+		return True
+
+	for formula in formulas:
+		p = IncrementalParser(formula)
+		p.xlstidy()
+		for _ in range(edits):
+			# an edit and its undo, both checked
+			text = p.formula
+			offset = rng.randrange(1, len(text) + 1)
+			deleted = rng.randrange(0, min(6, len(text) - offset) + 1)
+			if rng.random() < 0.5:
+				at = rng.randrange(0, len(text))
+				inserted = text[at:at + rng.randrange(0, 9)]
+			else:
+				inserted = rng.choice(snippets)
+			if not (check(p, (offset, deleted, inserted)) and check(p, (offset, len(inserted), text[offset:offset + deleted]))):
+				failed += 1
+				p = IncrementalParser(p.formula)
+				p.xlstidy()
+
+	print('{0} edits on {1} formulas: {2} patched in place, {3} parsed in full, {4} mismatches'.format(
+		done, len(formulas), patched, done - patched, failed))
+	print('patched edits: {0:.3f}s, {1:.3f}s with full parses ({2:.1f}x)'.format(incremental, full, full / (incremental or 1)))
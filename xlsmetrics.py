@@ -0,0 +1,86 @@
+# ========================================================================
+# Description: Per-formula size and nesting report over RAW files
+#
+#              The metrics are the ones XlsParser counts while scanning
+#              (XlsParser.metrics); formulas over any threshold are
+#              flagged.
+#
+#       Usage: python xlsmetrics.py <name>_raw.txt [...] [--all]
+#                                   [--max-depth N] [--max-if-depth N]
+#                                   [--max-references N] [--max-length N]
+#              exit status 1 when a formula is flagged
+# ========================================================================
+import sys
+
+from tokenizer import XlsParser
+
+# metric -> default limit
+THRESHOLDS = {
+	'depth': 12,
+	'if_depth': 10,
+	'references': 25,
+	'length': 2000,
+}
+
+
+def measure(records):
+	# records: iterable of (name, body) -> [(name, Metrics)]
+	return [(name, XlsParser(body).metrics) for name, body in records if body]
+
+
+def flagged(metrics, thresholds=THRESHOLDS):
+	# -> [(name, Metrics, [exceeded metric names])] of the formulas over a threshold
+	o = []
+	for name, m in metrics:
+		over = [k for k in sorted(thresholds) if getattr(m, k) > thresholds[k]]
+		if over:
+			o.append((name, m, over))
+	return o
+
+
+########################################################################################################################
+
+if __name__ == '__main__':
+
+	from xlsfiles import read_raw
+
+	args = sys.argv[1:]
+	show_all = '--all' in args
+	if show_all:
+		args.remove('--all')
+
+	thresholds = dict(THRESHOLDS)
+	for key in list(thresholds):
+		flag = '--max-' + key.replace('_', '-')
+		if flag in args:
+			i = args.index(flag)
+			thresholds[key] = int(args[i + 1])
+			del args[i:i + 2]
+
+	if not args:
+		print('usage: python xlsmetrics.py <name>_raw.txt [...] [--all] [--max-depth N] [--max-if-depth N] [--max-references N] [--max-length N]')
+		sys.exit(2)
+
+	fmt = '{0:<4} {1:<40} {2:>6} {3:>6} {4:>6} {5:>6} {6:>6} {7:>6}  {8}'
+	total = 0
+	over = 0
+	for filename in args:
+		with open(filename, 'r') as ff:
+			metrics = measure(read_raw(ff))
+		bad = flagged(metrics, thresholds)
+		total += len(metrics)
+		over += len(bad)
+
+		print(filename)
+		print(fmt.format('', 'FORMULA', 'LENGTH', 'DEPTH', 'IFS', 'CALLS', 'OPNDS', 'REFS', 'TOP FUNCTIONS'))
+		marks = dict((name, exceeded) for name, m, exceeded in bad)
+		rows = metrics if show_all else [(name, m) for name, m, exceeded in bad]
+		for name, m in sorted(rows, key=lambda r: (-r[1].depth, -r[1].length)):
+			top = sorted(m.calls.items(), key=lambda c: (-c[1], c[0]))[:3]
+			print(fmt.format('!' if name in marks else '', name[:40], m.length, m.depth, m.if_depth, m.functions, m.operands,
+				m.references, ', '.join('{0}x{1}'.format(k, v) for k, v in top)
+				+ ('   [over: ' + ', '.join(marks[name]) + ']' if name in marks else '')))
+		print()
+
+	print('{0} formulas, {1} over a threshold ({2})'.format(total, over, ', '.join('{0} > {1}'.format(k, thresholds[k]) for k in sorted(thresholds))))
+	sys.exit(1 if over else 0)
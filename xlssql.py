@@ -0,0 +1,600 @@
+# ========================================================================
+# Description: Set-based recalculation of table-column formulas in SQLite
+#
+#              The calculated columns of one table are compiled to SQL and
+#              evaluated level by level (tsort order) with one UPDATE per
+#              level over the whole table:
+#
+#                  [@Col], [Col]              -> "Table"."Col" (this row)
+#                  IF(c1,a,IF(c2,b,d))        -> CASE WHEN c1 THEN a WHEN c2 THEN b ELSE d END
+#                  SUMIF(S)/COUNTIF(S)/AVERAGEIF(S) over own columns
+#                                             -> GROUP BY table built once per level,
+#                                                read back by key
+#                  VLOOKUP(k,Other[[K]:[..]],n,FALSE)
+#                                             -> first Other row with K = k
+#                  named ranges (CurY)        -> bound parameters (:CurY)
+#
+#              Excel errors are NULL.  Blank data cells are read as '', so
+#              NULL is never anything but an error: IF, AND and OR return
+#              it when a condition is one, IFERROR tells it apart from a
+#              blank (COALESCE) and IFNA is only taken around a VLOOKUP,
+#              whose only error is #N/A.  Text compares case-insensitively,
+#              TRUE/FALSE are 1/0 and '&' prints numbers as Excel does
+#              (XL_TEXT).  Functions whose Excel semantics SQLite lacks
+#              (SEARCH, NUMBERVALUE, YEAR ...) are registered on the
+#              connection as XL_* functions.  Formulas using anything else
+#              are reported, and so are the formulas that depend on them.
+#
+#       Usage: python xlssql.py <name>_raw.txt [--table JDEDataTable]
+#                               [--db file.sqlite] [--param Name=value ...]
+# ========================================================================
+import collections
+import datetime
+import sys
+
+import structref
+from tokenizer import FunctionNode, OperatorNode, RangeNode, get_ast
+from tsort import levels as tsort_levels
+
+
+class SqlError(Exception):
+	pass
+
+
+def quote(name):
+	return '"' + name.replace('"', '""') + '"'
+
+
+def _text(value):
+	return "'" + value.replace("'", "''") + "'"
+
+
+# ------------------------------------------------------------------------
+# Excel functions registered on the connection (None is an Excel error)
+# ------------------------------------------------------------------------
+def _number(v):
+	if isinstance(v, (int, float)):
+		return v
+	if v is None:
+		return None
+	try:
+		return float(v.strip()) if v.strip() else 0
+	except ValueError:
+		return None
+
+
+def _result(v):
+	# integral floats as integers, so that they concatenate as Excel prints them
+	return int(v) if isinstance(v, float) and v.is_integer() and abs(v) < 1e15 else v
+
+
+def xl_text(v):
+	# number -> text as Excel concatenates it (15 significant digits, no trailing .0)
+	if isinstance(v, float):
+		return '{0:.15g}'.format(v)
+	return v if v is None else str(v)
+
+
+def xl_numbervalue(v):
+	return _result(_number(v))
+
+
+def xl_search(find, within, start=1):
+	if find is None or within is None or start is None or start < 1:
+		return None
+	i = str(within).lower().find(str(find).lower(), int(start) - 1)
+	return i + 1 if i >= 0 else None
+
+
+def _date(v):
+	# Excel serial number or ISO text -> date
+	if isinstance(v, (int, float)):
+		return datetime.date(1899, 12, 30) + datetime.timedelta(days=int(v)) if v >= 0 else None
+	if not v:
+		return None
+	try:
+		return datetime.date(int(v[0:4]), int(v[5:7]), int(v[8:10]))
+	except ValueError:
+		return None
+
+
+def xl_year(v):
+	d = _date(v)
+	return d and d.year
+
+
+def xl_month(v):
+	d = _date(v)
+	return d and d.month
+
+
+def xl_trim(v):
+	return None if v is None else ' '.join(w for w in str(v).split(' ') if w)
+
+
+def xl_round(v, digits):
+	v = _number(v)
+	if v is None or digits is None:
+		return None
+	scale = 10.0 ** int(digits)
+	return _result((int(abs(v) * scale + 0.5) / scale) * (1 if v >= 0 else -1))
+
+
+def xl_power(a, b):
+	a, b = _number(a), _number(b)
+	try:
+		return None if a is None or b is None else _result(float(a) ** b)
+	except (ZeroDivisionError, OverflowError, ValueError):
+		return None
+
+
+FUNCTIONS = {
+	'XL_TEXT': (xl_text, 1),
+	'XL_NUMBERVALUE': (xl_numbervalue, 1),
+	'XL_SEARCH': (xl_search, -1),
+	'XL_YEAR': (xl_year, 1),
+	'XL_MONTH': (xl_month, 1),
+	'XL_TRIM': (xl_trim, 1),
+	'XL_ROUND': (xl_round, 2),
+	'XL_POWER': (xl_power, 2),
+}
+
+# Excel function -> (XL_* function, min args, max args)
+_SCALAR = {
+	'NUMBERVALUE': ('XL_NUMBERVALUE', 1, 1),
+	'VALUE': ('XL_NUMBERVALUE', 1, 1),
+	'SEARCH': ('XL_SEARCH', 2, 3),
+	'YEAR': ('XL_YEAR', 1, 1),
+	'MONTH': ('XL_MONTH', 1, 1),
+	'TRIM': ('XL_TRIM', 1, 1),
+	'ROUND': ('XL_ROUND', 2, 2),
+}
+
+_AGGREGATES = {
+	'SUMIF': 'SUM', 'SUMIFS': 'SUM',
+	'COUNTIF': 'COUNT', 'COUNTIFS': 'COUNT',
+	'AVERAGEIF': 'AVG', 'AVERAGEIFS': 'AVG',
+}
+
+_COMPARISONS = ('=', '<>', '<', '>', '<=', '>=')
+
+
+def register(conn):
+	for name, (function, nargs) in FUNCTIONS.items():
+		conn.create_function(name, nargs, function)
+
+
+def schema_of(conn):
+	# table -> column names, in order, of every table of the database
+	o = {}
+	for (table,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'"):
+		o[table] = [row[1] for row in conn.execute('PRAGMA table_info({0})'.format(quote(table)))]
+	return o
+
+
+# ========================================================================
+#       Class: Aggregate
+# Description: One pre-aggregated GROUP BY table
+#
+#  Attributes:     name - Temporary table name
+#              function - SUM, COUNT or AVG
+#                 value - Aggregated column (None for COUNT)
+#                  keys - Columns grouped by (criteria taken from the row)
+#               filters - (column, constant SQL) criteria
+# ========================================================================
+Aggregate = collections.namedtuple('Aggregate', 'name function value keys filters')
+
+
+# ========================================================================
+#       Class: Level
+# Description: Calculated columns evaluated by one UPDATE
+#
+#  Attributes:    columns - Column names, in formula order
+#                 results - SQL expression of each column
+#              aggregates - Aggregate tables built before the UPDATE
+#                 lookups - (table, column) indexed for VLOOKUP
+# ========================================================================
+Level = collections.namedtuple('Level', 'columns results aggregates lookups')
+
+
+# ========================================================================
+#       Class: SqlCompiler
+# Description: Compiles the calculated columns of one table to SQL
+#
+#  Attributes:  table - The table the formulas belong to
+#              schema - Table -> column names (VLOOKUP tables, checks)
+#              params - Named ranges used, become :name parameters
+#
+#     Methods: String - expression(node) - SQL of a formula subtree
+#              Plan   - compile(formulas) - Levels and rejected columns
+# ========================================================================
+class SqlCompiler:
+	def __init__(self, table, schema=None):
+		self.table = table
+		self.schema = dict((k.lower(), v) for k, v in (schema or {}).items())
+		self.params = []
+		self._known = set(c.lower() for c in self.schema.get(table.lower(), ()))
+		self._aggregates = collections.OrderedDict()
+		self._used = []
+		self._lookups = []
+		self._uses = []
+		self._calculated = set()
+		self._formula_columns = []
+
+	# --------------------------------------------------------------------
+	# References
+	# --------------------------------------------------------------------
+	def _own(self, node):
+		# StructRef of one column of the formula's own table, or None
+		if not isinstance(node, RangeNode):
+			return None
+		ref = structref.parse(node.token.tvalue)
+		if ref is None or ref.first is None or ref.first != ref.last:
+			return None
+		if ref.table and ref.table.lower() != self.table.lower():
+			return None
+		return ref
+
+	def _column(self, name):
+		if self._known and name.lower() not in self._known:
+			raise SqlError('unknown column [{0}]'.format(name))
+		self._uses.append(name)
+		column = quote(self.table) + '.' + quote(name)
+		# NULL in a calculated column is an error, in a data column a blank cell
+		return column if name.lower() in self._calculated else "IFNULL({0}, '')".format(column)
+
+	def _reference(self, node):
+		text = node.token.tvalue
+		ref = self._own(node)
+		if ref is not None and ref.specifiers in ((), (structref.THIS_ROW,)):
+			# [Col] in a calculated column is the implicit intersection with this row
+			return self._column(ref.first)
+		if structref.parse(text) is None and text.replace('_', '').replace('.', '').isalnum() and not _is_a1(text):
+			if text not in self.params:
+				self.params.append(text)
+			return ':' + text
+		raise SqlError('unsupported reference ' + text)
+
+	def _range(self, node):
+		# Column of a whole-column range argument (SUMIF ranges)
+		ref = self._own(node)
+		if ref is None or ref.this_row or ref.specifiers not in ((), ('#Data',)):
+			raise SqlError('unsupported range ' + node.emit())
+		self._uses.append(ref.first)
+		return ref.first
+
+	# --------------------------------------------------------------------
+	# Expressions
+	# --------------------------------------------------------------------
+	def expression(self, node):
+		t = node.token
+		if isinstance(node, RangeNode):
+			return self._reference(node)
+		if isinstance(node, FunctionNode):
+			return self._function(node)
+		if isinstance(node, OperatorNode):
+			return self._operator(node)
+		if t.tsubtype == 'number':
+			return t.tvalue
+		if t.tsubtype == 'text':
+			return _text(t.tvalue)
+		if t.tsubtype == 'logical':
+			return '1' if t.tvalue.upper() == 'TRUE' else '0'
+		if t.tsubtype == 'error':
+			return 'NULL'
+		raise SqlError('unsupported operand ' + node.emit())
+
+	def _operator(self, node):
+		t = node.token
+		args = [self.expression(a) for a in node.args]
+		if t.ttype == 'operator-prefix':
+			return '(-{0})'.format(args[0]) if t.tvalue == '-' else args[0]
+		if t.ttype == 'operator-postfix':
+			return '({0} / 100.0)'.format(args[0])
+		op = t.tvalue
+		if op in ('+', '-', '*'):
+			return '({0} {1} {2})'.format(args[0], op, args[1])
+		if op == '/':
+			return '({0} * 1.0 / {1})'.format(*args)
+		if op == '^':
+			return 'XL_POWER({0}, {1})'.format(*args)
+		if op == '&':
+			return '({0} || {1})'.format(*[s if _is_text(a) else 'XL_TEXT({0})'.format(s) for a, s in zip(node.args, args)])
+		if op in _COMPARISONS:
+			return '({0} {1} {2} COLLATE NOCASE)'.format(args[0], op, args[1])
+		raise SqlError('unsupported operator ' + op)
+
+	def _function(self, node):
+		name = node.token.tvalue.upper()
+		args = node.args
+		n = len(args)
+
+		if name == 'IF' and 2 <= n <= 3:
+			whens = []
+			while True:
+				# an error condition is the error of the IF, not its FALSE branch
+				condition = self.expression(args[0])
+				whens.append('WHEN {0} IS NULL THEN NULL WHEN {0} THEN {1}'.format(condition, self.expression(args[1])))
+				if len(args) < 3:
+					other = '0'
+					break
+				if not (isinstance(args[2], FunctionNode) and args[2].token.tvalue.upper() == 'IF' and 2 <= len(args[2].args) <= 3):
+					other = self.expression(args[2])
+					break
+				args = args[2].args
+			return 'CASE {0} ELSE {1} END'.format(' '.join(whens), other)
+		if name == 'IFERROR' and n == 2 or name == 'IFNA' and n == 2 and _is_call(args[0], 'VLOOKUP'):
+			return 'COALESCE({0}, {1})'.format(self.expression(args[0]), self.expression(args[1]))
+		if name in ('AND', 'OR') and n >= 1:
+			# Excel evaluates every argument: any error is the result, whatever the others
+			conditions = [self.expression(a) for a in args]
+			return '(CASE WHEN {0} THEN NULL ELSE ({1}) END)'.format(
+				' OR '.join(c + ' IS NULL' for c in conditions), (' ' + name + ' ').join(conditions))
+		if name == 'NOT' and n == 1:
+			return '(NOT {0})'.format(self.expression(args[0]))
+		if name in ('LEFT', 'RIGHT') and 1 <= n <= 2:
+			s = self.expression(args[0])
+			count = self.expression(args[1]) if n == 2 else '1'
+			if name == 'LEFT':
+				return 'substr({0}, 1, {1})'.format(s, count)
+			return 'substr({0}, max(length({0}) - {1} + 1, 1))'.format(s, count)
+		if name == 'MID' and n == 3:
+			return 'substr({0}, {1}, {2})'.format(*[self.expression(a) for a in args])
+		if name in ('LEN', 'UPPER', 'LOWER', 'ABS') and n == 1:
+			return '{0}({1})'.format('length' if name == 'LEN' else name.lower(), self.expression(args[0]))
+		if name in _SCALAR and _SCALAR[name][1] <= n <= _SCALAR[name][2]:
+			return '{0}({1})'.format(_SCALAR[name][0], ', '.join(self.expression(a) for a in args))
+		if name in _AGGREGATES:
+			return self._aggregate(name, args)
+		if name == 'VLOOKUP' and n == 4 and args[3].emit().upper() in ('FALSE', '0'):
+			return self._vlookup(args)
+		raise SqlError('unsupported function ' + name)
+
+	def _aggregate(self, name, args):
+		if name in ('COUNTIF', 'COUNTIFS'):
+			value, pairs = None, args
+		elif name.endswith('S'):
+			value, pairs = self._range(args[0]), args[1:]
+		else:
+			value, pairs = self._range(args[2] if len(args) > 2 else args[0]), args[:2]
+		if not pairs or len(pairs) % 2:
+			raise SqlError('bad arguments to ' + name)
+
+		keys, filters, criteria = [], [], []
+		for i in range(0, len(pairs), 2):
+			column, criterion = self._range(pairs[i]), pairs[i + 1]
+			t = criterion.token
+			if t.ttype == 'operand' and t.tsubtype in ('number', 'text', 'logical'):
+				if t.tsubtype == 'text' and (t.tvalue[:1] in '<>=' or '*' in t.tvalue or '?' in t.tvalue):
+					raise SqlError('unsupported criteria ' + criterion.emit())
+				filters.append((column, self.expression(criterion)))
+			else:
+				keys.append(column)
+				criteria.append(self.expression(criterion))
+
+		signature = (_AGGREGATES[name], value and value.lower(), tuple(k.lower() for k in keys), tuple((c.lower(), v) for c, v in filters))
+		aggregate = self._aggregates.get(signature)
+		if aggregate is None:
+			aggregate = Aggregate('_agg{0}'.format(len(self._aggregates) + 1), _AGGREGATES[name], value, tuple(keys), tuple(filters))
+			self._aggregates[signature] = aggregate
+		if aggregate not in self._used:
+			self._used.append(aggregate)
+
+		where = ' AND '.join('k{0} = {1}'.format(i, c) for i, c in enumerate(criteria)) or '1'
+		lookup = '(SELECT total FROM temp.{0} WHERE {1})'.format(quote(aggregate.name), where)
+		return lookup if aggregate.function == 'AVG' else 'COALESCE({0}, 0)'.format(lookup)
+
+	def _vlookup(self, args):
+		ref = structref.parse(args[1].token.tvalue) if isinstance(args[1], RangeNode) else None
+		if ref is None or ref.first is None or not ref.table:
+			raise SqlError('unsupported VLOOKUP table ' + args[1].emit())
+		columns = self.schema.get(ref.table.lower())
+		own = ref.table.lower() == self.table.lower()
+		if own:
+			# calculated columns the schema does not hold yet come after the others
+			known = set(c.lower() for c in columns or ())
+			columns = list(columns or ()) + [c for c in self._formula_columns if c.lower() not in known]
+		if columns is None:
+			raise SqlError('unknown table ' + ref.table)
+		lower = [c.lower() for c in columns]
+		if ref.first.lower() not in lower or not args[2].emit().isdigit():
+			raise SqlError('unsupported VLOOKUP ' + args[1].emit())
+		first = lower.index(ref.first.lower())
+		index = first + int(args[2].emit()) - 1
+		if index >= len(columns):
+			raise SqlError('VLOOKUP column out of range ' + args[1].emit())
+
+		if own:
+			# a lookup into the table itself reads its columns: computed after the calculated ones
+			self._uses.extend(columns[first:index + 1])
+		if (ref.table, columns[first]) not in self._lookups:
+			self._lookups.append((ref.table, columns[first]))
+		# NULL in a calculated column is an error, in a data column a blank cell
+		# aliased: in a lookup into the table itself "T"."Key" must still be the outer row
+		value = 'l.' + quote(columns[index])
+		if not (own and lower[index] in self._calculated):
+			value = "IFNULL({0}, '')".format(value)
+		return "(SELECT {0} FROM {1} AS l WHERE l.{2} = {3} COLLATE NOCASE ORDER BY l.rowid LIMIT 1)".format(
+			value, quote(ref.table), quote(columns[first]), self.expression(args[0]))
+
+	# --------------------------------------------------------------------
+	# Whole table
+	# --------------------------------------------------------------------
+	def compile(self, formulas):
+		# formulas: iterable of (column, body) -> Plan
+		# bodies without a leading '=' are data, not calculated columns
+		formulas = [(name, body) for name, body in formulas if body.lstrip().startswith('=') and body.lstrip(' =').strip()]
+		calculated = dict((name.lower(), name) for name, body in formulas)
+		self._calculated = set(calculated)
+		self._formula_columns = [name for name, body in formulas]
+		if self._known:
+			self._known |= set(calculated)
+
+		compiled = collections.OrderedDict()
+		rejected = collections.OrderedDict()
+		deps = {}
+		for name, body in formulas:
+			self._used = []
+			self._lookups = []
+			self._uses = []
+			try:
+				sql = self.expression(get_ast(body))
+			except SqlError as e:
+				rejected[name] = str(e)
+				sql = None
+			uses = set(calculated[u.lower()] for u in self._uses if u.lower() in calculated)
+			deps[name] = uses
+			if sql is not None:
+				compiled[name] = (sql, self._used, self._lookups)
+
+		# a column computed from a rejected one cannot be computed either
+		changed = True
+		while changed:
+			changed = False
+			for name in list(compiled):
+				missing = sorted(d for d in deps[name] if d in rejected and d != name)
+				if missing:
+					rejected[name] = 'depends on ' + ', '.join(missing)
+					del compiled[name]
+					changed = True
+
+		order = dict((name, i) for i, name in enumerate(compiled))
+		levels = []
+		built = set()
+		for group in tsort_levels(dict((name, set(d for d in deps[name] if d in order)) for name in compiled)):
+			columns = sorted(group, key=lambda c: order[c])
+			aggregates, lookups = [], []
+			for c in columns:
+				# an aggregate is built once, by the first level reading it: its columns are final by then
+				aggregates.extend(a for a in compiled[c][1] if a.name not in built and a not in aggregates)
+				lookups.extend(l for l in compiled[c][2] if l not in lookups)
+			built.update(a.name for a in aggregates)
+			levels.append(Level(columns, [compiled[c][0] for c in columns], aggregates, lookups))
+		return Plan(self.table, levels, rejected, list(self.params))
+
+
+# ========================================================================
+#       Class: Plan
+# Description: Compiled recalculation of one table
+#
+#  Attributes:    table - Table updated
+#                levels - Level list, in evaluation order
+#              rejected - Column -> reason it could not be compiled
+#                params - Named ranges to bind
+#
+#     Methods: List   - statements(existing) - SQL of the whole run
+#              String - script() - The statements as one SQL text
+#              None   - run(conn, params) - Recalculate the table
+# ========================================================================
+class Plan:
+	def __init__(self, table, levels, rejected, params):
+		self.table = table
+		self.levels = levels
+		self.rejected = rejected
+		self.params = params
+
+	def statements(self, existing=()):
+		# existing: columns already in the table (not added again)
+		existing = set(c.lower() for c in existing)
+		t = quote(self.table)
+		o = []
+		for i, level in enumerate(self.levels):
+			o.append('-- level {0}: {1}'.format(i + 1, ', '.join(level.columns)))
+			for table, column in level.lookups:
+				o.append('CREATE INDEX IF NOT EXISTS {0} ON {1} ({2} COLLATE NOCASE)'.format(
+					quote('_xl_{0}_{1}'.format(table, column)), quote(table), quote(column)))
+			for a in level.aggregates:
+				keys = ['k{0}'.format(k) for k in range(len(a.keys))]
+				o.append('DROP TABLE IF EXISTS temp.{0}'.format(quote(a.name)))
+				o.append('CREATE TEMP TABLE {0} ({1})'.format(quote(a.name),
+					', '.join([k + ' COLLATE NOCASE' for k in keys] + ['total'] + (['PRIMARY KEY ({0})'.format(', '.join(keys))] if keys else []))))
+				where = ' AND '.join('{0} = {1} COLLATE NOCASE'.format(quote(c), v) for c, v in a.filters)
+				o.append('INSERT INTO temp.{0} SELECT {1} FROM {2}{3}{4}'.format(
+					quote(a.name),
+					', '.join(['{0} COLLATE NOCASE'.format(quote(k)) for k in a.keys] + ['COUNT(*)' if a.value is None else '{0}({1})'.format(a.function, quote(a.value))]),
+					t,
+					' WHERE ' + where if where else '',
+					' GROUP BY ' + ', '.join(str(k + 1) for k in range(len(a.keys))) if a.keys else ''))
+			for column in level.columns:
+				if column.lower() not in existing:
+					o.append('ALTER TABLE {0} ADD COLUMN {1}'.format(t, quote(column)))
+			o.append('UPDATE {0} SET {1}'.format(t, ', '.join('{0} = {1}'.format(quote(c), r) for c, r in zip(level.columns, level.results))))
+		return o
+
+	def script(self):
+		return ''.join(s + ('\n' if s.startswith('--') else ';\n') for s in self.statements())
+
+	def run(self, conn, params=None):
+		register(conn)
+		existing = schema_of(conn).get(self.table, [])
+		params = dict(params or {})
+		missing = [p for p in self.params if p not in params]
+		if missing:
+			raise SqlError('no value for ' + ', '.join(missing))
+		with conn:
+			for s in self.statements(existing):
+				if not s.startswith('--'):
+					conn.execute(s, dict((p, params[p]) for p in self.params if ':' + p in s))
+
+
+def _is_text(node):
+	# text constant or concatenation: needs no XL_TEXT
+	t = node.token
+	return t.ttype == 'operand' and t.tsubtype == 'text' or isinstance(node, OperatorNode) and t.tvalue == '&' and len(node.args) == 2
+
+
+def _is_call(node, name):
+	return isinstance(node, FunctionNode) and node.token.tvalue.upper() == name
+
+
+def _is_a1(text):
+	# A1 style cell reference (named ranges are never one)
+	letters = text.rstrip('0123456789')
+	return letters != text and letters.isalpha() and len(letters) <= 3
+
+
+def compile_table(formulas, table, schema=None):
+	return SqlCompiler(table, schema).compile(formulas)
+
+
+########################################################################################################################
+
+if __name__ == '__main__':
+
+	import sqlite3
+
+	from specialize import parse_value
+	from xlsfiles import read_raw
+
+	args = sys.argv[1:]
+
+	def option(flag, default):
+		if flag in args:
+			i = args.index(flag)
+			value = args[i + 1]
+			del args[i:i + 2]
+			return value
+		return default
+
+	table = option('--table', 'JDEDataTable')
+	db = option('--db', None)
+	params = {}
+	while '--param' in args:
+		k, v = option('--param', None).split('=', 1)
+		params[k] = parse_value(v)
+
+	if not args:
+		print('usage: python xlssql.py <name>_raw.txt [--table JDEDataTable] [--db file.sqlite] [--param Name=value ...]')
+		sys.exit(2)
+
+	conn = sqlite3.connect(db) if db else None
+	with open(args[0], 'r') as ff:
+		plan = compile_table(read_raw(ff), table, schema_of(conn) if conn else None)
+
+	for name, reason in plan.rejected.items():
+		sys.stderr.write('not compiled: {0}: {1}\n'.format(name, reason))
+	if conn is None:
+		sys.stdout.write(plan.script())
+	else:
+		plan.run(conn, params)
+		print('{0} columns of {1} recalculated in {2} levels'.format(sum(len(l.columns) for l in plan.levels), table, len(plan.levels)))
@@ -0,0 +1,193 @@
+# ========================================================================
+# Description: Opt-in hot-path instrumentation of XlsParser
+#
+#              enable() installs a ParserStats collector on XlsParser;
+#              each phase (scan, cleanup, fixup, parse, tidy) then adds
+#              its wall and CPU time and the number of tokens it
+#              emitted. disable() removes it again: the parser only
+#              tests XlsParser.stats for None at phase boundaries.
+#
+#              ParserStats(memory=True) also counts the bytes each
+#              phase allocates, through tracemalloc: the net bytes it
+#              leaves allocated and the peak it reaches above its
+#              start. Tracing slows the parser several times over, so
+#              it is off by default.
+#
+#       Usage: stats = xlsstats.enable()
+#              stats = xlsstats.enable(xlsstats.ParserStats(memory=True))
+#              ... batch run ...
+#              stats.write_json('stats.json')
+#              stats.write_prometheus('tidyxls.prom')
+# ========================================================================
+import heapq
+import json
+import os
+import time
+import tracemalloc
+
+from tokenizer import XlsParser
+
+PHASES = ('scan', 'cleanup', 'fixup', 'parse', 'tidy')
+
+
+# ========================================================================
+#       Class: ParserStats
+# Description: Accumulated counters of an instrumented batch run
+#
+#  Attributes:    wall  - phase -> wall-clock seconds
+#                  cpu  - phase -> process CPU seconds
+#                 calls - phase -> number of times the phase ran
+#               tokens  - phase -> tokens emitted by the phase
+#                alloc  - phase -> net bytes allocated (memory=True)
+#           alloc_peak  - phase -> highest peak above the phase start (memory=True)
+#              formulas - number of formulas parsed
+#               largest - the `top` longest formulas  (length, formula)
+#               slowest - the `top` slowest formulas (seconds, formula)
+#
+#     Methods: Tuple       - mark()  - Current clocks (and traced bytes)
+#              Tuple       - lap(phase, mark, tokens) - Charge a phase since mark
+#              None        - formula(text, start) - Record one parsed formula
+#              Dict        - as_dict()
+#              String      - to_json() / to_prometheus()
+# ========================================================================
+class ParserStats:
+	def __init__(self, top=10, excerpt=120, memory=False):
+		self.top = top
+		self.excerpt = excerpt
+		self.memory = memory
+		self._tracing = False
+		self.reset()
+
+	def reset(self):
+		self.wall = dict.fromkeys(PHASES, 0.0)
+		self.cpu = dict.fromkeys(PHASES, 0.0)
+		self.calls = dict.fromkeys(PHASES, 0)
+		self.tokens = dict.fromkeys(PHASES, 0)
+		self.alloc = dict.fromkeys(PHASES, 0)
+		self.alloc_peak = dict.fromkeys(PHASES, 0)
+		self.formulas = 0
+		self.chars = 0
+		self._largest = []
+		self._slowest = []
+
+	def mark(self):
+		if not self.memory:
+			return time.perf_counter(), time.process_time()
+		# the peak is measured from here on
+		tracemalloc.reset_peak()
+		return time.perf_counter(), time.process_time(), tracemalloc.get_traced_memory()[0]
+
+	def lap(self, phase, mark, tokens=0):
+		wall, cpu = time.perf_counter(), time.process_time()
+		self.wall[phase] += wall - mark[0]
+		self.cpu[phase] += cpu - mark[1]
+		self.calls[phase] += 1
+		self.tokens[phase] += tokens
+		if not self.memory:
+			return wall, cpu
+		current, peak = tracemalloc.get_traced_memory()
+		self.alloc[phase] += current - mark[2]
+		self.alloc_peak[phase] = max(self.alloc_peak[phase], peak - mark[2])
+		tracemalloc.reset_peak()
+		return wall, cpu, current
+
+	def formula(self, text, start):
+		elapsed = time.perf_counter() - start[0]
+		self.formulas += 1
+		self.chars += len(text)
+		self._keep(self._largest, (len(text), text[:self.excerpt]))
+		self._keep(self._slowest, (elapsed, text[:self.excerpt]))
+
+	def _keep(self, heap, item):
+		# min-heap of the `top` biggest items seen so far
+		if len(heap) < self.top:
+			heapq.heappush(heap, item)
+		elif item > heap[0]:
+			heapq.heapreplace(heap, item)
+
+	@property
+	def largest(self):
+		return sorted(self._largest, reverse=True)
+
+	@property
+	def slowest(self):
+		return sorted(self._slowest, reverse=True)
+
+	def as_dict(self):
+		phases = {
+			p: {'wall_seconds': self.wall[p], 'cpu_seconds': self.cpu[p], 'calls': self.calls[p], 'tokens': self.tokens[p]}
+			for p in PHASES
+		}
+		if self.memory:
+			for p in PHASES:
+				phases[p].update(alloc_bytes=self.alloc[p], alloc_peak_bytes=self.alloc_peak[p])
+		return {
+			'formulas': self.formulas,
+			'chars': self.chars,
+			'phases': phases,
+			'largest': [{'length': n, 'formula': f} for n, f in self.largest],
+			'slowest': [{'seconds': s, 'formula': f} for s, f in self.slowest],
+		}
+
+	def to_json(self, indent=2):
+		return json.dumps(self.as_dict(), indent=indent)
+
+	def to_prometheus(self, prefix='tidyxls'):
+		def metric(name, kind, help_text, samples):
+			lines.append('# HELP {0}_{1} {2}'.format(prefix, name, help_text))
+			lines.append('# TYPE {0}_{1} {2}'.format(prefix, name, kind))
+			for labels, value in samples:
+				lines.append('{0}_{1}{2} {3!r}'.format(prefix, name, labels, value))
+
+		lines = []
+		metric('formulas_total', 'counter', 'Formulas parsed.', [('', self.formulas)])
+		metric('formula_chars_total', 'counter', 'Characters of formula text parsed.', [('', self.chars)])
+		metric('phase_seconds_total', 'counter', 'Time spent per parser phase.',
+			[('{{phase="{0}",clock="wall"}}'.format(p), self.wall[p]) for p in PHASES]
+			+ [('{{phase="{0}",clock="cpu"}}'.format(p), self.cpu[p]) for p in PHASES])
+		metric('phase_calls_total', 'counter', 'Executions per parser phase.',
+			[('{{phase="{0}"}}'.format(p), self.calls[p]) for p in PHASES])
+		metric('phase_tokens_total', 'counter', 'Tokens emitted per parser phase.',
+			[('{{phase="{0}"}}'.format(p), self.tokens[p]) for p in PHASES])
+		if self.memory:
+			metric('phase_alloc_bytes_total', 'counter', 'Net bytes allocated per parser phase.',
+				[('{{phase="{0}"}}'.format(p), self.alloc[p]) for p in PHASES])
+			metric('phase_alloc_peak_bytes', 'gauge', 'Highest allocation peak of a parser phase.',
+				[('{{phase="{0}"}}'.format(p), self.alloc_peak[p]) for p in PHASES])
+		metric('formula_max_chars', 'gauge', 'Length of the largest formula seen.',
+			[('', self.largest[0][0] if self._largest else 0)])
+		metric('formula_max_seconds', 'gauge', 'Parse time of the slowest formula seen.',
+			[('', self.slowest[0][0] if self._slowest else 0.0)])
+		return '\n'.join(lines) + '\n'
+
+	def write_json(self, filename):
+		_write_atomic(filename, self.to_json() + '\n')
+
+	def write_prometheus(self, filename):
+		# for the node_exporter textfile collector, which must never see a half-written file
+		_write_atomic(filename, self.to_prometheus())
+
+
+def _write_atomic(filename, text):
+	tmp = filename + '.tmp'
+	with open(tmp, 'w') as ff:
+		ff.write(text)
+	os.replace(tmp, filename)
+
+
+def enable(stats=None):
+	XlsParser.stats = stats if stats is not None else ParserStats()
+	if XlsParser.stats.memory and not tracemalloc.is_tracing():
+		tracemalloc.start()
+		XlsParser.stats._tracing = True
+	return XlsParser.stats
+
+
+def disable():
+	stats = XlsParser.stats
+	XlsParser.stats = None
+	if stats is not None and stats._tracing:
+		# only stop the tracing enable() started
+		tracemalloc.stop()
+		stats._tracing = False
+	return stats
@@ -0,0 +1,242 @@
+# ========================================================================
+# Description: Long-running worker for the TydyXls.xlsm macro
+#
+#              Keeps the parser loaded and the most recent results in an
+#              LRU, so a single formula is answered without a new Python
+#              process.
+#
+#    Protocol: one JSON object per line (UTF-8, '\n' terminated) in each
+#              direction; every request gets exactly one response line,
+#              in order.
+#
+#              request  {"id": 1, "op": "tidy", "formula": "=IF(...)", "layout": "classic"}
+#              response {"id": 1, "ok": true, "result": "IF(\n\t..."}
+#                       {"id": 1, "ok": false, "error": "..."}
+#
+#              op: tidy     - xlstidy() text (layout optional, default classic)
+#                  compact  - single-line formula (also accepts a tidy text)
+#                  deps     - list of the references of the formula
+#                  check    - list of diagnostics [kind, offset, text, context]
+#                  ping     - "pong"
+#                  stats    - cache counters
+#                  quit     - "bye", then the worker stops
+#
+#       Usage: python xlsworker.py [--cache N]                  (stdin/stdout, N=0: no cache)
+#              python xlsworker.py --port N [--cache N]         (127.0.0.1:N)
+#              python xlsworker.py --unix PATH [--cache N]      (Unix socket)
+#              python xlsworker.py --client <name>_raw.txt      (test client)
+# ========================================================================
+import collections
+import json
+import sys
+
+from tokenizer import XlsParser, untidy
+
+DEFAULT_CACHE = 1024
+
+
+# ========================================================================
+#       Class: Worker
+# Description: Request dispatcher with an LRU of recent results
+#
+#  Attributes: maxsize - Entries kept in the LRU
+#                 hits - Requests answered from the LRU
+#               misses - Requests computed
+#
+#     Methods: Dict   - handle(request) - Response of one decoded request
+#              String - handle_line(line) - Response line of a request line
+# ========================================================================
+class Worker:
+	def __init__(self, maxsize=DEFAULT_CACHE):
+		self.maxsize = maxsize
+		self.hits = 0
+		self.misses = 0
+		self.running = True
+		self._cache = collections.OrderedDict()
+
+	def _cached(self, key, compute):
+		try:
+			value = self._cache.pop(key)
+			self.hits += 1
+		except KeyError:
+			value = compute()
+			self.misses += 1
+			if self.maxsize <= 0:
+				# --cache 0: nothing is kept
+				return value
+			while len(self._cache) >= self.maxsize:
+				self._cache.popitem(last=False)
+		self._cache[key] = value
+		return value
+
+	def _tidy(self, formula, layout):
+		return XlsParser(formula).xlstidy(layout)
+
+	def _deps(self, formula):
+		return XlsParser(formula).dependencies()
+
+	def _check(self, formula):
+		return [[d.kind, d.offset, d.text, list(d.context)] for d in XlsParser(formula).diagnostics]
+
+	def handle(self, request):
+		rid = request.get('id')
+		op = request.get('op')
+		formula = request.get('formula', '')
+		try:
+			if op == 'tidy':
+				layout = request.get('layout', 'classic')
+				result = self._cached(('tidy', layout, formula), lambda: self._tidy(formula, layout))
+			elif op == 'compact':
+				result = self._cached(('compact', formula), lambda: untidy(formula))
+			elif op == 'deps':
+				result = self._cached(('deps', formula), lambda: self._deps(formula))
+			elif op == 'check':
+				result = self._cached(('check', formula), lambda: self._check(formula))
+			elif op == 'ping':
+				result = 'pong'
+			elif op == 'stats':
+				result = {'hits': self.hits, 'misses': self.misses, 'size': len(self._cache), 'maxsize': self.maxsize}
+			elif op == 'quit':
+				self.running = False
+				result = 'bye'
+			else:
+				return {'id': rid, 'ok': False, 'error': 'unknown op {0!r}'.format(op)}
+		except Exception as e:
+			return {'id': rid, 'ok': False, 'error': '{0}: {1}'.format(e.__class__.__name__, e)}
+		return {'id': rid, 'ok': True, 'result': result}
+
+	def handle_line(self, line):
+		# line: str, or bytes that must be UTF-8 (UnicodeDecodeError is a ValueError: a bad request)
+		try:
+			if isinstance(line, bytes):
+				line = line.decode('utf-8')
+			request = json.loads(line)
+			if not isinstance(request, dict):
+				raise ValueError('request must be a JSON object')
+		except ValueError as e:
+			response = {'id': None, 'ok': False, 'error': 'bad request: {0}'.format(e)}
+		else:
+			response = self.handle(request)
+		return json.dumps(response) + '\n'
+
+
+def serve_stream(worker, rfile, wfile):
+	# Answer request lines of a binary stream until EOF or quit
+	for line in rfile:
+		if not line.strip():
+			continue
+		wfile.write(worker.handle_line(line).encode('utf-8'))
+		wfile.flush()
+		if not worker.running:
+			break
+
+
+def serve_socket(worker, port=None, path=None):
+	# One connection at a time: requests are answered in milliseconds and share the LRU
+	import socketserver
+
+	class Handler(socketserver.StreamRequestHandler):
+		def handle(self):
+			serve_stream(worker, self.rfile, self.wfile)
+
+	if path is not None:
+		server = socketserver.UnixStreamServer(path, Handler)
+	else:
+		socketserver.TCPServer.allow_reuse_address = True
+		server = socketserver.TCPServer(('127.0.0.1', port), Handler)
+	try:
+		with server:
+			while worker.running:
+				server.handle_request()
+	finally:
+		if path is not None:
+			import os
+			os.remove(path)
+
+
+# ========================================================================
+#       Class: Client
+# Description: Test client driving a worker over its stdin/stdout
+#
+#     Methods: Dict - request(op, formula, **fields)
+#              None - close()
+# ========================================================================
+class Client:
+	def __init__(self, args=()):
+		import subprocess
+		self._process = subprocess.Popen([sys.executable, __file__] + list(args),
+			stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+		self._id = 0
+
+	def request(self, op, formula='', **fields):
+		self._id += 1
+		fields.update(id=self._id, op=op, formula=formula)
+		self._process.stdin.write((json.dumps(fields) + '\n').encode('utf-8'))
+		self._process.stdin.flush()
+		response = json.loads(self._process.stdout.readline().decode('utf-8'))
+		if response.get('id') != self._id:
+			raise RuntimeError('out of order response {0!r}'.format(response))
+		return response
+
+	def close(self):
+		self.request('quit')
+		self._process.stdin.close()
+		self._process.wait()
+
+
+def run_client(raw_filename):
+	# Every formula of a RAW file through a worker, checked against the parser in-process
+	import time
+	from xlsfiles import read_raw
+
+	with open(raw_filename, 'r') as ff:
+		formulas = [body for name, body in read_raw(ff) if body]
+
+	client = Client()
+	errors = 0
+	timings = []
+	for rounds in range(2):
+		for formula in formulas:
+			start = time.perf_counter()
+			response = client.request('tidy', formula)
+			timings.append(time.perf_counter() - start)
+			if not response['ok'] or response['result'] != XlsParser(formula).xlstidy():
+				errors += 1
+	stats = client.request('stats')['result']
+	client.close()
+
+	timings.sort()
+	print('{0} requests, {1} errors, median {2:.2f} ms, max {3:.2f} ms, cache {4}'.format(
+		len(timings), errors, timings[len(timings) // 2] * 1000, timings[-1] * 1000, stats))
+	return errors
+
+
+########################################################################################################################
+
+if __name__ == '__main__':
+
+	args = sys.argv[1:]
+
+	def option(flag, default=None):
+		if flag in args:
+			i = args.index(flag)
+			value = args[i + 1]
+			del args[i:i + 2]
+			return value
+		return default
+
+	client = option('--client')
+	if client is not None:
+		sys.exit(1 if run_client(client) else 0)
+
+	cache = int(option('--cache', DEFAULT_CACHE))
+	if cache < 0:
+		print('--cache: expected 0 (no cache) or more entries, got {0}'.format(cache))
+		sys.exit(2)
+	worker = Worker(cache)
+	port = option('--port')
+	path = option('--unix')
+	if port is not None or path is not None:
+		serve_socket(worker, int(port) if port is not None else None, path)
+	else:
+		serve_stream(worker, sys.stdin.buffer, sys.stdout.buffer)